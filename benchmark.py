@@ -0,0 +1,1557 @@
+"""
+Benchmark TimeCraft against local stand-ins for Google Calendar and Groq.
+
+The Flask app runs in-process against a fake Calendar API served over HTTP on
+localhost and a fake Groq client with scripted responses, so results only
+depend on this code and the configured latencies.
+
+Usage:
+    python benchmark.py --events 2000 --latency 50 --groq-latency 300 \\
+        --requests 200 --concurrency 8 --calendars 12 --output results.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import queue
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.parser import Parser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+from urllib.request import Request, urlopen
+
+
+def select_fields(resource, fields: str):
+    """
+    Apply a partial response mask like "nextPageToken,items(id,start)".
+
+    Args:
+        resource: Response, or list of resources, to trim
+        fields: Comma separated field names, with nested masks in parentheses
+
+    Returns:
+        The resource with only the selected fields
+    """
+    if fields == "*":
+        return resource
+    if isinstance(resource, list):
+        return [select_fields(item, fields) for item in resource]
+
+    selected = {}
+    depth = 0
+    name = nested = ""
+    for char in fields + ",":
+        if char == "(" and depth == 0:
+            depth = 1
+        elif depth:
+            depth += {"(": 1, ")": -1}.get(char, 0)
+            if depth:
+                nested += char
+        elif char == ",":
+            if name in resource:
+                selected[name] = (
+                    select_fields(resource[name], nested) if nested else resource[name]
+                )
+            name = nested = ""
+        else:
+            name += char
+    return selected
+
+
+class FakeCalendar:
+    """
+    Minimal Google Calendar API v3 server for events, free/busy and batches.
+
+    It also supports watch channels, posting a notification to the channel's
+    address after every change like Google does.
+
+    With a rate limit set, calls beyond it are rejected with 429. Rejected
+    calls count against the limit too, as they do for many APIs, so clients
+    retrying too eagerly stay throttled.
+    """
+
+    RATE_LIMITED = {
+        "error": {
+            "code": 429,
+            "message": "Rate Limit Exceeded",
+            "errors": [{"domain": "usageLimits", "reason": "rateLimitExceeded"}],
+        }
+    }
+
+    def __init__(self, latency: float = 0.0, page_size: int = 2500):
+        """
+        Args:
+            latency: Seconds added to every HTTP round trip
+            page_size: Largest page returned by events().list
+        """
+        self.latency = latency
+        self.page_size = page_size
+        self.calendars = {"primary": {}}
+        self.round_trips = 0
+        # Bytes of all responses
+        self.bytes_sent = 0
+        # (sequence number, calendar ID, event ID) of every change, for sync tokens
+        self.changes = []
+        self.channels = {}
+        self.notifications = queue.Queue()
+        self.lock = threading.Lock()
+        # Calls per second, 0 for no limit
+        self.rate_limit = 0
+        self.allowance = 0.0
+        self.allowance_updated = time.monotonic()
+        self.throttled = 0
+
+    def add_event(
+        self,
+        calendar_id: str,
+        summary: str,
+        start: str,
+        end: str,
+        event_id=None,
+        ical_uid=None,
+    ) -> Dict:
+        """Store an event with naive UTC start and end times."""
+        event_id = event_id or uuid.uuid4().hex
+        now = datetime.utcnow().isoformat() + "Z"
+        # The fields Google returns for a plain event besides those the app reads
+        event = {
+            "kind": "calendar#event",
+            "etag": f'"{uuid.uuid4().int % 10**16}"',
+            "id": event_id,
+            "status": "confirmed",
+            "htmlLink": f"https://www.google.com/calendar/event?eid={event_id}",
+            "created": now,
+            "updated": now,
+            "summary": summary,
+            "creator": {"email": "user@example.com", "self": True},
+            "organizer": {"email": "user@example.com", "self": True},
+            "start": {"dateTime": start.rstrip("Z") + "Z", "timeZone": "UTC"},
+            "end": {"dateTime": end.rstrip("Z") + "Z", "timeZone": "UTC"},
+            "iCalUID": ical_uid or f"{event_id}@google.com",
+            "sequence": 0,
+            "reminders": {"useDefault": True},
+            "eventType": "default",
+        }
+        self.calendars.setdefault(calendar_id, {})[event_id] = event
+        self.changes.append((len(self.changes) + 1, calendar_id, event_id))
+        self.notify(calendar_id)
+        return event
+
+    def simulate_change(self, calendar_id: str = "primary") -> str:
+        """
+        Move an event by 30 minutes as if another client edited it.
+
+        Args:
+            calendar_id: Calendar holding the event
+
+        Returns:
+            ID of the moved event
+        """
+        with self.lock:
+            event = random.choice(
+                [
+                    event
+                    for event in self.calendars[calendar_id].values()
+                    if event["status"] != "cancelled"
+                ]
+            )
+            for bound in ("start", "end"):
+                moved = datetime.fromisoformat(
+                    event[bound]["dateTime"].rstrip("Z")
+                ) + timedelta(minutes=30)
+                event[bound] = {"dateTime": moved.isoformat() + "Z"}
+            self.changes.append((len(self.changes) + 1, calendar_id, event["id"]))
+            self.notify(calendar_id)
+        return event["id"]
+
+    def notify(self, calendar_id: str, state: str = "exists") -> None:
+        """Queue a notification for every channel watching a calendar."""
+        for channel in self.channels.values():
+            if channel["calendarId"] == calendar_id:
+                self.notifications.put((channel, state))
+
+    def watch(self, calendar_id: str, body: Dict) -> tuple:
+        channel = {
+            "id": body["id"],
+            "token": body.get("token"),
+            "address": body["address"],
+            "calendarId": calendar_id,
+            "resourceId": uuid.uuid4().hex,
+            "messages": 0,
+        }
+        self.channels[channel["id"]] = channel
+        self.notifications.put((channel, "sync"))
+        ttl = float(body.get("params", {}).get("ttl", 604800))
+        return 200, {
+            "kind": "api#channel",
+            "id": channel["id"],
+            "resourceId": channel["resourceId"],
+            "resourceUri": f"calendars/{calendar_id}/events",
+            "expiration": str(int((time.time() + ttl) * 1000)),
+        }
+
+    def close_channels(self) -> None:
+        """Stop all channels and drop the notifications not yet sent."""
+        with self.lock:
+            self.channels.clear()
+            while not self.notifications.empty():
+                self.notifications.get_nowait()
+
+    def send_notifications(self) -> None:
+        """Post queued notifications, one at a time like a single sender."""
+        while True:
+            channel, state = self.notifications.get()
+            channel["messages"] += 1
+            headers = {
+                "X-Goog-Channel-ID": channel["id"],
+                "X-Goog-Resource-ID": channel["resourceId"],
+                "X-Goog-Resource-State": state,
+                "X-Goog-Message-Number": str(channel["messages"]),
+            }
+            if channel["token"]:
+                headers["X-Goog-Channel-Token"] = channel["token"]
+            try:
+                urlopen(
+                    Request(channel["address"], data=b"", headers=headers), timeout=5
+                ).read()
+            except OSError:
+                pass
+
+    def seed(
+        self, count: int, days: int = 28, calendar_ids: List[str] = ("primary",)
+    ) -> List[str]:
+        """
+        Fill calendars with events around today.
+
+        Events are spread round-robin over the calendars. With several
+        calendars, every tenth event is also added to the next calendar as a
+        shared meeting with the same iCalUID.
+
+        Args:
+            count: Number of events
+            days: Number of days, half before and half after today
+            calendar_ids: Calendars to fill
+
+        Returns:
+            IDs of the new events in the first calendar
+        """
+        rng = random.Random(0)
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        ids = []
+        for i in range(count):
+            start = today + timedelta(
+                days=rng.randrange(-days // 2, days // 2),
+                minutes=rng.randrange(6 * 60, 21 * 60, 15),
+            )
+            end = start + timedelta(minutes=rng.choice((30, 45, 60, 90)))
+            calendar_id = calendar_ids[i % len(calendar_ids)]
+            event = self.add_event(
+                calendar_id, f"Event {i}", start.isoformat(), end.isoformat()
+            )
+            if len(calendar_ids) > 1 and i % 10 == 0:
+                self.add_event(
+                    calendar_ids[(i + 1) % len(calendar_ids)],
+                    f"Event {i}",
+                    start.isoformat(),
+                    end.isoformat(),
+                    ical_uid=event["iCalUID"],
+                )
+            if calendar_id == calendar_ids[0]:
+                ids.append(event["id"])
+        return ids
+
+    def admit(self) -> bool:
+        """Count a call against the rate limit, returning whether it is within."""
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        self.allowance = min(
+            self.allowance + (now - self.allowance_updated) * self.rate_limit,
+            self.rate_limit,
+        )
+        self.allowance_updated = now
+        admitted = self.allowance >= 1
+        # At most a second of calls is held against a client
+        self.allowance = max(self.allowance - 1, -self.rate_limit)
+        if not admitted:
+            self.throttled += 1
+        return admitted
+
+    def handle(self, method: str, path: str, query: Dict, body: Dict) -> tuple:
+        if not self.admit():
+            return 429, self.RATE_LIMITED
+        if path == "/calendar/v3/freeBusy":
+            return self.freebusy(body)
+        if path == "/calendar/v3/channels/stop":
+            self.channels.pop(body.get("id"), None)
+            return 204, None
+        match = re.match(r"/calendar/v3/calendars/([^/]+)/events(?:/([^/]+))?$", path)
+        if not match:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+        calendar_id = unquote(match.group(1))
+        event_id = match.group(2)
+        events = self.calendars.setdefault(calendar_id, {})
+        if event_id == "watch" and method == "POST":
+            return self.watch(calendar_id, body)
+        if event_id is None:
+            if method == "GET":
+                return self.list(calendar_id, query)
+            if body.get("id") in events:
+                # Deleted events keep their ID too
+                return 409, {"error": {"code": 409, "message": "Duplicate"}}
+            event = self.add_event(
+                calendar_id,
+                body.get("summary"),
+                body["start"]["dateTime"],
+                body["end"]["dateTime"],
+                body.get("id"),
+            )
+            return 200, event
+
+        if event_id not in events:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        if method == "GET":
+            return 200, events[event_id]
+        if method in ("PUT", "PATCH"):
+            events[event_id].update(body)
+            self.changes.append((len(self.changes) + 1, calendar_id, event_id))
+            self.notify(calendar_id)
+            return 200, events[event_id]
+        if method == "DELETE":
+            if events[event_id]["status"] == "cancelled":
+                return 410, {"error": {"code": 410, "message": "Deleted"}}
+            events[event_id]["status"] = "cancelled"
+            self.changes.append((len(self.changes) + 1, calendar_id, event_id))
+            self.notify(calendar_id)
+            return 204, None
+        return 400, {"error": {"code": 400, "message": "Bad Request"}}
+
+    def list(self, calendar_id: str, query: Dict) -> tuple:
+        events = self.calendars[calendar_id]
+        if query.get("syncToken"):
+            since = int(query["syncToken"])
+            changed = {
+                event_id
+                for sequence, changed_calendar, event_id in self.changes
+                if sequence > since and changed_calendar == calendar_id
+            }
+            items = [
+                events.get(event_id, {"id": event_id, "status": "cancelled"})
+                for event_id in changed
+            ]
+        else:
+            time_min = query.get("timeMin", "")
+            time_max = query.get("timeMax")
+            items = sorted(
+                (
+                    event
+                    for event in events.values()
+                    if event["status"] != "cancelled"
+                    and event["end"]["dateTime"] > time_min
+                    and (not time_max or event["start"]["dateTime"] < time_max)
+                ),
+                key=lambda event: event["start"]["dateTime"],
+            )
+
+        page_size = min(int(query.get("maxResults", 250)), self.page_size)
+        offset = int(query.get("pageToken", 0))
+        result = {
+            "kind": "calendar#events",
+            "etag": f'"{len(self.changes)}"',
+            "summary": calendar_id,
+            "updated": datetime.utcnow().isoformat() + "Z",
+            "timeZone": "UTC",
+            "accessRole": "owner",
+            "defaultReminders": [{"method": "popup", "minutes": 10}],
+            "items": items[offset : offset + page_size],
+        }
+        if offset + page_size < len(items):
+            result["nextPageToken"] = str(offset + page_size)
+        else:
+            result["nextSyncToken"] = str(len(self.changes))
+        return 200, select_fields(result, query.get("fields", "*"))
+
+    def freebusy(self, body: Dict) -> tuple:
+        calendars = {}
+        for item in body.get("items", []):
+            events = self.calendars.get(item["id"], {}).values()
+            calendars[item["id"]] = {
+                "busy": sorted(
+                    (
+                        {
+                            "start": event["start"]["dateTime"],
+                            "end": event["end"]["dateTime"],
+                        }
+                        for event in events
+                        if event["status"] != "cancelled"
+                        and event["end"]["dateTime"] > body["timeMin"]
+                        and event["start"]["dateTime"] < body["timeMax"]
+                    ),
+                    key=lambda block: block["start"],
+                )
+            }
+        return 200, {"kind": "calendar#freeBusy", "calendars": calendars}
+
+    def serve(self) -> str:
+        """
+        Start serving on a free localhost port.
+
+        Returns:
+            Root URL of the server
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, payload, content_type="application/json"):
+                if payload is None:
+                    data = b""
+                elif isinstance(payload, bytes):
+                    data = payload
+                else:
+                    data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                with fake.lock:
+                    fake.bytes_sent += len(data)
+
+            def dispatch(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                time.sleep(fake.latency)
+                url = urlparse(self.path)
+                with fake.lock:
+                    fake.round_trips += 1
+                if url.path.startswith("/batch"):
+                    return self.batch(raw)
+
+                query = {key: value[0] for key, value in parse_qs(url.query).items()}
+                with fake.lock:
+                    status, payload = fake.handle(
+                        method, url.path, query, json.loads(raw) if raw else {}
+                    )
+                self.send(status, payload)
+
+            def batch(self, raw):
+                message = Parser().parsestr(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n"
+                    + raw.decode()
+                )
+                boundary = "batch_" + uuid.uuid4().hex
+                parts = []
+                for part in message.get_payload():
+                    head, _, body = part.get_payload().partition("\r\n\r\n")
+                    if not _:
+                        head, _, body = part.get_payload().partition("\n\n")
+                    method, path, _ = head.splitlines()[0].split(" ", 2)
+                    url = urlparse(path)
+                    query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                    with fake.lock:
+                        status, payload = fake.handle(
+                            method,
+                            url.path,
+                            query,
+                            json.loads(body) if body.strip() else {},
+                        )
+                    text = "" if payload is None else json.dumps(payload)
+                    retry_after = "Retry-After: 1\r\n" if status == 429 else ""
+                    parts.append(
+                        f"--{boundary}\r\nContent-Type: application/http\r\n"
+                        f"Content-ID: <response-{part['Content-ID'][1:-1]}>\r\n\r\n"
+                        f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                        f"{retry_after}Content-Length: {len(text)}\r\n\r\n{text}\r\n"
+                    )
+                parts.append(f"--{boundary}--")
+                self.send(
+                    200,
+                    "".join(parts).encode(),
+                    f"multipart/mixed; boundary={boundary}",
+                )
+
+            def do_GET(self):
+                self.dispatch("GET")
+
+            def do_POST(self):
+                self.dispatch("POST")
+
+            def do_PUT(self):
+                self.dispatch("PUT")
+
+            def do_PATCH(self):
+                self.dispatch("PATCH")
+
+            def do_DELETE(self):
+                self.dispatch("DELETE")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.send_notifications, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+
+class FakeGroq:
+    """Stand-in for the Groq client which answers from a script."""
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Args:
+            latency: Seconds every completion takes before its first token
+        """
+        self.latency = latency
+        self.calls = 0
+        # perf_counter() when the latest completion was requested
+        self.called_at = None
+        # Function of the create() parameters returning the response content
+        self.script: Callable[[Dict], str] = lambda params: "{}"
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **params):
+        self.calls += 1
+        self.called_at = time.perf_counter()
+        time.sleep(self.latency)
+        content = self.script(params)
+        if params.get("stream"):
+            return iter(
+                SimpleNamespace(
+                    choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))]
+                )
+                for piece in re.findall(r".{1,8}", content, re.S)
+            )
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(
+                prompt_tokens=sum(len(m["content"]) for m in params["messages"]) // 4,
+                completion_tokens=len(content) // 4,
+            ),
+        )
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    """Summarize the latencies of one workload, in milliseconds."""
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def run_workload(
+    app, credentials: Dict, requests: int, concurrency: int, step: Callable
+) -> Dict:
+    """
+    Drive the app with concurrent clients, each with its own session.
+
+    Args:
+        app: Flask app
+        credentials: Session credentials of every client
+        requests: Total number of measured requests
+        concurrency: Number of clients
+        step: Function of (client, iteration) making one request and
+            returning its response
+
+    Returns:
+        Summary of the workload
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def client_loop(client_number):
+        nonlocal errors
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["credentials"] = credentials
+        # The first page load syncs the client's calendar, which is not measured
+        client.get("/list-calendar-events")
+        for iteration in range(client_number, requests, concurrency):
+            started = time.perf_counter()
+            response = step(client, iteration)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code >= 400:
+                    errors += 1
+
+    threads = [
+        threading.Thread(target=client_loop, args=(number,))
+        for number in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def action_script(event_ids: List[str], events_per_turn: int) -> Callable:
+    """
+    Script turns creating events and updating and deleting existing ones.
+
+    Args:
+        event_ids: IDs of existing events, consumed by updates and deletes
+        events_per_turn: Number of events each operation touches
+
+    Returns:
+        Script for FakeGroq
+    """
+    lock = threading.Lock()
+    tomorrow = (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%d")
+    turns = itertools.count()
+
+    def script(params):
+        if params.get("temperature", 0) > 0:
+            return "All done."
+        with lock:
+            touched = [event_ids.pop() for _ in range(2 * events_per_turn)]
+            turn = next(turns)
+        return json.dumps(
+            {
+                "type": "action",
+                "actions": [
+                    {
+                        "operation": "create_events",
+                        "events": [
+                            {
+                                "summary": f"Focus block {turn}.{i}",
+                                "start": f"{tomorrow}T{8 + i % 12:02d}:00:00Z",
+                                "end": f"{tomorrow}T{8 + i % 12:02d}:30:00Z",
+                            }
+                            for i in range(events_per_turn)
+                        ],
+                    },
+                    {
+                        "operation": "update_events",
+                        "events": [
+                            {"eventId": event_id, "summary": "Moved"}
+                            for event_id in touched[:events_per_turn]
+                        ],
+                    },
+                    {
+                        "operation": "delete_events",
+                        "events": [
+                            {"eventId": event_id}
+                            for event_id in touched[events_per_turn:]
+                        ],
+                    },
+                ],
+                "message": "Rearranged your day.",
+            }
+        )
+
+    return script
+
+
+def measure_action_concurrency(
+    timecraft,
+    credentials: Dict,
+    event_ids: List[str],
+    events_per_turn: int,
+    plans: int = 10,
+) -> Dict:
+    """
+    Compare running the actions of a plan one by one against concurrently.
+
+    Every plan creates, updates and deletes events, as in the actions
+    workload. One by one runs the plans with a single Calendar worker,
+    concurrently with the configured CALENDAR_CONCURRENCY workers.
+
+    Args:
+        timecraft: The app module
+        credentials: Session credentials used for the Calendar service
+        event_ids: IDs of existing events, consumed by updates and deletes
+        events_per_turn: Number of events each action touches
+        plans: Number of plans run in each mode
+
+    Returns:
+        Throughput and latencies of both modes
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from flask import session
+
+    script = action_script(event_ids, events_per_turn)
+    configured = timecraft.calendar_pool
+    results = {"actions_per_plan": 3, "events_per_action": events_per_turn}
+    # A plan makes more calls than CALENDAR_USER_RATE allows in a second,
+    # which would time the scheduler in both modes
+    throttled = timecraft.calendar_scheduler.enabled
+    timecraft.calendar_scheduler.enabled = False
+    try:
+        for mode, pool in (
+            ("sequential", ThreadPoolExecutor(max_workers=1)),
+            ("concurrent", configured),
+        ):
+            timecraft.calendar_pool = pool
+            latencies = []
+            with timecraft.app.test_request_context():
+                session["session_id"] = f"action-concurrency-{mode}"
+                session["credentials"] = credentials
+                started = time.perf_counter()
+                for _ in range(plans):
+                    actions = json.loads(script({}))["actions"]
+                    plan_started = time.perf_counter()
+                    timecraft.run_actions(actions, "UTC")
+                    latencies.append(time.perf_counter() - plan_started)
+                elapsed = time.perf_counter() - started
+            latencies.sort()
+            results[mode] = {
+                "plans": plans,
+                "plans_per_s": plans / elapsed,
+                "p50_ms": percentile(latencies, 0.5) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+            }
+            if pool is not configured:
+                pool.shutdown()
+    finally:
+        timecraft.calendar_pool = configured
+        timecraft.calendar_scheduler.enabled = throttled
+    return results
+
+
+def measure_fanout(
+    app,
+    credentials: Dict,
+    calendar_ids: List[str],
+    busy_calendar_ids: List[str],
+    repeats: int = 20,
+) -> Dict:
+    """
+    Time fetching and merging a week of several calendars.
+
+    Args:
+        app: Flask app
+        credentials: Session credentials used for the Calendar service
+        calendar_ids: Calendars fetched with event details
+        busy_calendar_ids: Calendars only checked for busy time
+        repeats: Number of timed runs of each step
+
+    Returns:
+        Median milliseconds of every step
+    """
+    from event_store import fetch_calendar, fetch_calendars, merge_events, query_busy
+    from main import get_calendar_service
+
+    with app.test_request_context():
+        from flask import session
+
+        session["credentials"] = credentials
+        service = get_calendar_service()
+
+    now = datetime.utcnow()
+    time_min = now.isoformat() + "Z"
+    time_max = (now + timedelta(days=7)).isoformat() + "Z"
+
+    def median_ms(function):
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            result = function()
+            timings.append((time.perf_counter() - started) * 1000)
+        return percentile(sorted(timings), 0.5), result
+
+    sequential_ms, lists = median_ms(
+        lambda: [
+            fetch_calendar(service, calendar_id, time_min, time_max)
+            for calendar_id in calendar_ids
+        ]
+    )
+    concurrent_ms, merged = median_ms(
+        lambda: fetch_calendars(service, calendar_ids, time_min, time_max)
+    )
+    merge_ms, _ = median_ms(lambda: merge_events(lists))
+    results = {
+        "calendars": len(calendar_ids),
+        "events": sum(len(events) for events in lists),
+        "merged_events": len(merged),
+        "sequential_fetch_ms": sequential_ms,
+        "concurrent_fetch_ms": concurrent_ms,
+        "merge_ms": merge_ms,
+    }
+    if busy_calendar_ids:
+        results["busy_calendars"] = len(busy_calendar_ids)
+        results["freebusy_ms"], _ = median_ms(
+            lambda: query_busy(service, busy_calendar_ids, time_min, time_max)
+        )
+    return results
+
+
+def measure_push(timecraft, calendar: FakeCalendar, credentials: Dict) -> Dict:
+    """
+    Time how long a change made elsewhere takes to reach an open grid.
+
+    Each change moves an event in the fake calendar, which notifies the app.
+    The app syncs the calendar and publishes the new version to the user's
+    push streams, where its arrival is timed.
+
+    Args:
+        timecraft: The main module
+        calendar: Fake Calendar server
+        credentials: Session credentials of the user
+
+    Returns:
+        Summary of the delivery latencies
+    """
+    client = timecraft.app.test_client()
+    with client.session_transaction() as session:
+        session["credentials"] = credentials
+    client.get("/list-calendar-events")
+    with client.session_transaction() as session:
+        owner = session["session_id"]
+
+    # Channels are opened in the background
+    deadline = time.monotonic() + 10
+    while not all(
+        timecraft.watch_channels.watching(owner, calendar_id)
+        for calendar_id in timecraft.CALENDAR_IDS
+    ):
+        if time.monotonic() > deadline:
+            raise RuntimeError("Watch channels were not opened")
+        time.sleep(0.01)
+
+    stream = timecraft.change_feed.subscribe(owner)
+    latencies = []
+    round_trips = calendar.round_trips
+    try:
+        for _ in range(20):
+            started = time.perf_counter()
+            calendar.simulate_change(timecraft.DEFAULT_CALENDAR_ID)
+            stream.get(timeout=10)
+            latencies.append(time.perf_counter() - started)
+    finally:
+        timecraft.change_feed.unsubscribe(owner, stream)
+
+    summary = summarize(latencies, 0, sum(latencies))
+    summary["calendar_round_trips"] = calendar.round_trips - round_trips
+    # Without push, an open grid never hears of the change, and the next
+    # request only asks Google once the store's sync interval has passed
+    summary["polling_interval_s"] = timecraft.EventStore.SYNC_INTERVAL
+    return summary
+
+
+def measure_goodput(
+    timecraft,
+    calendar: FakeCalendar,
+    credentials: Dict,
+    rate_limit: float,
+    users: int = 12,
+    seconds: float = 8,
+    events_per_turn: int = 5,
+) -> Dict:
+    """
+    Compare action goodput against a rate limited Calendar, with the outbound
+    scheduler switched off and on.
+
+    Every simulated user creates events in a loop, as fast as their turns
+    complete. Goodput counts the events created, events failing after all
+    retries are lost work.
+
+    Args:
+        timecraft: The app module
+        calendar: Fake Calendar server
+        credentials: Session credentials of every user
+        rate_limit: Calls per second the fake Calendar accepts
+        users: Number of concurrent users
+        seconds: Duration of each run
+        events_per_turn: Events created by each turn
+
+    Returns:
+        Results of both runs
+    """
+    from flask import session
+
+    from outbound import OutboundScheduler
+
+    configured = timecraft.calendar_scheduler
+    calendar.rate_limit = rate_limit
+    results = {"rate_limit": rate_limit, "users": users}
+    try:
+        for mode in ("off", "on"):
+            timecraft.calendar_scheduler = OutboundScheduler(
+                project_rate=configured.project_rate,
+                user_rate=configured.user_rate,
+                max_in_flight=configured.max_in_flight,
+            )
+            timecraft.calendar_scheduler.enabled = mode == "on"
+            created = [0] * users
+            failed = [0] * users
+            latencies = []
+            throttled = calendar.throttled
+            tomorrow = (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%d")
+            deadline = time.perf_counter() + seconds
+
+            def user_loop(number):
+                with timecraft.app.test_request_context():
+                    session["session_id"] = f"goodput-{mode}-{number}"
+                    session["credentials"] = credentials
+                    for turn in itertools.count():
+                        if time.perf_counter() >= deadline:
+                            return
+                        events = [
+                            {
+                                "summary": f"Goodput {mode} {number}.{turn}.{i}",
+                                "start": f"{tomorrow}T09:00:00Z",
+                                "end": f"{tomorrow}T09:30:00Z",
+                            }
+                            for i in range(events_per_turn)
+                        ]
+                        started = time.perf_counter()
+                        try:
+                            outcomes = timecraft.create_events(events, "UTC")
+                        except Exception:
+                            outcomes = [{"success": False}] * len(events)
+                        latencies.append(time.perf_counter() - started)
+                        succeeded = sum(outcome["success"] for outcome in outcomes)
+                        created[number] += succeeded
+                        failed[number] += len(outcomes) - succeeded
+
+            threads = [
+                threading.Thread(target=user_loop, args=(number,))
+                for number in range(users)
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            latencies.sort()
+            results[f"scheduler_{mode}"] = {
+                "events_created": sum(created),
+                "events_failed": sum(failed),
+                "goodput_eps": sum(created) / elapsed,
+                "rejected_calls": calendar.throttled - throttled,
+                "fewest_events_per_user": min(created),
+                "most_events_per_user": max(created),
+                "turn_p50_ms": percentile(latencies, 0.5) * 1000,
+                "turn_p95_ms": percentile(latencies, 0.95) * 1000,
+            }
+            # Let the fake Calendar's limit recover between the runs
+            time.sleep(2)
+    finally:
+        calendar.rate_limit = 0
+        timecraft.calendar_scheduler = configured
+    return results
+
+
+def measure_first_byte(
+    timecraft, groq: FakeGroq, credentials: Dict, warm: bool, turns: int = 20
+) -> Dict:
+    """
+    Time chat turns from submitting the message to the first streamed token.
+
+    Before every turn the user's store is made stale, as after reading the
+    grid for longer than the sync interval, so the calendar has to be synced.
+    With warm, /chat/warmup is called first, like the chat box does while
+    the user types.
+
+    Args:
+        timecraft: The main module
+        groq: Fake Groq client of the app
+        credentials: Session credentials of the user
+        warm: Whether to warm up before every turn
+        turns: Number of chat turns
+
+    Returns:
+        Summary of the latencies to the first token, plus the median time
+        until the LLM was called
+    """
+    groq.script = lambda params: json.dumps(
+        {"type": "inquiry", "message": "You are free tomorrow afternoon."}
+    )
+    client = timecraft.app.test_client()
+    with client.session_transaction() as session:
+        session["credentials"] = credentials
+    client.get("/list-calendar-events")
+    with client.session_transaction() as session:
+        owner = session["session_id"]
+
+    latencies = []
+    prompt_latencies = []
+    # Back to back turns would otherwise wait for GROQ_RATE once its burst is
+    # spent, timing the scheduler instead of the turn
+    throttled = timecraft.groq_scheduler.enabled
+    timecraft.groq_scheduler.enabled = False
+    try:
+        for turn in range(turns):
+            timecraft.event_stores.get(owner).invalidate()
+            if warm:
+                client.post("/chat/warmup", json={"timezone": "UTC"})
+
+            started = time.perf_counter()
+            response = client.post(
+                "/chat/stream",
+                json={
+                    "message": f"What do I have tomorrow? ({turn})",
+                    "timezone": "UTC",
+                },
+                buffered=False,
+            )
+            for chunk in response.response:
+                if b"event: token" in chunk:
+                    latencies.append(time.perf_counter() - started)
+                    prompt_latencies.append(groq.called_at - started)
+                    break
+            response.close()
+    finally:
+        timecraft.groq_scheduler.enabled = throttled
+
+    summary = summarize(latencies, turns - len(latencies), sum(latencies))
+    summary["prompt_ready_p50_ms"] = percentile(sorted(prompt_latencies), 0.5) * 1000
+    return summary
+
+
+def measure_event_fetch(
+    app,
+    credentials: Dict,
+    calendar: FakeCalendar,
+    events: int = 2000,
+    repeats: int = 5,
+) -> Dict:
+    """
+    Compare fetching a window of events with and without the fields mask and
+    the concurrent fetch of sub-ranges.
+
+    Args:
+        app: Flask app
+        credentials: Session credentials used for the Calendar service
+        calendar: Fake Calendar server, which gets a calendar of its own
+        events: Number of events in the window
+        repeats: Number of timed runs of each variant
+
+    Returns:
+        Bytes, round trips and median milliseconds of every variant
+    """
+    import event_store
+    from main import get_calendar_service
+
+    calendar_id = "fetch@group.calendar.google.com"
+    days = 28
+    calendar.seed(events, days=days, calendar_ids=[calendar_id])
+    with app.test_request_context():
+        from flask import session
+
+        session["credentials"] = credentials
+        service = get_calendar_service()
+
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    time_min = (today - timedelta(days=days // 2)).isoformat() + "Z"
+    time_max = (today + timedelta(days=days // 2)).isoformat() + "Z"
+
+    def sequential():
+        return list(
+            event_store.iter_events(
+                service,
+                calendar_id,
+                timeMin=time_min,
+                timeMax=time_max,
+                orderBy="startTime",
+            )
+        )
+
+    def concurrent():
+        return event_store.fetch_events_concurrently(
+            service, time_min, time_max, calendar_id
+        )
+
+    variants = {
+        "full_sequential": ("*", sequential),
+        "masked_sequential": (event_store.EVENT_LIST_FIELDS, sequential),
+        "full_concurrent": ("*", concurrent),
+        "masked_concurrent": (event_store.EVENT_LIST_FIELDS, concurrent),
+    }
+    mask = event_store.EVENT_LIST_FIELDS
+    results = {"events": events}
+    try:
+        for name, (fields, fetch) in variants.items():
+            event_store.EVENT_LIST_FIELDS = fields
+            timings = []
+            for _ in range(repeats):
+                bytes_sent, round_trips = calendar.bytes_sent, calendar.round_trips
+                started = time.perf_counter()
+                fetched = fetch()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = {
+                "events": len(fetched),
+                "bytes": calendar.bytes_sent - bytes_sent,
+                "round_trips": calendar.round_trips - round_trips,
+                "p50_ms": percentile(sorted(timings), 0.5),
+            }
+    finally:
+        event_store.EVENT_LIST_FIELDS = mask
+    return results
+
+
+def measure_layout(events: int = 5000, repeats: int = 20) -> Dict:
+    """
+    Time laying out four days of overlapping events in the calendar grid.
+
+    Args:
+        events: Number of events
+        repeats: Number of timed layouts
+
+    Returns:
+        Median and slowest milliseconds
+    """
+    from layout import DAY_MINUTES, layout_events
+
+    base = datetime(2030, 1, 1)
+    calendar = []
+    for number in range(events):
+        start = base + timedelta(minutes=random.randrange(4 * DAY_MINUTES))
+        end = start + timedelta(minutes=random.randrange(15, 240))
+        calendar.append(
+            {
+                "id": str(number),
+                "summary": f"Event {number}",
+                "start": {"dateTime": start.isoformat() + "Z"},
+                "end": {"dateTime": end.isoformat() + "Z"},
+            }
+        )
+
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        layout_events(calendar)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "events": events,
+        "p50_ms": percentile(timings, 0.5),
+        "max_ms": timings[-1],
+    }
+
+
+def measure_conflict_check(
+    timecraft, events: int = 5000, planned: int = 10, repeats: int = 200
+) -> Dict:
+    """
+    Time checking an action plan for conflicts against a large calendar.
+
+    Args:
+        timecraft: The app module
+        events: Number of events in the calendar, spread over a year
+        planned: Number of events the plan creates and moves
+        repeats: Number of timed checks
+
+    Returns:
+        Index build and conflict check percentiles, in milliseconds
+    """
+    from flask import session
+
+    start = datetime(2030, 1, 1)
+    calendar = []
+    for number in range(events):
+        event_start = start + timedelta(minutes=random.randrange(0, 365 * 24 * 60, 15))
+        calendar.append(
+            {
+                "eventId": f"event-{number}",
+                "summary": f"Event {number}",
+                "start": event_start.isoformat() + "Z",
+                "end": (event_start + timedelta(minutes=45)).isoformat() + "Z",
+            }
+        )
+
+    def planned_time(number: int) -> tuple:
+        planned_start = start + timedelta(days=number % 30, hours=9 + number % 8)
+        return (
+            planned_start.isoformat() + "Z",
+            (planned_start + timedelta(hours=1)).isoformat() + "Z",
+        )
+
+    actions = [
+        {
+            "operation": "create_events",
+            "events": [
+                dict(zip(("start", "end"), planned_time(number)), summary="Planned")
+                for number in range(planned // 2)
+            ],
+        },
+        {
+            "operation": "update_events",
+            "events": [
+                dict(
+                    zip(("start", "end"), planned_time(number + planned)),
+                    eventId=f"event-{number}",
+                )
+                for number in range(planned - planned // 2)
+            ],
+        },
+    ]
+
+    builds = []
+    checks = []
+    with timecraft.app.test_request_context():
+        session["session_id"] = "conflict-check"
+        for _ in range(repeats):
+            started = time.perf_counter()
+            busy = timecraft.build_busy_index(calendar)
+            built = time.perf_counter()
+            timecraft.find_conflicts(actions, busy, "UTC")
+            checks.append((time.perf_counter() - built) * 1000)
+            builds.append((built - started) * 1000)
+    timecraft.event_stores.pop("conflict-check")
+
+    builds.sort()
+    checks.sort()
+    return {
+        "events": events,
+        "planned_events": planned,
+        "build_p50_ms": percentile(builds, 0.5),
+        "check_p50_ms": percentile(checks, 0.5),
+        "check_p95_ms": percentile(checks, 0.95),
+    }
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+app = main.create_app()
+created = time.perf_counter()
+app.test_client().get("/")
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (time.perf_counter() - created) * 1000,
+}))
+"""
+
+
+def measure_startup(repeats: int = 5) -> Dict:
+    """
+    Time a cold start of the app in fresh interpreters.
+
+    Args:
+        repeats: Number of interpreters started
+
+    Returns:
+        Median milliseconds spent importing main, in create_app, and serving
+        the first request
+    """
+    runs = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True,
+                check=True,
+                text=True,
+            ).stdout.splitlines()[-1]
+        )
+        for _ in range(repeats)
+    ]
+    return {
+        name: percentile(sorted(run[name] for run in runs), 0.5) for name in runs[0]
+    }
+
+
+def git_commit() -> Optional[str]:
+    """Return the commit being benchmarked, if this is a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=50, help="Calendar ms")
+    parser.add_argument("--groq-latency", type=float, default=300, help="Groq ms")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--events-per-turn", type=int, default=5)
+    parser.add_argument("--calendars", type=int, default=1)
+    parser.add_argument("--busy-calendars", type=int, default=0)
+    parser.add_argument(
+        "--push", action="store_true", help="Watch calendars for changes"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=0,
+        help="Calls per second of a rate limited Calendar to compare goodput "
+        "against, with the outbound scheduler off and on",
+    )
+    parser.add_argument("--output", default="benchmark-results.json")
+    args = parser.parse_args(argv)
+    output = os.path.abspath(args.output)
+
+    calendar_ids = ["primary"] + [
+        f"team-{number}@group.calendar.google.com"
+        for number in range(1, args.calendars)
+    ]
+    busy_calendar_ids = [
+        f"busy-{number}@group.calendar.google.com"
+        for number in range(args.busy_calendars)
+    ]
+    calendar = FakeCalendar(latency=args.latency / 1000)
+    event_ids = calendar.seed(
+        args.events, calendar_ids=calendar_ids + busy_calendar_ids
+    )
+    os.environ["CALENDAR_ROOT_URL"] = calendar.serve()
+    os.environ["CALENDAR_IDS"] = ",".join(calendar_ids)
+    os.environ["BUSY_CALENDAR_IDS"] = ",".join(busy_calendar_ids)
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    os.environ.setdefault("LLM_CACHE_BACKEND", "off")
+    # The app's per-request timings would drown the results
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    state_dir = tempfile.mkdtemp()
+    os.environ.setdefault("JOB_DB_PATH", os.path.join(state_dir, "jobs.sqlite3"))
+    os.environ.setdefault(
+        "ACTION_JOURNAL_PATH", os.path.join(state_dir, "actions.sqlite3")
+    )
+
+    startup = measure_startup()
+    print(
+        f"startup      import {startup['import_ms']:7.1f} ms  "
+        f"create_app {startup['create_app_ms']:6.1f} ms  "
+        f"first request {startup['first_request_ms']:6.1f} ms"
+    )
+
+    if args.push:
+        # Notifications need the app on a real port, the workloads still use
+        # test clients
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args):
+                pass
+
+        webhook_server = make_server(
+            "127.0.0.1",
+            0,
+            lambda environ, start_response: timecraft.app(environ, start_response),
+            threaded=True,
+            request_handler=QuietHandler,
+        )
+        threading.Thread(target=webhook_server.serve_forever, daemon=True).start()
+        os.environ["WEBHOOK_URL"] = (
+            f"http://127.0.0.1:{webhook_server.server_port}/calendar/notifications"
+        )
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main as timecraft
+
+    timecraft.create_app()
+
+    groq = FakeGroq(latency=args.groq_latency / 1000)
+    timecraft.groq = groq
+    credentials = {
+        "token": "benchmark",
+        "refresh_token": "benchmark",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "client_id": "benchmark",
+        "client_secret": "benchmark",
+        "scopes": timecraft.SCOPES,
+        "expiry": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+    }
+
+    def navigate(client, iteration):
+        direction = "next" if iteration // 4 % 2 == 0 else "prev"
+        return client.get(f"/list-calendar-events?direction={direction}")
+
+    def inquiry(client, iteration):
+        groq.script = lambda params: json.dumps(
+            {"type": "inquiry", "message": "You are free tomorrow afternoon."}
+        )
+        return client.post(
+            "/chat",
+            json={
+                "message": f"What do I have tomorrow? ({iteration})",
+                "timezone": "UTC",
+            },
+        )
+
+    scripted_actions = action_script(event_ids, args.events_per_turn)
+
+    def actions(client, iteration):
+        groq.script = scripted_actions
+        return client.post(
+            "/chat",
+            json={
+                "message": f"Rearrange my day ({iteration})",
+                "timezone": "UTC",
+            },
+        )
+
+    action_requests = min(args.requests, len(event_ids) // (2 * args.events_per_turn))
+    workloads = {
+        "navigation": (navigate, args.requests),
+        "inquiry": (inquiry, args.requests),
+        "actions": (actions, action_requests),
+    }
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "startup": startup,
+        "workloads": {},
+    }
+    for mode in ("cold", "warm"):
+        first_byte = measure_first_byte(
+            timecraft, groq, credentials, warm=mode == "warm"
+        )
+        results[f"first_byte_{mode}"] = first_byte
+        print(
+            f"first byte   {mode:<4} p50 {first_byte['p50_ms']:7.1f} ms  "
+            f"p95 {first_byte['p95_ms']:7.1f} ms  "
+            f"LLM called after {first_byte['prompt_ready_p50_ms']:.1f} ms"
+        )
+
+    if args.push:
+        push = measure_push(timecraft, calendar, credentials)
+        results["push"] = push
+        print(
+            f"push         {push['requests']:>5} changes  "
+            f"p50 {push['p50_ms']:7.1f} ms  p95 {push['p95_ms']:7.1f} ms  "
+            f"{push['calendar_round_trips']} Calendar round trips "
+            f"(polling every {push['polling_interval_s']} s without push)"
+        )
+
+    for name, (step, requests) in workloads.items():
+        round_trips = calendar.round_trips
+        summary = run_workload(
+            timecraft.app, credentials, requests, args.concurrency, step
+        )
+        summary["calendar_round_trips"] = calendar.round_trips - round_trips
+        results["workloads"][name] = summary
+        print(
+            f"{name:<12} {summary['requests']:>5} req  "
+            f"{summary['throughput_rps']:7.1f} req/s  "
+            f"p50 {summary['p50_ms']:7.1f} ms  p95 {summary['p95_ms']:7.1f} ms  "
+            f"p99 {summary['p99_ms']:7.1f} ms  errors {summary['errors']}"
+        )
+
+    # Ten plans in each mode, each consuming two events per action
+    if len(event_ids) >= 2 * 10 * 2 * args.events_per_turn:
+        concurrency = measure_action_concurrency(
+            timecraft, credentials, event_ids, args.events_per_turn
+        )
+        results["action_concurrency"] = concurrency
+        for mode in ("sequential", "concurrent"):
+            run = concurrency[mode]
+            print(
+                f"action plans {mode:<10} {run['plans_per_s']:6.2f} plans/s  "
+                f"p50 {run['p50_ms']:7.1f} ms  p95 {run['p95_ms']:7.1f} ms"
+            )
+
+    if len(calendar_ids) > 1 or busy_calendar_ids:
+        fanout = measure_fanout(
+            timecraft.app, credentials, calendar_ids, busy_calendar_ids
+        )
+        results["fanout"] = fanout
+        print(
+            f"fan-out      {fanout['calendars']} calendars  "
+            f"sequential {fanout['sequential_fetch_ms']:7.1f} ms  "
+            f"concurrent {fanout['concurrent_fetch_ms']:7.1f} ms  "
+            f"merge {fanout['merge_ms']:.2f} ms "
+            f"({fanout['events']} -> {fanout['merged_events']} events)"
+        )
+        if "freebusy_ms" in fanout:
+            print(
+                f"free/busy    {fanout['busy_calendars']} calendars  "
+                f"{fanout['freebusy_ms']:7.1f} ms"
+            )
+
+    event_fetch = measure_event_fetch(timecraft.app, credentials, calendar)
+    results["event_fetch"] = event_fetch
+    for name in (
+        "full_sequential",
+        "masked_sequential",
+        "full_concurrent",
+        "masked_concurrent",
+    ):
+        variant = event_fetch[name]
+        print(
+            f"fetch        {event_fetch['events']} events  {name:<18} "
+            f"{variant['bytes'] / 1024:8.1f} KiB  "
+            f"{variant['round_trips']:>2} round trips  "
+            f"p50 {variant['p50_ms']:7.1f} ms"
+        )
+
+    layout = measure_layout()
+    results["layout"] = layout
+    print(
+        f"layout       {layout['events']} events  "
+        f"p50 {layout['p50_ms']:6.1f} ms  max {layout['max_ms']:6.1f} ms"
+    )
+
+    conflict_check = measure_conflict_check(timecraft)
+    results["conflict_check"] = conflict_check
+    print(
+        f"conflicts    {conflict_check['events']} events  "
+        f"index build p50 {conflict_check['build_p50_ms']:6.2f} ms  "
+        f"check of {conflict_check['planned_events']} planned events "
+        f"p50 {conflict_check['check_p50_ms']:.3f} ms  "
+        f"p95 {conflict_check['check_p95_ms']:.3f} ms"
+    )
+
+    if args.rate_limit:
+        goodput = measure_goodput(timecraft, calendar, credentials, args.rate_limit)
+        results["goodput"] = goodput
+        for mode in ("off", "on"):
+            run = goodput[f"scheduler_{mode}"]
+            print(
+                f"goodput      scheduler {mode:<3} {run['goodput_eps']:6.1f} events/s  "
+                f"{run['events_failed']:>4} failed  "
+                f"{run['rejected_calls']:>5} calls rejected  "
+                f"per user {run['fewest_events_per_user']}-"
+                f"{run['most_events_per_user']}  "
+                f"turn p50 {run['turn_p50_ms']:7.1f} ms"
+            )
+
+    calendar.close_channels()
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results saved to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
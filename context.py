@@ -0,0 +1,225 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from typing import Dict, List, Tuple
+
+from event_store import parse_event_time
+from intervals import FreeBusyIndex, merge_intervals
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text, at about four characters per token."""
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Estimate the number of prompt tokens of a list of chat messages."""
+    # Every message carries a few tokens of role and formatting overhead
+    return sum(estimate_tokens(message["content"]) + 4 for message in messages)
+
+
+def describe_day(day: date, today: date) -> str:
+    """Describe a day relative to today, e.g. "D+1 Tue Nov 26"."""
+    return f"D+{(day - today).days} {day.strftime('%a %b %d')}"
+
+
+def encode_events(events: List[Dict], now: datetime, detail_days: int) -> List[str]:
+    """
+    Encode events compactly for the prompt.
+
+    Events starting within detail_days of today are listed one per line with
+    their ID. Later events are merged into busy blocks per day.
+
+    Args:
+        events: List of formatted events ordered by start time
+        now: Current time in UTC
+        detail_days: Number of days, starting today, listed event by event
+
+    Returns:
+        List of lines
+    """
+    today = now.date()
+    detail_end = today + timedelta(days=detail_days)
+    lines = []
+    busy = defaultdict(list)
+    for event in events:
+        start = parse_event_time(event["start"])
+        end = parse_event_time(event["end"])
+        if start.date() >= detail_end:
+            busy[start.date()].append((start, end))
+            continue
+
+        end_text = end.strftime("%H:%M")
+        if end.date() != start.date():
+            end_text = f"{describe_day(end.date(), today)} {end_text}"
+        line = (
+            f"{describe_day(start.date(), today)} {start:%H:%M}-{end_text} "
+            f"{event['summary']} (id {event['eventId']})"
+        )
+        if event.get("calendarId"):
+            line += f" [{event['calendarId']}]"
+        lines.append(line)
+
+    for day in sorted(busy):
+        blocks = ", ".join(
+            f"{start:%H:%M}-{end:%H:%M}" for start, end in merge_intervals(busy[day])
+        )
+        lines.append(f"{describe_day(day, today)} busy {blocks}")
+    return lines
+
+
+def encode_free_slots(
+    busy: FreeBusyIndex,
+    now: datetime,
+    zone: tzinfo,
+    days: int = 3,
+    hours: Tuple[int, int] = (8, 21),
+    min_minutes: int = 30,
+) -> List[str]:
+    """
+    List the free slots of the next days for the prompt.
+
+    Args:
+        busy: Free/busy index of the calendar
+        now: Current time in UTC
+        zone: Time zone of the user, used for the waking hours
+        days: Number of days, starting today, to list
+        hours: Local hours of the day in which free time is suggested
+        min_minutes: Shortest slot worth listing
+
+    Returns:
+        List of lines, one per day with free time
+    """
+    today = now.date()
+    local_today = now.astimezone(zone).date()
+    lines = []
+    for offset in range(days):
+        day = local_today + timedelta(days=offset)
+        day_start = datetime.combine(day, time(hours[0]), zone)
+        day_end = datetime.combine(day, time(hours[1]), zone)
+        slots = busy.free_slots(
+            max(day_start, now).timestamp(), day_end.timestamp(), min_minutes * 60
+        )
+        if not slots:
+            continue
+
+        text = ", ".join(
+            f"{datetime.fromtimestamp(start, timezone.utc):%H:%M}-"
+            f"{datetime.fromtimestamp(end, timezone.utc):%H:%M}"
+            for start, end in slots
+        )
+        start_day = datetime.fromtimestamp(slots[0][0], timezone.utc).date()
+        lines.append(f"{describe_day(start_day, today)} free {text}")
+    return lines
+
+
+def build_calendar_context(
+    events: List[Dict], now: datetime, max_tokens: int, free_slots: List[str] = ()
+) -> str:
+    """
+    Build the calendar section of the system prompt within a token budget.
+
+    Detail is dropped from the furthest days first: events become busy
+    blocks, and if that is still too long the last days are left out.
+
+    Args:
+        events: List of formatted events ordered by start time
+        now: Current time in UTC
+        max_tokens: Token budget of the section
+        free_slots: Lines from encode_free_slots
+
+    Returns:
+        The calendar context
+    """
+    header = (
+        f"Now: {now:%a %Y-%m-%d %H:%M} UTC. "
+        "Upcoming events for the next 7 days (D+0 is today, times in UTC):\n"
+    )
+    if free_slots:
+        header = (
+            "Free time during the user's waking hours, suggest these first:\n"
+            + "".join(line + "\n" for line in free_slots)
+            + header
+        )
+    if not events:
+        return header + "No events scheduled.\n"
+
+    for detail_days in (7, 3, 1, 0):
+        lines = encode_events(events, now, detail_days)
+        text = header + "".join(line + "\n" for line in lines)
+        if estimate_tokens(text) <= max_tokens:
+            return text
+
+    text = header
+    for line in lines:
+        if estimate_tokens(text + line) > max_tokens:
+            return text + "(later days omitted)\n"
+        text += line + "\n"
+    return text
+
+
+def summarize_messages(
+    messages: List[Dict[str, str]], max_tokens: int, summary: str = ""
+) -> str:
+    """
+    Condense chat messages into a short summary.
+
+    Each message becomes a line made of its start. Lines are kept newest
+    first until max_tokens is used up.
+
+    Args:
+        messages: List of messages with role and content, oldest first
+        max_tokens: Token budget of the summary
+        summary: Earlier summary the new lines are appended to
+
+    Returns:
+        The summary, one line per message
+    """
+    lines = summary.splitlines() if summary else []
+    for message in messages:
+        content = " ".join(message["content"].split())
+        lines.append(f"- {message['role']}: {content[:160]}")
+
+    kept = []
+    used = 0
+    for line in reversed(lines):
+        if used + estimate_tokens(line) > max_tokens:
+            break
+        kept.append(line)
+        used += estimate_tokens(line)
+    return "\n".join(reversed(kept))
+
+
+def fit_history(
+    chat_log: List[Dict[str, str]],
+    max_tokens: int,
+    summary_tokens: int,
+    summary: str = "",
+) -> Tuple[List[Dict[str, str]], str]:
+    """
+    Keep the most recent chat messages within a token budget.
+
+    Messages that do not fit are condensed into a short summary by
+    summarize_messages.
+
+    Args:
+        chat_log: List of messages with role and content, oldest first
+        max_tokens: Token budget of the kept messages
+        summary_tokens: Token budget of the summary of older messages
+        summary: Summary of messages before chat_log
+
+    Returns:
+        Tuple of the kept messages and the summary of the older ones
+    """
+    kept = []
+    used = 0
+    for message in reversed(chat_log):
+        cost = estimate_tokens(message["content"]) + 4
+        # The latest message is always kept
+        if kept and used + cost > max_tokens:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+
+    older = chat_log[: len(chat_log) - len(kept)]
+    return kept, summarize_messages(older, summary_tokens, summary)
@@ -0,0 +1,84 @@
+import threading
+from typing import Dict, List, Tuple
+
+from cache import TTLCache
+from context import summarize_messages
+
+
+class ConversationStore:
+    """
+    Chat histories kept on the server, keyed by session.
+
+    Conversations without a new message for idle_ttl seconds are evicted, as
+    are the least recently active ones beyond max_conversations. Once a
+    conversation grows past max_messages, its older half is folded into a
+    rolling summary.
+    """
+
+    def __init__(
+        self,
+        max_conversations: int = 1024,
+        idle_ttl: float = 6 * 3600,
+        max_messages: int = 40,
+        summary_tokens: int = 300,
+    ):
+        """
+        Args:
+            max_conversations: Maximum number of conversations kept
+            idle_ttl: Seconds a conversation is kept after its last message
+            max_messages: Maximum number of messages kept per conversation
+            summary_tokens: Token budget of the rolling summary, 0 to drop
+                old messages without summarizing them
+        """
+        self.max_messages = max_messages
+        self.summary_tokens = summary_tokens
+        self._conversations = TTLCache(max_size=max_conversations, ttl=idle_ttl)
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: str) -> Tuple[List[Dict[str, str]], str]:
+        """
+        Get a conversation.
+
+        Args:
+            conversation_id: Session identity of the user
+
+        Returns:
+            Tuple of the messages, oldest first, and the summary of the
+            messages before them
+        """
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                return [], ""
+            return list(conversation["messages"]), conversation["summary"]
+
+    def append(self, conversation_id: str, role: str, content: str) -> None:
+        """
+        Add a message to a conversation.
+
+        Args:
+            conversation_id: Session identity of the user
+            role: "user" or "assistant"
+            content: Text of the message
+        """
+        with self._lock:
+            conversation = self._conversations.get(conversation_id) or {
+                "messages": [],
+                "summary": "",
+            }
+            messages = conversation["messages"]
+            messages.append({"role": role, "content": content})
+            if len(messages) > self.max_messages:
+                folded = len(messages) - self.max_messages // 2
+                if self.summary_tokens:
+                    conversation["summary"] = summarize_messages(
+                        messages[:folded], self.summary_tokens, conversation["summary"]
+                    )
+                del messages[:folded]
+            # Storing again restarts the idle timeout
+            self._conversations.set(conversation_id, conversation)
+
+    def reset(self, conversation_id: str) -> None:
+        """Forget a conversation."""
+        with self._lock:
+            self._conversations.pop(conversation_id)
@@ -0,0 +1,609 @@
+import heapq
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+from intervals import IntervalIndex
+
+
+def parse_event_time(value: str) -> datetime:
+    """
+    Parse a Calendar date or date-time string into an aware UTC datetime.
+
+    Args:
+        value: RFC 3339 date-time, or a date for all-day events
+
+    Returns:
+        Timezone-aware datetime in UTC
+    """
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def format_api_time(value: datetime) -> str:
+    """Format an aware datetime the way the Calendar API expects."""
+    return value.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+# Partial response: only the fields the app reads
+EVENT_LIST_FIELDS = (
+    "nextPageToken,nextSyncToken,items(id,iCalUID,status,summary,start,end,colorId)"
+)
+
+# Largest page the Calendar API returns
+MAX_PAGE_SIZE = 2500
+
+# Shared pool for fetching sub-ranges of a window in parallel
+fetch_pool = ThreadPoolExecutor(max_workers=4)
+
+# Shared pool for fetching or syncing several calendars in parallel
+calendar_fetch_pool = ThreadPoolExecutor(max_workers=8)
+
+# Most calendars a single freebusy().query call may ask about
+FREEBUSY_MAX_CALENDARS = 50
+
+
+def iter_event_pages(
+    service, calendar_id: str = "primary", page_size: int = 250, **params
+) -> Iterator[Dict]:
+    """
+    Yield pages of events().list results, following nextPageToken.
+
+    The next page is only requested once the previous one has been consumed,
+    so callers can stop early without fetching the rest.
+
+    Args:
+        service: Google Calendar service
+        calendar_id: ID of the calendar
+        page_size: Number of events requested per page
+        **params: Additional events().list parameters
+
+    Yields:
+        Response dictionaries containing items and nextPageToken or nextSyncToken
+    """
+    page_token = None
+    while True:
+        page = (
+            service.events()
+            .list(
+                calendarId=calendar_id,
+                singleEvents=True,
+                maxResults=page_size,
+                pageToken=page_token,
+                fields=EVENT_LIST_FIELDS,
+                **params,
+            )
+            .execute()
+        )
+        yield page
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def iter_events(
+    service, calendar_id: str = "primary", limit: Optional[int] = None, **params
+) -> Iterator[Dict]:
+    """
+    Yield events across all pages of an events().list call.
+
+    Args:
+        service: Google Calendar service
+        calendar_id: ID of the calendar
+        limit: Optional maximum number of events to yield
+        **params: Additional events().list parameters
+
+    Yields:
+        Calendar event resources
+    """
+    page_size = min(limit, MAX_PAGE_SIZE) if limit else 250
+    count = 0
+    for page in iter_event_pages(service, calendar_id, page_size, **params):
+        for event in page.get("items", []):
+            yield event
+            count += 1
+            if limit and count >= limit:
+                return
+
+
+def fetch_events_concurrently(
+    service,
+    time_min: str,
+    time_max: str,
+    calendar_id: str = "primary",
+    parts: int = 4,
+) -> List[Dict]:
+    """
+    Fetch a time window by splitting it into sub-ranges fetched in parallel.
+
+    Args:
+        service: Google Calendar service
+        time_min: Start of the window
+        time_max: End of the window
+        calendar_id: ID of the calendar
+        parts: Number of sub-ranges
+
+    Returns:
+        List of Calendar event resources ordered by start time
+    """
+    start = parse_event_time(time_min)
+    step = (parse_event_time(time_max) - start) / parts
+    bounds = [start + step * i for i in range(parts + 1)]
+
+    def fetch(i):
+        return list(
+            iter_events(
+                service,
+                calendar_id,
+                timeMin=format_api_time(bounds[i]),
+                timeMax=format_api_time(bounds[i + 1]),
+                orderBy="startTime",
+            )
+        )
+
+    # Events crossing a boundary are returned by every sub-range they overlap,
+    # the first occurrence is already in start order
+    events = []
+    seen = set()
+    for chunk in fetch_pool.map(fetch, range(parts)):
+        for event in chunk:
+            if event["id"] not in seen:
+                seen.add(event["id"])
+                events.append(event)
+    return events
+
+
+def event_bounds(event: Dict) -> tuple:
+    """Return the start and end of a Calendar event as UTC timestamps."""
+    start = event["start"].get("dateTime", event["start"].get("date"))
+    end = event["end"].get("dateTime", event["end"].get("date"))
+    return parse_event_time(start).timestamp(), parse_event_time(end).timestamp()
+
+
+def merge_events(event_lists: List[List[Dict]]) -> List[Dict]:
+    """
+    Merge lists of events ordered by start time, dropping duplicates.
+
+    A meeting added to several calendars appears in each of them with the
+    same iCalUID and start, and is only kept the first time.
+
+    Args:
+        event_lists: Lists of Calendar event resources ordered by start time
+
+    Returns:
+        List of Calendar event resources ordered by start time
+    """
+    if len(event_lists) == 1:
+        return list(event_lists[0])
+
+    decorated = [
+        [(event_bounds(event)[0], event) for event in events] for events in event_lists
+    ]
+    merged = []
+    seen = set()
+    for start, event in heapq.merge(*decorated, key=lambda item: item[0]):
+        key = (event.get("iCalUID") or event["id"], start)
+        if key not in seen:
+            seen.add(key)
+            merged.append(event)
+    return merged
+
+
+def fetch_calendar(
+    service, calendar_id: str, time_min: str, time_max: str
+) -> List[Dict]:
+    """
+    Fetch the events of one calendar in a time window.
+
+    Windows longer than a week are split into sub-ranges fetched in parallel.
+
+    Args:
+        service: Google Calendar service
+        calendar_id: ID of the calendar
+        time_min: Start of the window
+        time_max: End of the window
+
+    Returns:
+        List of Calendar event resources ordered by start time, tagged with
+        their calendarId
+    """
+    days = (parse_event_time(time_max) - parse_event_time(time_min)).days
+    if days > 7:
+        events = fetch_events_concurrently(
+            service, time_min, time_max, calendar_id, parts=min(days // 7 + 1, 4)
+        )
+    else:
+        events = list(
+            iter_events(
+                service,
+                calendar_id,
+                timeMin=time_min,
+                timeMax=time_max,
+                orderBy="startTime",
+            )
+        )
+    for event in events:
+        event["calendarId"] = calendar_id
+    return events
+
+
+def fetch_calendars(
+    service, calendar_ids: List[str], time_min: str, time_max: str
+) -> List[Dict]:
+    """
+    Fetch several calendars in parallel and merge them.
+
+    Args:
+        service: Google Calendar service
+        calendar_ids: IDs of the calendars
+        time_min: Start of the window
+        time_max: End of the window
+
+    Returns:
+        List of Calendar event resources ordered by start time
+    """
+    return merge_events(
+        list(
+            calendar_fetch_pool.map(
+                lambda calendar_id: fetch_calendar(
+                    service, calendar_id, time_min, time_max
+                ),
+                calendar_ids,
+            )
+        )
+    )
+
+
+def query_busy(
+    service, calendar_ids: List[str], time_min: str, time_max: str
+) -> List[Tuple[float, float, str]]:
+    """
+    Get the busy time of calendars whose event details are not needed.
+
+    Args:
+        service: Google Calendar service
+        calendar_ids: IDs of the calendars
+        time_min: Start of the window
+        time_max: End of the window
+
+    Returns:
+        List of (start, end, calendar ID) tuples with UTC timestamps
+    """
+    busy = []
+    for first in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS):
+        response = (
+            service.freebusy()
+            .query(
+                body={
+                    "timeMin": time_min,
+                    "timeMax": time_max,
+                    "items": [
+                        {"id": calendar_id}
+                        for calendar_id in calendar_ids[
+                            first : first + FREEBUSY_MAX_CALENDARS
+                        ]
+                    ],
+                }
+            )
+            .execute()
+        )
+        for calendar_id, calendar in response.get("calendars", {}).items():
+            for block in calendar.get("busy", []):
+                busy.append(
+                    (
+                        parse_event_time(block["start"]).timestamp(),
+                        parse_event_time(block["end"]).timestamp(),
+                        calendar_id,
+                    )
+                )
+    return busy
+
+
+class EventStore:
+    """
+    Local copy of a user's calendar, kept up to date with incremental sync.
+
+    The first sync downloads every event from SYNC_LOOKBACK ago onwards. Later
+    syncs send the stored syncToken so Google only returns what changed.
+    """
+
+    # How long a sync is trusted before Google is asked for changes again
+    SYNC_INTERVAL = 60
+
+    # How far back the full sync reaches
+    SYNC_LOOKBACK = timedelta(days=30)
+
+    # Number of recent changes remembered for changed_since
+    CHANGE_LOG_SIZE = 1000
+
+    def __init__(self, calendar_id: str = "primary"):
+        self.calendar_id = calendar_id
+        # Raised while push notifications report changes as they happen
+        self.sync_interval = self.SYNC_INTERVAL
+        self.events = {}
+        self.index = IntervalIndex()
+        self.sync_token = None
+        self.synced_at = None
+        self.window_start = None
+        # Incremented on every change to the stored events
+        self.version = 0
+        # (version, start, end) of recent changes, complete from _changes_since
+        self.changes = deque(maxlen=self.CHANGE_LOG_SIZE)
+        self._changes_since = 0
+        self._lock = threading.RLock()
+
+    def covers(self, time_min: str) -> bool:
+        """Return whether windows starting at time_min can be answered locally."""
+        with self._lock:
+            return self.window_start is None or parse_event_time(time_min) >= (
+                self.window_start
+            )
+
+    def sync(self, service, force: bool = False) -> None:
+        """
+        Bring the store up to date unless it was synced recently.
+
+        Args:
+            service: Google Calendar service
+            force: Sync even if the last sync is recent
+        """
+        with self._lock:
+            if (
+                not force
+                and self.synced_at is not None
+                and time.monotonic() - self.synced_at < self.sync_interval
+            ):
+                return
+
+            if self.sync_token:
+                try:
+                    self._incremental_sync(service)
+                except HttpError as e:
+                    # The sync token expired, start over
+                    if e.resp.status != 410:
+                        raise
+                    self._full_sync(service)
+            else:
+                self._full_sync(service)
+
+            self.synced_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        """Make the next read fetch changes from Google."""
+        with self._lock:
+            self.synced_at = None
+
+    def _fetch(self, service, **params) -> List[Dict]:
+        items = []
+        for page in iter_event_pages(
+            service, self.calendar_id, MAX_PAGE_SIZE, **params
+        ):
+            items.extend(page.get("items", []))
+            self.sync_token = page.get("nextSyncToken")
+        return items
+
+    def _full_sync(self, service) -> None:
+        window_start = datetime.now(timezone.utc) - self.SYNC_LOOKBACK
+        items = self._fetch(service, timeMin=format_api_time(window_start))
+
+        self.events = {}
+        self.index = IntervalIndex()
+        self.window_start = window_start
+        for event in items:
+            self.apply(event)
+        self.version += 1
+        # Everything may have changed
+        self.changes.clear()
+        self._changes_since = self.version
+
+    def _incremental_sync(self, service) -> None:
+        for event in self._fetch(service, syncToken=self.sync_token):
+            self.apply(event)
+
+    def apply(self, event: Dict) -> None:
+        """
+        Store a new or changed event, or drop it if it was cancelled.
+
+        Args:
+            event: Calendar event resource
+        """
+        with self._lock:
+            self.remove(event["id"])
+            if event.get("status") == "cancelled":
+                return
+
+            start, end = event_bounds(event)
+            event["calendarId"] = self.calendar_id
+            self.events[event["id"]] = event
+            self.index.add(start, end, event["id"])
+            self.version += 1
+            self.changes.append((self.version, start, end))
+
+    def remove(self, event_id: str) -> None:
+        """
+        Drop an event from the store.
+
+        Args:
+            event_id: ID of the event
+        """
+        with self._lock:
+            event = self.events.pop(event_id, None)
+            if event is not None:
+                start, end = event_bounds(event)
+                self.index.remove(start, end, event_id)
+                self.version += 1
+                self.changes.append((self.version, start, end))
+
+    def changed_since(self, version: int) -> Optional[List[tuple]]:
+        """
+        Get the time ranges touched by changes after a version.
+
+        Args:
+            version: Version the caller has seen
+
+        Returns:
+            List of (start, end) timestamps, or None if the changes since that
+            version are no longer known
+        """
+        with self._lock:
+            complete_since = self._changes_since
+            if len(self.changes) == self.changes.maxlen:
+                complete_since = self.changes[0][0] - 1
+            if version < complete_since or version > self.version:
+                return None
+            return [
+                (start, end)
+                for changed, start, end in self.changes
+                if changed > version
+            ]
+
+    def get(self, event_id: str) -> Optional[Dict]:
+        """Get a stored event by its ID."""
+        with self._lock:
+            return self.events.get(event_id)
+
+    def query(self, time_min: str, time_max: Optional[str] = None) -> List[Dict]:
+        """
+        Get the events overlapping a time window.
+
+        Args:
+            time_min: Start of the window
+            time_max: Optional end of the window
+
+        Returns:
+            List of Calendar event resources ordered by start time
+        """
+        start = parse_event_time(time_min).timestamp()
+        end = parse_event_time(time_max).timestamp() if time_max else float("inf")
+        with self._lock:
+            return [
+                self.events[event_id]
+                for _, _, event_id in self.index.overlapping(start, end)
+            ]
+
+
+class CalendarSet:
+    """
+    Event stores of several calendars, read as one.
+
+    Reads merge the calendars in start order, dropping events which appear in
+    more than one. The version combines the versions of every calendar, e.g.
+    "12.3.7".
+    """
+
+    def __init__(self, calendar_ids: Iterable[str]):
+        """
+        Args:
+            calendar_ids: IDs of the calendars, the first one is the default
+        """
+        self.stores = {
+            calendar_id: EventStore(calendar_id) for calendar_id in calendar_ids
+        }
+        self.default = next(iter(self.stores.values()))
+
+    @property
+    def version(self) -> str:
+        return ".".join(str(store.version) for store in self.stores.values())
+
+    def covers(self, time_min: str) -> bool:
+        """Return whether windows starting at time_min can be answered locally."""
+        return all(store.covers(time_min) for store in self.stores.values())
+
+    def sync(self, service, force: bool = False) -> None:
+        """
+        Bring every calendar up to date, in parallel.
+
+        Args:
+            service: Google Calendar service
+            force: Sync even if the last sync is recent
+        """
+        if len(self.stores) == 1:
+            self.default.sync(service, force)
+            return
+        list(
+            calendar_fetch_pool.map(
+                lambda store: store.sync(service, force), self.stores.values()
+            )
+        )
+
+    def invalidate(self) -> None:
+        """Make the next read fetch changes from Google."""
+        for store in self.stores.values():
+            store.invalidate()
+
+    def apply(self, event: Dict) -> None:
+        """
+        Store a new or changed event in the calendar named by its calendarId.
+
+        Args:
+            event: Calendar event resource
+        """
+        self.stores.get(event.get("calendarId"), self.default).apply(event)
+
+    def remove(self, event_id: str, calendar_id: Optional[str] = None) -> None:
+        """
+        Drop an event.
+
+        Args:
+            event_id: ID of the event
+            calendar_id: Calendar to drop it from, all of them if None
+        """
+        for store_id, store in self.stores.items():
+            if calendar_id is None or store_id == calendar_id:
+                store.remove(event_id)
+
+    def changed_since(self, version: str) -> Optional[List[tuple]]:
+        """
+        Get the time ranges touched by changes after a version.
+
+        Args:
+            version: Combined version the caller has seen
+
+        Returns:
+            List of (start, end) timestamps, or None if the changes since that
+            version are no longer known
+        """
+        try:
+            versions = [int(part) for part in str(version).split(".")]
+        except ValueError:
+            return None
+        if len(versions) != len(self.stores):
+            return None
+
+        changes = []
+        for store, store_version in zip(self.stores.values(), versions):
+            store_changes = store.changed_since(store_version)
+            if store_changes is None:
+                return None
+            changes.extend(store_changes)
+        return changes
+
+    def get(self, event_id: str) -> Optional[Dict]:
+        """Get a stored event by its ID, from the first calendar holding it."""
+        for store in self.stores.values():
+            event = store.get(event_id)
+            if event is not None:
+                return event
+        return None
+
+    def query(self, time_min: str, time_max: Optional[str] = None) -> List[Dict]:
+        """
+        Get the events of all calendars overlapping a time window.
+
+        Args:
+            time_min: Start of the window
+            time_max: Optional end of the window
+
+        Returns:
+            List of Calendar event resources ordered by start time
+        """
+        return merge_events(
+            [store.query(time_min, time_max) for store in self.stores.values()]
+        )
@@ -0,0 +1,44 @@
+"""
+Gunicorn settings for serving TimeCraft in production.
+
+Usage:
+    gunicorn -c gunicorn.conf.py
+
+The app is loaded once in the master and workers are forked from it, so a
+worker boots in milliseconds and shares the imported modules and the
+Calendar discovery document with its siblings.
+"""
+
+import os
+
+wsgi_app = "main:create_app(preload=True)"
+bind = os.getenv("BIND", "0.0.0.0:8000")
+preload_app = True
+
+# Requests spend most of their time waiting on Google and Groq, so one process
+# serves many of them on threads. Conversations, event stores and prefetched
+# windows live in process memory, so more than one worker needs sessions
+# pinned to a worker by the load balancer.
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+
+# Chat streams and large action plans can take a while
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    """
+    Start the job workers of the new process, threads do not survive forks.
+
+    Also record when the worker started, so operations left pending before
+    then are the only ones it resumes.
+    """
+    import main
+
+    main.record_process_start()
+    main.get_job_queue()
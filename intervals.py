@@ -0,0 +1,233 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import Container, Hashable, Iterator, List, Tuple
+
+
+class IntervalIndex:
+    """Intervals sorted by start time, supporting fast overlap queries."""
+
+    def __init__(self):
+        self._starts = []
+        self._intervals = []
+        # Length of the longest stored interval, used to limit how far back
+        # an overlap query has to look
+        self._max_length = 0
+
+    @classmethod
+    def from_intervals(cls, intervals: List[Tuple[float, float, Hashable]]):
+        """
+        Build an index from many intervals at once.
+
+        Args:
+            intervals: List of (start, end, key) tuples
+
+        Returns:
+            The new index
+        """
+        index = cls()
+        index._intervals = sorted(intervals, key=lambda interval: interval[0])
+        index._starts = [interval[0] for interval in index._intervals]
+        index._max_length = max((end - start for start, end, _ in intervals), default=0)
+        return index
+
+    def add(self, start: float, end: float, key: Hashable) -> None:
+        """
+        Add an interval.
+
+        Args:
+            start: Start of the interval
+            end: End of the interval
+            key: Value identifying the interval
+        """
+        position = bisect_right(self._starts, start)
+        self._starts.insert(position, start)
+        self._intervals.insert(position, (start, end, key))
+        self._max_length = max(self._max_length, end - start)
+
+    def remove(self, start: float, end: float, key: Hashable) -> None:
+        """
+        Remove an interval previously added with the same arguments.
+
+        Args:
+            start: Start of the interval
+            end: End of the interval
+            key: Value identifying the interval
+        """
+        position = bisect_left(self._starts, start)
+        while position < len(self._starts) and self._starts[position] == start:
+            if self._intervals[position] == (start, end, key):
+                del self._starts[position]
+                del self._intervals[position]
+                if end - start >= self._max_length:
+                    # Rare, so a scan is cheaper than tracking every length
+                    self._max_length = max(
+                        (interval[1] - interval[0] for interval in self._intervals),
+                        default=0,
+                    )
+                return
+            position += 1
+
+    def overlapping(
+        self, start: float, end: float
+    ) -> List[Tuple[float, float, Hashable]]:
+        """
+        Find the intervals overlapping a range.
+
+        Args:
+            start: Start of the range
+            end: End of the range
+
+        Returns:
+            List of (start, end, key) tuples overlapping the range, ordered by start
+        """
+        first = bisect_left(self._starts, start - self._max_length)
+        last = bisect_left(self._starts, end)
+        return [
+            interval for interval in self._intervals[first:last] if interval[1] > start
+        ]
+
+    def __iter__(self) -> Iterator[Tuple[float, float, Hashable]]:
+        return iter(self._intervals)
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+
+def merge_intervals(intervals: List[Tuple]) -> List[Tuple]:
+    """
+    Merge overlapping or touching intervals.
+
+    Args:
+        intervals: List of (start, end) tuples
+
+    Returns:
+        List of disjoint (start, end) tuples ordered by start
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class FreeBusyIndex:
+    """Busy time of a calendar, for conflict checks and free slot search."""
+
+    def __init__(self, intervals: List[Tuple[float, float, Hashable]]):
+        """
+        Args:
+            intervals: List of (start, end, key) tuples of the busy events
+        """
+        self.events = IntervalIndex.from_intervals(intervals)
+        self._by_key = defaultdict(list)
+        for interval in intervals:
+            self._by_key[interval[2]].append(interval)
+        self.busy = merge_intervals([(start, end) for start, end, _ in intervals])
+        self._busy_starts = [start for start, _ in self.busy]
+        self._busy_ends = [end for _, end in self.busy]
+
+    def add(self, start: float, end: float, key: Hashable) -> None:
+        """
+        Mark an interval as busy.
+
+        Args:
+            start: Start of the interval
+            end: End of the interval
+            key: Value identifying the interval
+        """
+        self.events.add(start, end, key)
+        self._by_key[key].append((start, end, key))
+        # Only the busy blocks the interval overlaps or touches are merged
+        first = bisect_left(self._busy_ends, start)
+        last = bisect_right(self._busy_starts, end)
+        if first < last:
+            start = min(start, self.busy[first][0])
+            end = max(end, self.busy[last - 1][1])
+        self._splice(first, last, [(start, end)])
+
+    def remove(self, key: Hashable) -> None:
+        """
+        Free the intervals of an event, e.g. before it moves elsewhere.
+
+        Args:
+            key: Value identifying the intervals
+        """
+        intervals = self._by_key.pop(key, [])
+        if not intervals:
+            return
+        for start, end, _ in intervals:
+            self.events.remove(start, end, key)
+            # The events left in the busy block of the interval make it up anew
+            position = bisect_right(self._busy_starts, start) - 1
+            block_start, block_end = self.busy[position]
+            self._splice(
+                position,
+                position + 1,
+                merge_intervals(
+                    [
+                        (event_start, event_end)
+                        for event_start, event_end, _ in self.events.overlapping(
+                            block_start, block_end
+                        )
+                    ]
+                ),
+            )
+
+    def _splice(self, first: int, last: int, blocks: List[Tuple]) -> None:
+        """Replace the busy blocks from first up to last with others."""
+        self.busy[first:last] = blocks
+        self._busy_starts[first:last] = [block_start for block_start, _ in blocks]
+        self._busy_ends[first:last] = [block_end for _, block_end in blocks]
+
+    def conflicts(
+        self, start: float, end: float, ignore: Container = ()
+    ) -> List[Hashable]:
+        """
+        Find the events overlapping a range.
+
+        Args:
+            start: Start of the range
+            end: End of the range
+            ignore: Keys of events which do not count as conflicts
+
+        Returns:
+            List of keys of the overlapping events, ordered by start
+        """
+        return [
+            key
+            for _, _, key in self.events.overlapping(start, end)
+            if key not in ignore
+        ]
+
+    def free_slots(
+        self, start: float, end: float, min_length: float = 0
+    ) -> List[Tuple[float, float]]:
+        """
+        Find the free time within a range.
+
+        Args:
+            start: Start of the range
+            end: End of the range
+            min_length: Shortest slot worth returning
+
+        Returns:
+            List of (start, end) tuples of the free slots, ordered by start
+        """
+        slots = []
+        cursor = start
+        first = max(bisect_right(self._busy_starts, start) - 1, 0)
+        for busy_start, busy_end in self.busy[first:]:
+            if busy_start >= end:
+                break
+            if busy_end <= cursor:
+                continue
+            if busy_start - cursor >= min_length and busy_start > cursor:
+                slots.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+
+        if end - cursor >= min_length and end > cursor:
+            slots.append((cursor, end))
+        return slots
@@ -0,0 +1,245 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+
+class JobDeferred(Exception):
+    """
+    Raised by a job handler when the job cannot run yet.
+
+    The message says what the job waits for, and becomes its error if it
+    waits too long.
+    """
+
+
+class JobQueue:
+    """
+    Persistent queue of background jobs, stored in SQLite.
+
+    A job holds a JSON payload and JSON progress. Handlers record progress as
+    they go, so a job interrupted by a restart resumes where it stopped.
+    """
+
+    def __init__(self, path: str, recover: bool = True):
+        """
+        Args:
+            path: Path of the database file
+            recover: Requeue jobs left running by a previous process. Only one
+                of several processes sharing the file should do this, before
+                any of them runs jobs.
+        """
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, owner TEXT NOT NULL, status TEXT NOT NULL, "
+                "payload TEXT NOT NULL, progress TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, error TEXT, "
+                "not_before REAL NOT NULL, created REAL NOT NULL, "
+                "updated REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, not_before)"
+            )
+            if recover:
+                # Jobs running when the process stopped are picked up again
+                self._connection.execute(
+                    "UPDATE jobs SET status = 'queued' WHERE status = 'running'"
+                )
+
+    def enqueue(self, owner: str, payload: Dict) -> str:
+        """
+        Add a job.
+
+        Args:
+            owner: Session identity of the user the job belongs to
+            payload: JSON-serializable description of the work
+
+        Returns:
+            ID of the job
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO jobs (id, owner, status, payload, progress, "
+                "not_before, created, updated) VALUES (?, ?, 'queued', ?, '{}', ?, ?, ?)",
+                (job_id, owner, json.dumps(payload), now, now, now),
+            )
+        return job_id
+
+    def claim(self) -> Optional[Dict]:
+        """
+        Take the oldest job which is due and mark it as running.
+
+        Returns:
+            The job, or None if no job is due
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND not_before <= ? "
+                "ORDER BY created LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = self._connection.execute(
+                "UPDATE jobs SET status = 'running', updated = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (now, row["id"]),
+            ).rowcount
+        if not claimed:
+            # Another process sharing the file took it first
+            return None
+        return self._to_dict(row, status="running")
+
+    def save_progress(self, job_id: str, progress: Dict) -> None:
+        """Replace the progress of a job."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET progress = ?, updated = ? WHERE id = ?",
+                (json.dumps(progress), time.time(), job_id),
+            )
+
+    def finish(self, job_id: str, status: str = "done", error: str = None) -> None:
+        """
+        Mark a running job as finished.
+
+        Args:
+            job_id: ID of the job
+            status: "done", "failed", or "cancelled"
+            error: Optional description of what went wrong
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? "
+                "WHERE id = ? AND status = 'running'",
+                (status, error, time.time(), job_id),
+            )
+
+    def retry(self, job_id: str, delay: float, error: str = None) -> None:
+        """
+        Put a running job back in the queue.
+
+        Args:
+            job_id: ID of the job
+            delay: Seconds before the job may run again
+            error: Optional description of why the attempt failed
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts + ?, "
+                "error = ?, not_before = ?, updated = ? "
+                "WHERE id = ? AND status = 'running'",
+                (1 if error else 0, error, now + delay, now, job_id),
+            )
+
+    def cancel_owner(self, owner: str) -> None:
+        """Cancel the jobs of a user which have not finished."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'cancelled', updated = ? "
+                "WHERE owner = ? AND status IN ('queued', 'running')",
+                (time.time(), owner),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Get a job by its ID."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return None if row is None else self._to_dict(row)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
+
+    def _to_dict(self, row: sqlite3.Row, **overrides) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["progress"] = json.loads(job["progress"])
+        job.update(overrides)
+        return job
+
+
+class JobWorkers:
+    """Pool of threads running the jobs of a queue."""
+
+    # Failed attempts before a job is given up
+    MAX_ATTEMPTS = 5
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Callable[[Dict], None],
+        workers: int = 2,
+        poll_interval: float = 0.5,
+        retry_backoff: float = 2.0,
+        defer_timeout: float = 3600,
+    ):
+        """
+        Args:
+            queue: Queue to take jobs from
+            handler: Function running a job. It raises JobDeferred to run the
+                job later, and any other exception to retry it with backoff.
+            workers: Number of threads
+            poll_interval: Seconds an idle thread waits before checking again
+            retry_backoff: Seconds before the first retry, doubled on every
+                further attempt
+            defer_timeout: Seconds after it was enqueued that a job still
+                deferred is given up
+        """
+        self.queue = queue
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.retry_backoff = retry_backoff
+        self.defer_timeout = defer_timeout
+        self._wake = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run, daemon=True) for _ in range(workers)
+        ]
+
+    def start(self) -> None:
+        """Start the threads."""
+        for thread in self._threads:
+            thread.start()
+
+    def notify(self) -> None:
+        """Wake an idle thread, e.g. right after a job was enqueued."""
+        self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            job = self.queue.claim()
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            try:
+                self.handler(job)
+            except JobDeferred as e:
+                if time.time() - job["created"] >= self.defer_timeout:
+                    self.queue.finish(
+                        job["id"], "failed", str(e) or "Job could not run in time"
+                    )
+                else:
+                    self.queue.retry(job["id"], self.poll_interval * 10)
+            except Exception as e:
+                if job["attempts"] + 1 >= self.MAX_ATTEMPTS:
+                    self.queue.finish(job["id"], "failed", str(e))
+                else:
+                    self.queue.retry(
+                        job["id"], self.retry_backoff * 2 ** job["attempts"], str(e)
+                    )
+            else:
+                self.queue.finish(job["id"])
@@ -0,0 +1,200 @@
+import base64
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+def idempotency_key(*parts) -> str:
+    """
+    Hash the parts describing an operation into a key identifying it.
+
+    Args:
+        *parts: JSON-serializable parts, e.g. the operation, calendar, summary,
+            start and end
+
+    Returns:
+        Hex digest which is the same for the same parts
+    """
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def event_id_for(key: str) -> str:
+    """
+    Derive a Calendar event ID from an idempotency key.
+
+    Calendar accepts client-supplied IDs of 5 to 1024 characters of the
+    base32hex alphabet (0-9 and a-v). Inserting an ID that exists fails with
+    409, so a repeated insert cannot create a second event.
+
+    Args:
+        key: Key from idempotency_key
+
+    Returns:
+        Event ID
+    """
+    return base64.b32hexencode(bytes.fromhex(key)).decode().rstrip("=").lower()
+
+
+class ActionJournal:
+    """
+    Write-ahead log of calendar operations, stored in SQLite.
+
+    Operations are recorded as pending before any API call and marked done or
+    failed once their outcome is known. Pending operations left by a process
+    which stopped can be run again, which is safe as every operation is
+    idempotent.
+    """
+
+    # Seconds finished operations are kept
+    RETENTION = 7 * 24 * 3600
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Path of the database file
+        """
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            # Writers append to the log without blocking readers, and a commit
+            # only waits for the log, not the database file
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS operations ("
+                "owner TEXT NOT NULL, key TEXT NOT NULL, operation TEXT NOT NULL, "
+                "payload TEXT NOT NULL, status TEXT NOT NULL, result TEXT, "
+                "created REAL NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (owner, key))"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS operations_owner "
+                "ON operations (owner, status)"
+            )
+            self._connection.execute(
+                "DELETE FROM operations WHERE status != 'pending' AND updated < ?",
+                (time.time() - self.RETENTION,),
+            )
+
+    def begin(
+        self, owner: str, operations: List[Tuple[str, str, Dict]]
+    ) -> Dict[str, Dict]:
+        """
+        Record operations as pending, in one transaction.
+
+        Args:
+            owner: Session identity of the user
+            operations: List of (key, operation, payload) tuples, the payload
+                being JSON-serializable input to run the operation again
+
+        Returns:
+            Dictionary mapping the keys which were recorded before to their
+            earlier entry
+        """
+        now = time.time()
+        keys = [key for key, _, _ in operations]
+        with self._lock, self._connection:
+            earlier = {}
+            for first in range(0, len(keys), 500):
+                chunk = keys[first : first + 500]
+                rows = self._connection.execute(
+                    "SELECT * FROM operations WHERE owner = ? AND key IN "
+                    f"({', '.join('?' * len(chunk))})",
+                    [owner, *chunk],
+                ).fetchall()
+                earlier.update((row["key"], self._to_dict(row)) for row in rows)
+            self._connection.executemany(
+                "INSERT INTO operations (owner, key, operation, payload, status, "
+                "created, updated) VALUES (?, ?, ?, ?, 'pending', ?, ?) "
+                "ON CONFLICT (owner, key) DO UPDATE SET status = 'pending', "
+                "payload = excluded.payload, updated = excluded.updated",
+                [
+                    (owner, key, operation, json.dumps(payload), now, now)
+                    for key, operation, payload in operations
+                ],
+            )
+        return earlier
+
+    def finish(self, owner: str, results: Dict[str, Dict]) -> None:
+        """
+        Record the outcome of operations, in one transaction.
+
+        Args:
+            owner: Session identity of the user
+            results: Dictionary mapping keys to the result of their operation,
+                with a success flag
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE operations SET status = ?, result = ?, updated = ? "
+                "WHERE owner = ? AND key = ?",
+                [
+                    (
+                        "done" if result.get("success") else "failed",
+                        json.dumps(result),
+                        now,
+                        owner,
+                        key,
+                    )
+                    for key, result in results.items()
+                ],
+            )
+
+    def abandon(self, owner: str, keys: List[str], before: float) -> int:
+        """
+        Give up operations which are still pending, e.g. after running them
+        again failed.
+
+        Args:
+            owner: Session identity of the user
+            keys: Keys of the operations
+            before: Only give up operations last recorded before this time,
+                so those recorded again since are left to their new run
+
+        Returns:
+            Number of operations given up
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            return self._connection.executemany(
+                "UPDATE operations SET status = 'abandoned', updated = ? "
+                "WHERE owner = ? AND key = ? AND status = 'pending' "
+                "AND updated < ?",
+                [(now, owner, key, before) for key in keys],
+            ).rowcount
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
+
+    def pending(self, owner: str, before: Optional[float] = None) -> List[Dict]:
+        """
+        Get the pending operations of a user, oldest first.
+
+        Args:
+            owner: Session identity of the user
+            before: Only return operations last recorded before this time
+
+        Returns:
+            List of operations
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM operations WHERE owner = ? AND status = 'pending' "
+                "AND updated < ? ORDER BY created",
+                (owner, time.time() if before is None else before),
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def _to_dict(self, row: sqlite3.Row) -> Dict:
+        entry = dict(row)
+        entry["payload"] = json.loads(entry["payload"])
+        entry["result"] = json.loads(entry["result"]) if entry["result"] else None
+        return entry
@@ -0,0 +1,194 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from heapq import heappop, heappush
+from typing import Dict, List, NamedTuple, Tuple
+
+# Grid geometry, one pixel per minute with the grid starting below the header
+HEADER_HEIGHT = 40
+HOUR_HEIGHT = 60
+FIRST_MINUTE = 6.5 * 60
+DAY_MINUTES = 24 * 60
+
+
+class EventBox(NamedTuple):
+    """
+    Position of an event, or of the part of it on one day, in the grid.
+
+    All-day events sit in a row above the grid, so their position and times
+    are left empty.
+    """
+
+    eventId: str
+    summary: str
+    start_time: str
+    end_time: str
+    start_pixel: float
+    duration: float
+    column: int
+    columns: int
+    all_day: bool = False
+
+
+def minute_to_pixel(minute: float) -> float:
+    """Convert a minute of the day into a vertical offset in the grid."""
+    return minute - FIRST_MINUTE + HEADER_HEIGHT / HOUR_HEIGHT * 60
+
+
+def split_days(
+    starts: List[datetime], ends: List[datetime]
+) -> Tuple[List[str], List[int], List[int], List[int]]:
+    """
+    Split events into one segment per day they cover.
+
+    Args:
+        starts: Start of each event
+        ends: End of each event
+
+    Returns:
+        Parallel lists of the day, start minute, end minute and event index of
+        every segment
+    """
+    days, start_minutes, end_minutes, owners = [], [], [], []
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        day = start.date()
+        last = end.date()
+        start_minute = start.hour * 60 + start.minute
+        end_minute = end.hour * 60 + end.minute
+        # An event ending at midnight ends with the previous day
+        if end_minute == 0 and last > day:
+            last -= timedelta(days=1)
+            end_minute = DAY_MINUTES
+
+        while day < last:
+            days.append(day.isoformat())
+            start_minutes.append(start_minute)
+            end_minutes.append(DAY_MINUTES)
+            owners.append(i)
+            day += timedelta(days=1)
+            start_minute = 0
+
+        days.append(day.isoformat())
+        start_minutes.append(start_minute)
+        end_minutes.append(max(end_minute, start_minute))
+        owners.append(i)
+    return days, start_minutes, end_minutes, owners
+
+
+def pack_columns(
+    starts: List[int], ends: List[int]
+) -> Tuple[List[int], List[int], List[int]]:
+    """
+    Assign overlapping segments of one day to side-by-side columns.
+
+    Segments are swept in start order. Each takes the lowest column free at
+    its start, and every group of transitively overlapping segments is split
+    into as many columns as it needs at its busiest.
+
+    Args:
+        starts: Start minute of each segment
+        ends: End minute of each segment
+
+    Returns:
+        Tuple of the segment indices in start order, the column of each
+        segment, and the number of columns of its group
+    """
+    order = sorted(range(len(starts)), key=lambda k: (starts[k], -ends[k]))
+    column = [0] * len(starts)
+    columns = [1] * len(starts)
+
+    active = []  # (end, column) of the segments still running
+    free = []  # Columns released within the current group
+    group = []
+    group_columns = 0
+    for k in order:
+        while active and active[0][0] <= starts[k]:
+            heappush(free, heappop(active)[1])
+        if not active:
+            # Nothing overlaps any more, close the group
+            for member in group:
+                columns[member] = group_columns
+            group, group_columns, free = [], 0, []
+
+        column[k] = heappop(free) if free else group_columns
+        group_columns = max(group_columns, column[k] + 1)
+        heappush(active, (ends[k], column[k]))
+        group.append(k)
+
+    for member in group:
+        columns[member] = group_columns
+    return order, column, columns
+
+
+def layout_events(events: List[Dict]) -> Dict[str, List[EventBox]]:
+    """
+    Compute where events go in the calendar grid.
+
+    Events are parsed once into parallel lists, split at midnight, and
+    packed into columns per day so overlapping events sit side by side.
+    All-day events take no time in the grid, so they are left out of the
+    packing and get a box on every day they cover instead.
+
+    Args:
+        events: List of Calendar event resources
+
+    Returns:
+        Dictionary mapping each day to the boxes on it, the all-day ones
+        first and the others ordered by start
+    """
+    days_events = defaultdict(list)
+    timed = []
+    for event in events:
+        if "dateTime" in event["start"]:
+            timed.append(event)
+            continue
+        # The end date of an all-day event is exclusive
+        day = date.fromisoformat(event["start"]["date"])
+        last = max(date.fromisoformat(event["end"]["date"]), day + timedelta(days=1))
+        while day < last:
+            days_events[day.isoformat()].append(
+                EventBox(
+                    event["id"],
+                    event.get("summary", "No Title"),
+                    "",
+                    "",
+                    0,
+                    0,
+                    0,
+                    1,
+                    all_day=True,
+                )
+            )
+            day += timedelta(days=1)
+
+    starts = [datetime.fromisoformat(event["start"]["dateTime"]) for event in timed]
+    ends = [datetime.fromisoformat(event["end"]["dateTime"]) for event in timed]
+    start_times = [start.strftime("%H:%M") for start in starts]
+    end_times = [end.strftime("%H:%M") for end in ends]
+
+    days, start_minutes, end_minutes, owners = split_days(starts, ends)
+    segments_by_day = defaultdict(list)
+    for segment, day in enumerate(days):
+        segments_by_day[day].append(segment)
+
+    for day, segments in segments_by_day.items():
+        day_starts = [start_minutes[segment] for segment in segments]
+        day_ends = [end_minutes[segment] for segment in segments]
+        order, column, columns = pack_columns(day_starts, day_ends)
+
+        boxes = days_events[day]
+        for k in order:
+            event_index = owners[segments[k]]
+            event = timed[event_index]
+            boxes.append(
+                EventBox(
+                    event["id"],
+                    event.get("summary", "No Title"),
+                    start_times[event_index],
+                    end_times[event_index],
+                    minute_to_pixel(day_starts[k]),
+                    day_ends[k] - day_starts[k],
+                    column[k],
+                    columns[k],
+                )
+            )
+    return dict(days_events)
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from cache import TTLCache
+
+
+def prompt_key(model: str, messages: List[Dict[str, str]], **params) -> str:
+    """
+    Hash a prompt into a cache key.
+
+    Whitespace is collapsed in every message, so trivially different spacing
+    shares an entry. Case is kept, as it can change what the user asked for.
+    The system prompt carries the calendar context, so any change to the
+    calendar produces a new key.
+
+    Args:
+        model: Name of the model
+        messages: Chat messages with role and content
+        **params: Other parameters which influence the completion
+
+    Returns:
+        Hex digest identifying the prompt
+    """
+    normalized = []
+    for message in messages:
+        normalized.append([message["role"], " ".join(message["content"].split())])
+
+    payload = json.dumps(
+        {"model": model, "messages": normalized, "params": params},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class MemoryBackend:
+    """Keeps responses in process memory."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600):
+        """
+        Args:
+            max_size: Maximum number of responses kept
+            ttl: Seconds a response stays valid
+        """
+        self._entries = TTLCache(max_size=max_size, ttl=ttl)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._entries.get(key)
+
+    def set(self, key: str, value: str) -> None:
+        self._entries.set(key, value)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class SQLiteBackend:
+    """Keeps responses in a SQLite database, so they survive restarts."""
+
+    def __init__(self, path: str, max_size: int = 10000, ttl: float = 86400):
+        """
+        Args:
+            path: Path of the database file
+            max_size: Maximum number of responses kept
+            ttl: Seconds a response stays valid
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires REAL NOT NULL, used REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_used ON responses (used)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value, expires FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._connection.execute(
+                "UPDATE responses SET used = ? WHERE key = ?", (now, key)
+            )
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now),
+            )
+            # Evict expired responses, then the least recently used
+            self._connection.execute("DELETE FROM responses WHERE expires < ?", (now,))
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                "ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+
+
+class ResponseCache:
+    """Cache of deterministic LLM responses, with hit and saved latency counters."""
+
+    def __init__(self, backend):
+        """
+        Args:
+            backend: MemoryBackend, SQLiteBackend, or any object with get, set
+                and clear
+        """
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get a cached response.
+
+        Args:
+            key: Key built by prompt_key
+
+        Returns:
+            The response content, or None on a miss
+        """
+        entry = self.backend.get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            entry = json.loads(entry)
+            self.hits += 1
+            # A hit saves as long as the call which produced the response took
+            self.saved_seconds += entry["latency"]
+        return entry["content"]
+
+    def set(self, key: str, value: str, latency: float = 0.0) -> None:
+        """
+        Store a response.
+
+        Args:
+            key: Key built by prompt_key
+            value: Response content
+            latency: Seconds the LLM call took
+        """
+        self.backend.set(key, json.dumps({"content": value, "latency": latency}))
+
+    def clear(self) -> None:
+        """Drop all cached responses."""
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get the cache counters.
+
+        Returns:
+            Dictionary containing hits, misses, and saved_seconds
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "saved_seconds": self.saved_seconds,
+            }
@@ -1,23 +1,197 @@
 import json
+import math
 import os
-from collections import defaultdict
+import queue
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Union
+from datetime import timezone as dt_timezone
+from typing import Dict, Iterator, List, Optional, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify, redirect, render_template, request, session, url_for
-from google.auth.transport.requests import Request
+from flask import (
+    Flask,
+    Response,
+    after_this_request,
+    copy_current_request_context,
+    has_request_context,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    session,
+    stream_with_context,
+    url_for,
+)
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from groq import Groq
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from cache import TTLCache
+from context import (
+    build_calendar_context,
+    count_message_tokens,
+    encode_free_slots,
+    estimate_tokens,
+    fit_history,
+)
+from conversations import ConversationStore
+from event_store import (
+    CalendarSet,
+    EventStore,
+    fetch_calendars,
+    parse_event_time,
+    query_busy,
+)
+from intervals import FreeBusyIndex
+from jobs import JobDeferred, JobQueue, JobWorkers
+from journal import ActionJournal, event_id_for, idempotency_key
+from layout import layout_events
+from llm_cache import MemoryBackend, ResponseCache, SQLiteBackend, prompt_key
+from outbound import OutboundScheduler, PooledHttp, Throttled, parse_retry_after
+from tracing import Tracer, prometheus_text, server_timing
+from watch import ChangeFeed, WatchChannels
 
 load_dotenv()
 
 # Flask app setup
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY")
-groq = Groq(api_key=os.getenv("GROQ_API_KEY"))
+
+# Groq client, created on first use by get_groq. The groq package takes a
+# large share of the import time, so it is only imported then too.
+groq = None
+_groq_lock = threading.Lock()
+
+
+def get_groq():
+    """Return the Groq client of this process."""
+    global groq
+    with _groq_lock:
+        if groq is None:
+            import httpx
+            from groq import DefaultHttpxClient, Groq
+
+            # Retries go through groq_scheduler instead, see create_completion
+            groq = Groq(
+                api_key=os.getenv("GROQ_API_KEY"),
+                max_retries=0,
+                http_client=DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=GROQ_CONNECTIONS,
+                        max_keepalive_connections=GROQ_CONNECTIONS,
+                    )
+                ),
+            )
+        return groq
+
+
+# Calendar work of chat turns runs on this pool. Its size bounds how many
+# Calendar requests the process has in flight, to stay within rate limits.
+CALENDAR_CONCURRENCY = int(os.getenv("CALENDAR_CONCURRENCY", "8"))
+calendar_pool = ThreadPoolExecutor(max_workers=CALENDAR_CONCURRENCY)
+
+# Every call to Google Calendar and Groq waits for its turn in a scheduler.
+# The project rates are per second for the whole server, split evenly between
+# its gunicorn workers. A rate of 0 leaves calls unlimited, they still take
+# turns and pause on rate limit responses. Groq is only limited when GROQ_RATE
+# is set, as its quota depends on the plan of the account.
+WORKER_COUNT = int(os.getenv("WEB_CONCURRENCY", "1"))
+CALENDAR_CONNECTIONS = int(os.getenv("CALENDAR_CONNECTIONS", "16"))
+GROQ_CONNECTIONS = int(os.getenv("GROQ_CONNECTIONS", "16"))
+calendar_scheduler = OutboundScheduler(
+    project_rate=float(os.getenv("CALENDAR_RATE", "100")) / WORKER_COUNT,
+    user_rate=float(os.getenv("CALENDAR_USER_RATE", "25")),
+    max_in_flight=CALENDAR_CONNECTIONS,
+)
+groq_scheduler = OutboundScheduler(
+    project_rate=float(os.getenv("GROQ_RATE", "0")) / WORKER_COUNT,
+    user_rate=float(os.getenv("GROQ_USER_RATE", "0")),
+)
+
+# Open connections to Google, shared by the Calendar services of every user
+calendar_http = PooledHttp(max_idle=CALENDAR_CONNECTIONS)
+
+# Calendars shown in the grid and the chat context, comma-separated. The first
+# one is where new events go.
+CALENDAR_IDS = [
+    calendar_id.strip()
+    for calendar_id in os.getenv("CALENDAR_IDS", "primary").split(",")
+    if calendar_id.strip()
+]
+DEFAULT_CALENDAR_ID = CALENDAR_IDS[0]
+
+# Calendars only checked for busy time, through the free/busy API
+BUSY_CALENDAR_IDS = [
+    calendar_id.strip()
+    for calendar_id in os.getenv("BUSY_CALENDAR_IDS", "").split(",")
+    if calendar_id.strip()
+]
+
+
+def get_request_spans() -> Optional[List[tuple]]:
+    """Return the spans recorded for the current request, if there is one."""
+    if not has_request_context():
+        return None
+    # The environ is shared with request contexts copied to worker threads
+    return request.environ.setdefault("timecraft.spans", [])
+
+
+# Timed spans of outbound calls, reported per response in the Server-Timing
+# header and aggregated at /metrics. TRACING=0 turns them off.
+tracer = Tracer(
+    enabled=os.getenv("TRACING", "1") != "0", current_spans=get_request_spans
+)
+
+# What happens to planned events overlapping other events: "flag" runs them
+# and reports the overlap, "reject" skips them
+CONFLICT_POLICY = os.getenv("CONFLICT_POLICY", "flag")
+
+# How action results are turned into a reply: "template", "llm", or "auto"
+# (template, falling back to the LLM when an action failed)
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "auto")
+
+# Responses of the deterministic first LLM call: "memory", "sqlite" (kept in
+# LLM_CACHE_PATH across restarts), or "off"
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[ResponseCache]:
+    """
+    Return the LLM response cache of this process, opening it on first use.
+
+    Opening it lazily keeps the SQLite connection out of a preloading parent
+    process, so forked workers never share one.
+
+    Returns:
+        The cache, or None if LLM_CACHE_BACKEND is "off"
+    """
+    global llm_cache
+    with _llm_cache_lock:
+        if llm_cache is None:
+            if LLM_CACHE_BACKEND == "sqlite":
+                llm_cache = ResponseCache(
+                    SQLiteBackend(
+                        os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3"),
+                        ttl=LLM_CACHE_TTL,
+                    )
+                )
+            elif LLM_CACHE_BACKEND == "memory":
+                llm_cache = ResponseCache(MemoryBackend(ttl=LLM_CACHE_TTL))
+        return llm_cache
+
 
 # Google OAuth 2.0 Client Config
 CLIENT_SECRETS_FILE = "client_secret.json"
@@ -25,12 +199,24 @@ SCOPES = [
     "https://www.googleapis.com/auth/calendar",
     "https://www.googleapis.com/auth/calendar.readonly",
 ]
-REDIRECT_URI = "http://localhost:5000/oauth2callback"
+REDIRECT_URI = os.getenv("REDIRECT_URI", "http://localhost:5000/oauth2callback")
 
-# OAuth Flow
-flow = Flow.from_client_secrets_file(
-    CLIENT_SECRETS_FILE, scopes=SCOPES, redirect_uri=REDIRECT_URI
-)
+# OAuth Flow, created on first use by get_flow
+flow = None
+_flow_lock = threading.Lock()
+
+
+def get_flow():
+    """Return the OAuth flow, reading CLIENT_SECRETS_FILE on first use."""
+    global flow
+    with _flow_lock:
+        if flow is None:
+            from google_auth_oauthlib.flow import Flow
+
+            flow = Flow.from_client_secrets_file(
+                CLIENT_SECRETS_FILE, scopes=SCOPES, redirect_uri=REDIRECT_URI
+            )
+        return flow
 
 
 # Utility functions for date manipulation
@@ -45,6 +231,22 @@ def get_current_date():
     return session.get("current_date", datetime.now().strftime("%Y-%m-%d"))
 
 
+def parse_day(value: str) -> Optional[str]:
+    """
+    Normalize a day given by the client or kept in the session.
+
+    Args:
+        value: Day in ISO format, e.g. "2030-01-31"
+
+    Returns:
+        The day as YYYY-MM-DD, or None if it is not a valid day
+    """
+    try:
+        return datetime.fromisoformat(value).strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
 def format_date_for_api(date_str):
     return datetime.fromisoformat(date_str).isoformat() + "Z"
 
@@ -56,27 +258,454 @@ def get_date_range(current_date_str, days_to_add=0):
     return start_date, end_date
 
 
-# Updating Google Calendar events
+def get_zone(timezone: str) -> ZoneInfo:
+    """Return the named time zone, or UTC if it is unknown."""
+    try:
+        return ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo("UTC")
+
+
+# Google Calendar service setup
+# Cached Calendar services and credentials, keyed on the session identity
+service_cache = TTLCache(max_size=256, ttl=3600)
+
+# Refresh access tokens this long before they expire
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+_discovery_document = None
+_discovery_lock = threading.Lock()
+
+
+def get_session_id():
+    """Return the identity of the current session, creating one if needed."""
+    if "session_id" not in session:
+        session["session_id"] = uuid.uuid4().hex
+    return session["session_id"]
+
+
+def credentials_to_dict(credentials):
+    return {
+        "token": credentials.token,
+        "refresh_token": credentials.refresh_token,
+        "token_uri": credentials.token_uri,
+        "client_id": credentials.client_id,
+        "client_secret": credentials.client_secret,
+        "scopes": credentials.scopes,
+        "expiry": credentials.expiry.isoformat() if credentials.expiry else None,
+    }
+
+
+@contextmanager
+def user_context(owner: str, credentials: Credentials) -> Iterator[None]:
+    """
+    Act for a user outside of their requests, e.g. in a background thread.
+
+    The action functions work on the session of the current request, so this
+    enters a request context whose session holds the user's identity and
+    credentials.
+
+    Args:
+        owner: Session identity of the user
+        credentials: Credentials of the user
+    """
+    with app.test_request_context():
+        session["session_id"] = owner
+        session["credentials"] = credentials_to_dict(credentials)
+        yield
+
+
+def credentials_from_dict(credentials_dict):
+    credentials_dict = dict(credentials_dict)
+    expiry = credentials_dict.pop("expiry", None)
+    credentials = Credentials(**credentials_dict)
+    if expiry:
+        credentials.expiry = datetime.fromisoformat(expiry)
+    return credentials
+
+
+def get_discovery_document():
+    """Load the bundled Calendar discovery document once per process."""
+    global _discovery_document
+    with _discovery_lock:
+        if _discovery_document is None:
+            document = json.loads(get_static_doc("calendar", "v3"))
+            # Point the client at another server, e.g. the benchmark's stand-in
+            if os.getenv("CALENDAR_ROOT_URL"):
+                document["rootUrl"] = os.getenv("CALENDAR_ROOT_URL")
+            _discovery_document = document
+        return _discovery_document
+
+
+class TracedHttpRequest(HttpRequest):
+    """
+    HttpRequest recording a span named after its API method, sent when
+    calendar_scheduler admits it.
+    """
+
+    # Session identity of the user the request is made for
+    owner = ""
+
+    def execute(self, *args, **kwargs):
+        calendar_scheduler.acquire(self.owner)
+        throttled, retry_after = 0, None
+        try:
+            with tracer.span(self.methodId or "calendar.request"):
+                return super().execute(*args, **kwargs)
+        except HttpError as e:
+            if is_rate_limited(e):
+                throttled, retry_after = 1, parse_retry_after(e.resp.get("retry-after"))
+            raise
+        finally:
+            calendar_scheduler.release(self.owner, 1, throttled, retry_after)
+
+
+def build_calendar_service(credentials, owner: str = ""):
+    """
+    Build a Google Calendar service from the bundled discovery document.
+
+    Args:
+        credentials: OAuth credentials used to authorize requests
+        owner: Session identity of the user, whose calls calendar_scheduler
+            admits in turn with other users' calls
+
+    Returns:
+        Google Calendar service which is safe to share between threads
+    """
+    # Each request borrows a pooled connection, as httplib2 is not thread-safe
+    http = AuthorizedHttp(credentials, http=calendar_http)
+
+    def build_request(_, *args, **kwargs):
+        api_request = TracedHttpRequest(http, *args, **kwargs)
+        api_request.owner = owner
+        return api_request
+
+    return build_from_document(
+        get_discovery_document(), credentials=credentials, requestBuilder=build_request
+    )
+
+
 def get_calendar_service():
-    """Initialize and return Google Calendar service with current credentials."""
+    """Return the cached Google Calendar service for the current user."""
     if "credentials" not in session:
         return None
 
-    credentials_dict = session["credentials"]
-    credentials = Credentials(**credentials_dict)
+    user_id = get_session_id()
+    cached = service_cache.get(user_id)
+    if cached is None:
+        credentials = credentials_from_dict(session["credentials"])
+        cached = {
+            "credentials": credentials,
+            "service": build_calendar_service(credentials, user_id),
+        }
+        service_cache.set(user_id, cached)
+        # Finish what a stopped process left of the user's action plans before
+        # the request makes newer changes, which the old ones would overwrite
+        resume_actions(user_id)
+
+    # Only refresh when the token is about to expire
+    credentials = cached["credentials"]
+    if (
+        credentials.refresh_token
+        and credentials.expiry
+        and credentials.expiry - datetime.utcnow() < TOKEN_REFRESH_MARGIN
+    ):
+        # Only imported here, as it pulls in requests
+        from google.auth.transport.requests import Request
+
+        with tracer.span("google.oauth.refresh"):
+            credentials.refresh(Request())
+        session["credentials"] = credentials_to_dict(credentials)
+
+    return cached["service"]
+
+
+# Local copies of each user's calendar, keyed on the session identity
+event_stores = TTLCache(max_size=256, ttl=3600)
+
+
+def get_event_store():
+    """Return the local event store for the current user."""
+    user_id = get_session_id()
+    store = event_stores.get(user_id)
+    if store is None:
+        store = CalendarSet(CALENDAR_IDS)
+        if watch_channels is not None:
+            for calendar_id, calendar_store in store.stores.items():
+                if watch_channels.watching(user_id, calendar_id):
+                    calendar_store.sync_interval = WATCHED_SYNC_INTERVAL
+        event_stores.set(user_id, store)
+    return store
+
+
+def fetch_events(service, store, time_min, time_max):
+    """
+    Get the Calendar events in a time window, from the local store when possible.
+
+    Args:
+        service: Google Calendar service
+        store: Event store of the user
+        time_min: Start of the window
+        time_max: End of the window
+
+    Returns:
+        List of Calendar event resources ordered by start time
+    """
+    if store.covers(time_min):
+        store.sync(service)
+        if store.covers(time_min):
+            return store.query(time_min, time_max)
+
+    # The window starts before the synced range, so ask Google directly
+    return fetch_calendars(service, CALENDAR_IDS, time_min, time_max)
+
+
+def event_calendar_id(event: Dict, store) -> str:
+    """
+    Find the calendar an event belongs to.
+
+    Args:
+        event: Event with an eventId and optionally a calendarId
+        store: Event store of the user
+
+    Returns:
+        ID of the calendar, the default calendar if unknown
+    """
+    if event.get("calendarId"):
+        return event["calendarId"]
+    stored = store.get(event.get("eventId", ""))
+    return (stored or {}).get("calendarId", DEFAULT_CALENDAR_ID)
+
+
+# Google Calendar accepts at most 50 calls in a single batch request
+BATCH_SIZE = 50
+
+# Calls failing with these statuses are retried with exponential backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BATCH_RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+
+def is_rate_limited(error: Optional[Exception]) -> bool:
+    """Return whether Google rejected a Calendar call for exceeding a quota."""
+    if not isinstance(error, HttpError):
+        return False
+    # Google reports some rate limits as 403 with a rate limit reason
+    return error.resp.status == 429 or (
+        error.resp.status == 403
+        and re.search(rb'"reason":\s*"(user)?[rR]ateLimitExceeded"', error.content)
+        is not None
+    )
 
-    if not credentials.valid and credentials.expired and credentials.refresh_token:
-        credentials.refresh(Request())
-        session["credentials"] = {
-            "token": credentials.token,
-            "refresh_token": credentials.refresh_token,
-            "token_uri": credentials.token_uri,
-            "client_id": credentials.client_id,
-            "client_secret": credentials.client_secret,
-            "scopes": credentials.scopes,
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Return whether a Calendar call failed with a rate limit, server error or
+    network error.
+
+    Every call sent through execute_batch is idempotent, inserts included as
+    they carry their own event ID, so a call which timed out after reaching
+    Google can be sent again.
+    """
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRY_STATUSES or is_rate_limited(error)
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+def failure(error: Exception) -> Dict[str, Union[str, bool]]:
+    """Describe a failed Calendar call as an action result."""
+    if isinstance(error, Throttled) or is_rate_limited(error):
+        return {
+            "success": False,
+            "error": "Google Calendar is rate limiting requests, please try again shortly",
+            "rateLimited": True,
         }
+    return {"success": False, "error": str(error)}
+
+
+def execute_batch(service, api_requests: List) -> List[tuple]:
+    """
+    Execute Google API requests through multipart batch requests.
+
+    Calls rejected with 429 or 5xx responses are retried in a new batch, up to
+    BATCH_RETRIES times with exponential backoff. Every batch is admitted by
+    calendar_scheduler at the cost of its calls, which also holds back
+    retries of rate limited calls until Google's Retry-After has passed.
+
+    Args:
+        service: Google Calendar service used to create the batch requests
+        api_requests: List of unexecuted API requests
+
+    Returns:
+        List of (response, exception) tuples in the same order as api_requests
+    """
+    outcomes = [None] * len(api_requests)
+
+    def callback(request_id, response, exception):
+        outcomes[int(request_id)] = (response, exception)
+
+    pending = list(range(len(api_requests)))
+    for attempt in range(BATCH_RETRIES + 1):
+        for chunk_start in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[chunk_start : chunk_start + BATCH_SIZE]
+            batch = service.new_batch_http_request(callback=callback)
+            for index in chunk:
+                batch.add(api_requests[index], request_id=str(index))
+
+            owner = getattr(api_requests[chunk[0]], "owner", "")
+            try:
+                calendar_scheduler.acquire(owner, len(chunk))
+            except Throttled as e:
+                for index in chunk:
+                    outcomes[index] = (None, e)
+                continue
+
+            tracer.count("calendar_batched_calls_total", len(chunk))
+            try:
+                with tracer.span("calendar.batch"):
+                    batch.execute()
+            except Exception as e:
+                # The whole batch failed, so every call in this chunk without a
+                # response of its own failed with it
+                for index in chunk:
+                    if outcomes[index] is None:
+                        outcomes[index] = (None, e)
+            limited = [
+                outcomes[index][1]
+                for index in chunk
+                if is_rate_limited(outcomes[index][1])
+            ]
+            waits = [parse_retry_after(e.resp.get("retry-after")) for e in limited]
+            calendar_scheduler.release(
+                owner,
+                len(chunk),
+                len(limited),
+                max((wait for wait in waits if wait is not None), default=None),
+            )
+
+        pending = [index for index in pending if is_retryable(outcomes[index][1])]
+        if not pending or attempt == BATCH_RETRIES:
+            break
+        tracer.count("calendar_retries_total", len(pending))
+        if not calendar_scheduler.enabled or not all(
+            is_rate_limited(outcomes[index][1]) for index in pending
+        ):
+            time.sleep(RETRY_BACKOFF * 2**attempt)
+        for index in pending:
+            outcomes[index] = None
+
+    limited = sum(is_rate_limited(outcome[1]) for outcome in outcomes)
+    if limited:
+        tracer.count("calendar_rate_limited_total", limited)
+        app.logger.warning("%d Calendar calls failed on rate limits", limited)
+    return outcomes
 
-    return build("calendar", "v3", credentials=credentials)
+
+ACTION_JOURNAL_PATH = os.getenv("ACTION_JOURNAL_PATH", "actions.sqlite3")
+
+# Action journal of this process, opened on first use by get_action_journal
+action_journal = None
+_journal_lock = threading.Lock()
+
+# Operations still pending from before this time were left by a process which
+# stopped before finishing them
+PROCESS_STARTED = time.time()
+
+
+def record_process_start() -> None:
+    """
+    Start a process's count of pending operations from now.
+
+    A preloading parent imports this module long before it forks, so every
+    worker calls this once forked. Otherwise operations a sibling started
+    after the import would look abandoned.
+    """
+    global PROCESS_STARTED
+    PROCESS_STARTED = time.time()
+
+
+def get_action_journal() -> ActionJournal:
+    """Return the action journal of this process, opening it on first use."""
+    global action_journal
+    with _journal_lock:
+        if action_journal is None:
+            action_journal = ActionJournal(ACTION_JOURNAL_PATH)
+        return action_journal
+
+
+def http_status(error: Exception) -> Optional[int]:
+    """Return the HTTP status of a failed Calendar call, if it got a response."""
+    return error.resp.status if isinstance(error, HttpError) else None
+
+
+def create_key(event: Dict[str, str], timezone: str) -> str:
+    """
+    Get the idempotency key of a planned event, which its event ID derives from.
+
+    Args:
+        event: Event dictionary containing summary, start, and end times
+        timezone: Time zone of the user
+
+    Returns:
+        Key from idempotency_key
+
+    Raises:
+        KeyError: If the event lacks a summary, start, or end
+    """
+    return idempotency_key(
+        "create",
+        event.get("calendarId") or DEFAULT_CALENDAR_ID,
+        event["summary"],
+        event["start"],
+        event["end"],
+        timezone,
+    )
+
+
+# IDs tried for a planned event whose earlier IDs are held by changed events
+CREATE_ID_GENERATIONS = 5
+
+
+def next_event_id(key: str, plan: Dict) -> None:
+    """
+    Move a planned event on to its next derived ID.
+
+    The IDs are derived from the key and a generation number, so a replayed
+    operation walks the same IDs and finds the event it created before.
+
+    Args:
+        key: Key from create_key
+        plan: Planned insert, whose body gets the new ID
+    """
+    plan["generation"] = plan.get("generation", 0) + 1
+    plan["body"]["id"] = event_id_for(idempotency_key(key, plan["generation"]))
+
+
+def matches_plan(event: Dict, body: Dict) -> bool:
+    """
+    Check whether an existing event is the one a planned insert describes.
+
+    Args:
+        event: Calendar event resource
+        body: Body of the planned insert, with wall-clock times and a time zone
+
+    Returns:
+        Whether the summary, start and end are the planned ones
+    """
+
+    def instant(time: Dict) -> Optional[float]:
+        if "dateTime" not in time:
+            return None
+        moment = datetime.fromisoformat(time["dateTime"].replace("Z", "+00:00"))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=get_zone(time.get("timeZone", "UTC")))
+        return moment.timestamp()
+
+    return (
+        event.get("summary") == body["summary"]
+        and instant(event.get("start", {})) == instant(body["start"])
+        and instant(event.get("end", {})) == instant(body["end"])
+    )
 
 
 def create_events(
@@ -85,8 +714,16 @@ def create_events(
     """
     Create multiple calendar events.
 
+    Every event gets an ID derived from its calendar, summary, start and end,
+    so the same event planned twice is created once. Google rejects an insert
+    with an existing ID, which makes retries and resubmitted plans no-ops.
+    An existing event only counts as created before while it still has the
+    planned summary and times. Once it was moved or renamed, the plan creates
+    a new event under the next derived ID.
+
     Args:
         events: List of event dictionaries containing summary, start, and end times
+        timezone: Time zone of the user
 
     Returns:
         List of dictionaries containing success status and event ID or error message
@@ -95,23 +732,145 @@ def create_events(
     if not service:
         return [{"success": False, "error": "Not authenticated"}]
 
-    results = []
-    for event in events:
+    results = [None] * len(events)
+    store = get_event_store()
+
+    # Coalesce duplicate events before anything is sent
+    planned = {}
+    for index, event in enumerate(events):
         try:
-            event_body = {
-                "summary": event["summary"],
-                "start": {"dateTime": event["start"][:-1], "timeZone": timezone},
-                "end": {"dateTime": event["end"][:-1], "timeZone": timezone},
+            calendar_id = event.get("calendarId") or DEFAULT_CALENDAR_ID
+            key = create_key(event, timezone)
+            if key in planned:
+                planned[key]["indices"].append(index)
+                tracer.count("actions_coalesced_total")
+                continue
+            planned[key] = {
+                "indices": [index],
+                "calendarId": calendar_id,
+                "body": {
+                    "id": event_id_for(key),
+                    "summary": event["summary"],
+                    "start": {"dateTime": event["start"][:-1], "timeZone": timezone},
+                    "end": {"dateTime": event["end"][:-1], "timeZone": timezone},
+                },
             }
+        except Exception as e:
+            results[index] = {"success": False, "error": str(e)}
+
+    owner = get_session_id()
+    journal = get_action_journal()
+    journal.begin(
+        owner,
+        [
+            (
+                key,
+                "create_events",
+                {"event": events[plan["indices"][0]], "timezone": timezone},
+            )
+            for key, plan in planned.items()
+        ],
+    )
 
-            created_event = (
-                service.events().insert(calendarId="primary", body=event_body).execute()
+    outcomes = {}
+    remaining = list(planned)
+    for _ in range(CREATE_ID_GENERATIONS):
+        pending = []
+        for key in remaining:
+            plan = planned[key]
+            stored = store.get(plan["body"]["id"])
+            while (
+                stored is not None
+                and stored.get("calendarId") == plan["calendarId"]
+                and not matches_plan(stored, plan["body"])
+            ):
+                # The event was moved or renamed since, so it is not this one
+                next_event_id(key, plan)
+                stored = store.get(plan["body"]["id"])
+            if stored is not None and stored.get("calendarId") == plan["calendarId"]:
+                # Created before, e.g. by an earlier submission of the same plan
+                tracer.count("actions_already_done_total")
+                outcomes[key] = {"success": True, "eventId": stored["id"]}
+                continue
+            pending.append(
+                (
+                    key,
+                    service.events().insert(
+                        calendarId=plan["calendarId"], body=plan["body"]
+                    ),
+                )
             )
 
-            results.append({"success": True, "eventId": created_event["id"]})
-        except Exception as e:
-            results.append({"success": False, "error": str(e)})
+        taken = []
+        calls = execute_batch(service, [api_request for _, api_request in pending])
+        for (key, _), (created_event, error) in zip(pending, calls):
+            if http_status(error) == 409:
+                taken.append(key)
+            elif error:
+                outcomes[key] = failure(error)
+            else:
+                created_event["calendarId"] = planned[key]["calendarId"]
+                store.apply(created_event)
+                outcomes[key] = {"success": True, "eventId": created_event["id"]}
+
+        # The ID is taken by an earlier run of the same operation, whose
+        # response may have been lost, or by an event since changed. Deleted
+        # events keep their ID, so those are restored.
+        calls = execute_batch(
+            service,
+            [
+                service.events().get(
+                    calendarId=planned[key]["calendarId"],
+                    eventId=planned[key]["body"]["id"],
+                )
+                for key in taken
+            ],
+        )
+        remaining = []
+        restores = []
+        for key, (existing_event, error) in zip(taken, calls):
+            if error:
+                outcomes[key] = failure(error)
+            elif existing_event.get("status") == "cancelled":
+                restores.append(
+                    (
+                        key,
+                        service.events().update(
+                            calendarId=planned[key]["calendarId"],
+                            eventId=existing_event["id"],
+                            body={**planned[key]["body"], "status": "confirmed"},
+                        ),
+                    )
+                )
+            elif matches_plan(existing_event, planned[key]["body"]):
+                tracer.count("actions_already_done_total")
+                existing_event["calendarId"] = planned[key]["calendarId"]
+                store.apply(existing_event)
+                outcomes[key] = {"success": True, "eventId": existing_event["id"]}
+            else:
+                next_event_id(key, planned[key])
+                remaining.append(key)
+
+        calls = execute_batch(service, [api_request for _, api_request in restores])
+        for (key, _), (restored_event, error) in zip(restores, calls):
+            if error:
+                outcomes[key] = failure(error)
+            else:
+                restored_event["calendarId"] = planned[key]["calendarId"]
+                store.apply(restored_event)
+                outcomes[key] = {"success": True, "eventId": restored_event["id"]}
+        if not remaining:
+            break
+    for key in remaining:
+        outcomes[key] = {
+            "success": False,
+            "error": "Every ID for this event is taken by other events",
+        }
 
+    journal.finish(owner, outcomes)
+    for key, plan in planned.items():
+        for index in plan["indices"]:
+            results[index] = dict(outcomes[key])
     return results
 
 
@@ -129,17 +888,61 @@ def update_events(events: List[Dict[str, str]]) -> List[Dict[str, Union[str, boo
     if not service:
         return [{"success": False, "error": "Not authenticated"}]
 
-    results = []
-    for event in events:
+    results = [None] * len(events)
+    store = get_event_store()
+
+    # Coalesce duplicate updates before anything is sent
+    planned = {}
+    for index, event in enumerate(events):
         try:
-            # Get existing event
-            existing_event = (
-                service.events()
-                .get(calendarId="primary", eventId=event["eventId"])
-                .execute()
-            )
+            calendar_id = event_calendar_id(event, store)
+            changes = {
+                field: event[field]
+                for field in ("summary", "start", "end", "colorId")
+                if field in event
+            }
+            key = idempotency_key("update", calendar_id, event["eventId"], changes)
+            if key in planned:
+                planned[key]["indices"].append(index)
+                tracer.count("actions_coalesced_total")
+                continue
+            planned[key] = {"indices": [index], "calendarId": calendar_id}
+        except Exception as e:
+            results[index] = {"success": False, "error": str(e)}
+
+    owner = get_session_id()
+    journal = get_action_journal()
+    journal.begin(
+        owner,
+        [
+            (key, "update_events", {"event": events[plan["indices"][0]]})
+            for key, plan in planned.items()
+        ],
+    )
 
+    # Get existing events
+    outcomes = {}
+    pending = [
+        (
+            key,
+            service.events().get(
+                calendarId=plan["calendarId"],
+                eventId=events[plan["indices"][0]]["eventId"],
+            ),
+        )
+        for key, plan in planned.items()
+    ]
+    calls = execute_batch(service, [api_request for _, api_request in pending])
+
+    updates = []
+    for (key, _), (existing_event, error) in zip(pending, calls):
+        if error:
+            outcomes[key] = failure(error)
+            continue
+
+        try:
             # Update fields if provided
+            event = events[planned[key]["indices"][0]]
             if "summary" in event:
                 existing_event["summary"] = event["summary"]
             if "start" in event:
@@ -149,18 +952,32 @@ def update_events(events: List[Dict[str, str]]) -> List[Dict[str, Union[str, boo
             if "colorId" in event:
                 existing_event["colorId"] = event["colorId"]
 
-            updated_event = (
-                service.events()
-                .update(
-                    calendarId="primary", eventId=event["eventId"], body=existing_event
+            updates.append(
+                (
+                    key,
+                    service.events().update(
+                        calendarId=planned[key]["calendarId"],
+                        eventId=event["eventId"],
+                        body=existing_event,
+                    ),
                 )
-                .execute()
             )
-
-            results.append({"success": True, "eventId": updated_event["id"]})
         except Exception as e:
-            results.append({"success": False, "error": str(e)})
+            outcomes[key] = {"success": False, "error": str(e)}
 
+    calls = execute_batch(service, [api_request for _, api_request in updates])
+    for (key, _), (updated_event, error) in zip(updates, calls):
+        if error:
+            outcomes[key] = failure(error)
+        else:
+            updated_event["calendarId"] = planned[key]["calendarId"]
+            store.apply(updated_event)
+            outcomes[key] = {"success": True, "eventId": updated_event["id"]}
+
+    journal.finish(owner, outcomes)
+    for key, plan in planned.items():
+        for index in plan["indices"]:
+            results[index] = dict(outcomes[key])
     return results
 
 
@@ -168,6 +985,8 @@ def delete_events(event_ids: List[Dict[str, str]]) -> List[Dict[str, Union[str,
     """
     Delete multiple calendar events.
 
+    Deleting an event which is already gone succeeds, so retries are no-ops.
+
     Args:
         event_ids: List of dictionaries containing eventId
 
@@ -178,20 +997,108 @@ def delete_events(event_ids: List[Dict[str, str]]) -> List[Dict[str, Union[str,
     if not service:
         return [{"success": False, "error": "Not authenticated"}]
 
-    results = []
-    for event in event_ids:
-        try:
-            service.events().delete(
-                calendarId="primary", eventId=event["eventId"]
-            ).execute()
+    results = [None] * len(event_ids)
+    store = get_event_store()
 
-            results.append({"success": True})
+    # Coalesce duplicate deletions before anything is sent
+    planned = {}
+    for index, event in enumerate(event_ids):
+        try:
+            calendar_id = event_calendar_id(event, store)
+            key = idempotency_key("delete", calendar_id, event["eventId"])
+            if key in planned:
+                planned[key]["indices"].append(index)
+                tracer.count("actions_coalesced_total")
+                continue
+            planned[key] = {"indices": [index], "calendarId": calendar_id}
         except Exception as e:
-            results.append({"success": False, "error": str(e)})
+            results[index] = {"success": False, "error": str(e)}
+
+    owner = get_session_id()
+    journal = get_action_journal()
+    earlier = journal.begin(
+        owner,
+        [
+            (key, "delete_events", {"event": event_ids[plan["indices"][0]]})
+            for key, plan in planned.items()
+        ],
+    )
+
+    outcomes = {}
+    pending = []
+    for key, plan in planned.items():
+        event_id = event_ids[plan["indices"][0]]["eventId"]
+        if (earlier.get(key) or {}).get("status") == "done" and not store.get(event_id):
+            tracer.count("actions_already_done_total")
+            outcomes[key] = {"success": True}
+            continue
+        pending.append(
+            (
+                key,
+                service.events().delete(
+                    calendarId=plan["calendarId"], eventId=event_id
+                ),
+            )
+        )
 
+    calls = execute_batch(service, [api_request for _, api_request in pending])
+    for (key, _), (_, error) in zip(pending, calls):
+        # Google answers 410 for events which were deleted already
+        if error and http_status(error) not in (404, 410):
+            outcomes[key] = failure(error)
+        else:
+            plan = planned[key]
+            store.remove(event_ids[plan["indices"][0]]["eventId"], plan["calendarId"])
+            outcomes[key] = {"success": True}
+
+    journal.finish(owner, outcomes)
+    for key, plan in planned.items():
+        for index in plan["indices"]:
+            results[index] = dict(outcomes[key])
     return results
 
 
+def resume_actions(owner: str) -> None:
+    """
+    Run the operations a stopped process left pending in the action journal.
+
+    Operations are idempotent, so any which did reach Google before the
+    process stopped are not done twice. Operations which cannot be run again
+    are abandoned rather than tried on every visit of the user.
+
+    Args:
+        owner: Session identity of the user
+    """
+    cached = service_cache.get(owner)
+    journal = get_action_journal()
+    entries = journal.pending(owner, before=PROCESS_STARTED)
+    if cached is None or not entries:
+        return
+
+    groups = {}
+    for entry in entries:
+        timezone = entry["payload"].get("timezone", "UTC")
+        groups.setdefault((entry["operation"], timezone), []).append(
+            entry["payload"]["event"]
+        )
+
+    with user_context(owner, cached["credentials"]):
+        for (operation, timezone), events in groups.items():
+            try:
+                run_action({"operation": operation, "events": events}, timezone)
+            except Exception as e:
+                app.logger.warning("Cannot resume %s: %s", operation, e)
+    tracer.count("actions_resumed_total", len(entries))
+
+    # Operations run again were recorded anew, the others failed to run
+    abandoned = journal.abandon(
+        owner, [entry["key"] for entry in entries], before=PROCESS_STARTED
+    )
+    if abandoned:
+        tracer.count("actions_abandoned_total", abandoned)
+        app.logger.warning("Abandoned %d operations which could not resume", abandoned)
+
+
 def list_events(
     timeframe: Optional[Dict[str, str]] = None,
 ) -> Dict[str, Union[List[Dict], str]]:
@@ -224,34 +1131,29 @@ def list_events(
             else future.isoformat() + "Z"
         )
 
-        events_result = (
-            service.events()
-            .list(
-                calendarId="primary",
-                timeMin=time_min,
-                timeMax=time_max,
-                maxResults=100,
-                singleEvents=True,
-                orderBy="startTime",
-            )
-            .execute()
-        )
-
-        events = events_result.get("items", [])
+        events = fetch_events(service, get_event_store(), time_min, time_max)
         formatted_events = []
 
         for event in events:
-            formatted_events.append(
-                {
-                    "eventId": event["id"],
-                    "summary": event.get("summary", "No Title"),
-                    "start": event["start"].get("dateTime", event["start"].get("date")),
-                    "end": event["end"].get("dateTime", event["end"].get("date")),
-                    "colorId": event.get("colorId", "7"),  # Default to peacock color
-                }
-            )
+            formatted_event = {
+                "eventId": event["id"],
+                "summary": event.get("summary", "No Title"),
+                "start": event["start"].get("dateTime", event["start"].get("date")),
+                "end": event["end"].get("dateTime", event["end"].get("date")),
+                "colorId": event.get("colorId", "7"),  # Default to peacock color
+            }
+            if len(CALENDAR_IDS) > 1:
+                formatted_event["calendarId"] = event.get(
+                    "calendarId", DEFAULT_CALENDAR_ID
+                )
+            formatted_events.append(formatted_event)
 
         return {"success": True, "events": formatted_events}
+    except (HttpError, Throttled) as e:
+        if not isinstance(e, Throttled) and not is_rate_limited(e):
+            return {"success": False, "error": str(e)}
+        app.logger.warning("Listing events was rate limited: %s", e)
+        return failure(e)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -272,12 +1174,15 @@ def get_events(
     if not service:
         return [{"success": False, "error": "Not authenticated"}]
 
+    store = get_event_store()
     results = []
     for event in event_ids:
         try:
             event_result = (
                 service.events()
-                .get(calendarId="primary", eventId=event["eventId"])
+                .get(
+                    calendarId=event_calendar_id(event, store), eventId=event["eventId"]
+                )
                 .execute()
             )
 
@@ -300,36 +1205,276 @@ def get_events(
     return results
 
 
-# Routes
-@app.route("/")
-def index():
-    return render_template("index.html")
+# Neighbouring windows laid out in the background for prev/next navigation,
+# one small cache per user, keyed by the first day of the window
+window_caches = TTLCache(max_size=256, ttl=3600)
+WINDOW_CACHE_SIZE = 6
+prefetch_pool = ThreadPoolExecutor(max_workers=2)
+prefetch_tasks = {}
+prefetch_lock = threading.Lock()
+navigation_stats = {"hits": 0, "misses": 0, "total_ms": 0.0}
 
 
-@app.route("/authorize")
-def authorize():
-    authorization_url, state = flow.authorization_url(
-        access_type="offline", include_granted_scopes="true"
-    )
-    session["state"] = state
-    return redirect(authorization_url)
+def load_window(service, store, current_date_str: str) -> tuple:
+    """
+    Fetch and lay out the 4-day window starting on a date.
 
+    Args:
+        service: Google Calendar service
+        store: Event store of the user
+        current_date_str: First day of the window
 
-@app.route("/oauth2callback")
-def oauth2callback():
-    if "state" not in session or session["state"] != request.args["state"]:
-        return "Error: State mismatch", 400
+    Returns:
+        Tuple of the laid out events and the store version they match, or None
+        if the window is outside the store
+    """
+    start_date, end_date = get_date_range(current_date_str)
+    now = format_date_for_api(start_date.isoformat())
+    end = format_date_for_api(end_date.isoformat())
+    days_events = layout_events(fetch_events(service, store, now, end))
+    return days_events, store.version if store.covers(now) else None
 
-    flow.fetch_token(authorization_response=request.url)
-    credentials = flow.credentials
-    session["credentials"] = {
-        "token": credentials.token,
-        "refresh_token": credentials.refresh_token,
-        "token_uri": credentials.token_uri,
-        "client_id": credentials.client_id,
-        "client_secret": credentials.client_secret,
-        "scopes": credentials.scopes,
-    }
+
+def prefetch_windows(user_id: str, service, store, current_date_str: str) -> None:
+    """
+    Load the previous and next windows in the background.
+
+    Args:
+        user_id: Session identity of the user
+        service: Google Calendar service
+        store: Event store of the user
+        current_date_str: First day of the window being shown
+    """
+    cache = window_caches.get(user_id)
+    if cache is None:
+        # Entries expire with the store's sync interval so they are never
+        # staler than a store read
+        cache = TTLCache(max_size=WINDOW_CACHE_SIZE, ttl=EventStore.SYNC_INTERVAL)
+        window_caches.set(user_id, cache)
+
+    with prefetch_lock:
+        cancelled, futures = prefetch_tasks.setdefault(user_id, (threading.Event(), []))
+        futures[:] = [future for future in futures if not future.done()]
+
+    for days in (4, -4):
+        start_date, _ = get_date_range(current_date_str, days)
+        start = start_date.strftime("%Y-%m-%d")
+
+        def prefetch(start=start):
+            if cancelled.is_set():
+                return
+            window = load_window(service, store, start)
+            if not cancelled.is_set():
+                cache.set(start, window)
+
+        with prefetch_lock:
+            futures.append(prefetch_pool.submit(prefetch))
+
+
+def get_prefetched_window(user_id: str, store, current_date_str: str):
+    """
+    Get a prefetched window if it is still up to date.
+
+    Args:
+        user_id: Session identity of the user
+        store: Event store of the user
+        current_date_str: First day of the window
+
+    Returns:
+        The laid out events, or None if the window has to be loaded
+    """
+    cache = window_caches.get(user_id)
+    window = cache.get(current_date_str) if cache else None
+    if window is not None and window[1] not in (None, store.version):
+        # The calendar changed since the window was prefetched
+        window = None
+
+    with prefetch_lock:
+        navigation_stats["misses" if window is None else "hits"] += 1
+    return None if window is None else window[0]
+
+
+def cancel_prefetches(user_id: str) -> None:
+    """Stop the background work of a user and drop their prefetched windows."""
+    with prefetch_lock:
+        cancelled, futures = prefetch_tasks.pop(user_id, (threading.Event(), []))
+    cancelled.set()
+    for future in futures:
+        future.cancel()
+    window_caches.pop(user_id)
+
+
+def changed_day_overlaps(day: datetime, start: float, end: float) -> bool:
+    """Return whether a change between two timestamps may show up on a day."""
+    # Events are drawn in their own time zone, so allow for any UTC offset
+    day_start = day.replace(tzinfo=dt_timezone.utc) - timedelta(hours=14)
+    day_end = day_start + timedelta(hours=24 + 28)
+    return start < day_end.timestamp() and end >= day_start.timestamp()
+
+
+# Public HTTPS URL of /calendar/notifications. When set, the calendars of
+# users viewing the grid are watched with push notifications instead of polled.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WATCH_TTL = int(os.getenv("WATCH_TTL", str(6 * 3600)))
+
+# Channels are renewed when they have less than this many seconds left
+WATCH_RENEW_MARGIN = 15 * 60
+
+# While a calendar is watched, Google is still asked for changes this often in
+# case a notification got lost
+WATCHED_SYNC_INTERVAL = 15 * 60
+
+# Push streams to the grid end after this many seconds to free their thread,
+# and the browser reconnects. Comments are sent in between to keep them open.
+PUSH_STREAM_SECONDS = 300
+PUSH_KEEPALIVE = 25
+
+watch_channels = WatchChannels(WEBHOOK_URL, WATCH_TTL) if WEBHOOK_URL else None
+change_feed = ChangeFeed()
+refresh_pending = set()
+refresh_lock = threading.Lock()
+_renewal_thread = None
+
+
+def watch_calendars(owner: str, service, store) -> None:
+    """
+    Open channels in the background for the calendars of a user not watched yet.
+
+    Args:
+        owner: Session identity of the user
+        service: Google Calendar service of the user
+        store: Event store of the user
+    """
+    for calendar_id, calendar_store in store.stores.items():
+        if watch_channels.reserve(owner, calendar_id):
+            calendar_pool.submit(open_channel, owner, service, calendar_store)
+
+
+def open_channel(owner: str, service, calendar_store: EventStore) -> None:
+    """Open a channel for one calendar and stop polling it as often."""
+    global _renewal_thread
+    try:
+        watch_channels.open(service, owner, calendar_store.calendar_id)
+    except HttpError as e:
+        app.logger.warning(
+            "Cannot watch calendar %s: %s", calendar_store.calendar_id, e
+        )
+        return
+    calendar_store.sync_interval = WATCHED_SYNC_INTERVAL
+
+    with refresh_lock:
+        # Also restarts a renewal thread which died, instead of leaving every
+        # channel to expire
+        if _renewal_thread is None or not _renewal_thread.is_alive():
+            _renewal_thread = threading.Thread(target=renew_channels, daemon=True)
+            _renewal_thread.start()
+
+
+def renew_channels() -> None:
+    """Renew channels before they expire, and let those of departed users lapse."""
+    while True:
+        time.sleep(60)
+        for channel in watch_channels.expiring(WATCH_RENEW_MARGIN):
+            cached = service_cache.get(channel["owner"])
+            store = event_stores.get(channel["owner"])
+            if cached is not None and store is not None:
+                try:
+                    watch_channels.renew(cached["service"], channel)
+                    continue
+                except HttpError as e:
+                    app.logger.warning("Cannot renew channel %s: %s", channel["id"], e)
+                except Exception:
+                    # One broken channel must not stop the others renewing
+                    app.logger.exception("Cannot renew channel %s", channel["id"])
+
+            watch_channels.forget(channel)
+            if store is not None and channel["calendarId"] in store.stores:
+                store.stores[channel["calendarId"]].sync_interval = (
+                    EventStore.SYNC_INTERVAL
+                )
+
+
+def stop_channels(owner: str) -> None:
+    """Stop the channels of a user, e.g. when they log out."""
+    cached = service_cache.get(owner)
+    for channel in watch_channels.owned_by(owner):
+        if cached is None:
+            watch_channels.forget(channel)
+        else:
+            # Best effort, the channel expires on its own anyway
+            calendar_pool.submit(watch_channels.stop, cached["service"], channel)
+
+
+def schedule_refresh(owner: str, calendar_id: str) -> None:
+    """Refresh a calendar in the background, at most once at a time."""
+    with refresh_lock:
+        if (owner, calendar_id) in refresh_pending:
+            return
+        refresh_pending.add((owner, calendar_id))
+    calendar_pool.submit(refresh_calendar, owner, calendar_id)
+
+
+def refresh_calendar(owner: str, calendar_id: str) -> None:
+    """
+    Fetch the changes of a calendar after a notification, and tell the user's
+    open grids about them.
+
+    Args:
+        owner: Session identity of the user
+        calendar_id: ID of the changed calendar
+    """
+    with refresh_lock:
+        # Notifications arriving from now on need another sync
+        refresh_pending.discard((owner, calendar_id))
+
+    store = event_stores.get(owner)
+    if store is None or calendar_id not in store.stores:
+        return
+    calendar_store = store.stores[calendar_id]
+    cached = service_cache.get(owner)
+    if cached is None:
+        # Nothing to sync with, the next read does it
+        calendar_store.invalidate()
+        return
+
+    version = calendar_store.version
+    try:
+        with tracer.span("calendar.push.refresh"):
+            calendar_store.sync(cached["service"], force=True)
+    except HttpError as e:
+        app.logger.warning("Refresh of calendar %s failed: %s", calendar_id, e)
+        calendar_store.invalidate()
+        return
+    if calendar_store.version != version:
+        change_feed.publish(owner, {"version": store.version})
+
+
+# Routes
+@app.route("/")
+def index():
+    return render_template("index.html")
+
+
+@app.route("/authorize")
+def authorize():
+    authorization_url, state = get_flow().authorization_url(
+        access_type="offline", include_granted_scopes="true"
+    )
+    session["state"] = state
+    return redirect(authorization_url)
+
+
+@app.route("/oauth2callback")
+def oauth2callback():
+    if "state" not in session or session["state"] != request.args["state"]:
+        return "Error: State mismatch", 400
+
+    oauth_flow = get_flow()
+    oauth_flow.fetch_token(authorization_response=request.url)
+    session["credentials"] = credentials_to_dict(oauth_flow.credentials)
+    service_cache.pop(get_session_id())
+    event_stores.pop(get_session_id())
+    window_caches.pop(get_session_id())
     session["current_date"] = datetime.now().strftime("%Y-%m-%d")
     return redirect(url_for("list_calendar_events"))
 
@@ -339,23 +1484,12 @@ def list_calendar_events():
     if "credentials" not in session:
         return redirect("authorize")
 
-    credentials_dict = session["credentials"]
-    credentials = Credentials(**credentials_dict)
-
-    if not credentials.valid and credentials.expired and credentials.refresh_token:
-        credentials.refresh(Request())
-        session["credentials"] = {
-            "token": credentials.token,
-            "refresh_token": credentials.refresh_token,
-            "token_uri": credentials.token_uri,
-            "client_id": credentials.client_id,
-            "client_secret": credentials.client_secret,
-            "scopes": credentials.scopes,
-        }
-
-    service = build("calendar", "v3", credentials=credentials)
+    current_date_str = parse_day(get_current_date())
+    if current_date_str is None:
+        return "Error: Invalid date", 400
 
-    current_date_str = get_current_date()
+    started = time.perf_counter()
+    service = get_calendar_service()
 
     if request.args.get("direction") == "next":
         current_date = datetime.fromisoformat(current_date_str)
@@ -373,138 +1507,1333 @@ def list_calendar_events():
     now = format_date_for_api(start_date.isoformat())
     end = format_date_for_api(end_date.isoformat())
 
-    events_result = (
-        service.events()
-        .list(
-            calendarId="primary",
-            maxResults=100,
-            singleEvents=True,
-            orderBy="startTime",
-            timeMin=now,
-            timeMax=end,
-        )
-        .execute()
-    )
-    events = events_result.get("items", [])
+    user_id = get_session_id()
+    store = get_event_store()
+    days_events = get_prefetched_window(user_id, store, current_date_str)
+    if days_events is None:
+        days_events = layout_events(fetch_events(service, store, now, end))
 
-    formatted_events = []
-    for event in events:
-        start_time = event["start"].get("dateTime", event["start"].get("date"))
-        end_time = event["end"].get("dateTime", event["end"].get("date"))
-        summary = event.get("summary", "No Title")
-        formatted_events.append(
-            {"start": start_time, "end": end_time, "summary": summary}
-        )
+    # Get the windows the user is likely to open next ready in the background
+    prefetch_windows(user_id, service, store, current_date_str)
+    if watch_channels is not None:
+        watch_calendars(user_id, service, store)
 
-    header_height = 40  # Height of your header in pixels
-    hour_height = 60  # Height of each hour slot in pixels
+    date_range = [start_date + timedelta(days=i) for i in range(4)]
 
-    days_events = defaultdict(list)
-    for event in formatted_events:
-        start_dt = datetime.fromisoformat(event["start"])
-        end_dt = datetime.fromisoformat(event["end"])
-        event_day = start_dt.strftime("%Y-%m-%d")
-        days_events[event_day].append(
-            {
-                "summary": event["summary"],
-                "start_time": start_dt.strftime("%H:%M"),
-                "end_time": end_dt.strftime("%H:%M"),
-                "start_pixel": (start_dt.hour * 60 + start_dt.minute - 6.5 * 60)
-                + (header_height / hour_height * 60),  # Corrected calculation
-                "duration": (end_dt.hour * 60 + end_dt.minute)
-                - (start_dt.hour * 60 + start_dt.minute),
-            }
+    elapsed = (time.perf_counter() - started) * 1000
+    with prefetch_lock:
+        navigation_stats["total_ms"] += elapsed
+        hit_rate = navigation_stats["hits"] / max(
+            navigation_stats["hits"] + navigation_stats["misses"], 1
         )
-
-    date_range = [start_date + timedelta(days=i) for i in range(4)]
+    app.logger.info(
+        "Calendar window %s loaded in %.1f ms (prefetch hit rate %.0f%%)",
+        current_date_str,
+        elapsed,
+        hit_rate * 100,
+    )
 
     return render_template(
         "list_events.html",
         days_events=days_events,
         date_range=date_range,
+        start=current_date_str,
+        version=store.version if store.covers(now) else "",
+        push=watch_channels is not None,
+    )
+
+
+@app.route("/calendar-events", methods=["GET"])
+def calendar_events():
+    """
+    Return the laid out events of the days in a 4-day window that changed.
+
+    Query parameters:
+        start: First day of the window, defaults to the current date
+        version: Event store version the client has already rendered
+
+    Returns:
+        JSON with the current version and the events of each changed day
+    """
+    if "credentials" not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    current_date_str = parse_day(request.args.get("start", get_current_date()))
+    if current_date_str is None:
+        return jsonify({"error": "Invalid start date"}), 400
+
+    started = time.perf_counter()
+    start_date, end_date = get_date_range(current_date_str)
+    now = format_date_for_api(start_date.isoformat())
+    end = format_date_for_api(end_date.isoformat())
+
+    store = get_event_store()
+    events = fetch_events(get_calendar_service(), store, now, end)
+    version = store.version if store.covers(now) else None
+
+    etag = f"{version}-{current_date_str}"
+    if version is not None and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    days = [start_date + timedelta(days=i) for i in range(4)]
+    changed_days = set(days)
+    client_version = request.args.get("version")
+    if version is not None and client_version:
+        changes = store.changed_since(client_version)
+        if changes is not None:
+            changed_days = {
+                day
+                for day in days
+                for start, end in changes
+                if changed_day_overlaps(day, start, end)
+            }
+
+    days_events = layout_events(events)
+    response = jsonify(
+        {
+            "version": version,
+            "days": {
+                day.strftime("%Y-%m-%d"): [
+                    box._asdict()
+                    for box in days_events.get(day.strftime("%Y-%m-%d"), [])
+                ]
+                for day in days
+                if day in changed_days
+            },
+        }
+    )
+    if version is not None:
+        response.set_etag(etag)
+    app.logger.info(
+        "Calendar diff: %d of 4 days, %d bytes in %.1f ms",
+        len(changed_days),
+        response.content_length,
+        (time.perf_counter() - started) * 1000,
+    )
+    return response
+
+
+@app.route("/calendar/notifications", methods=["POST"])
+def calendar_notification():
+    """
+    Receive a push notification of a watched calendar.
+
+    Google posts one when a channel opens and then whenever the calendar
+    changes. Changes are fetched in the background with an incremental sync,
+    so Google gets its answer right away.
+    """
+    if watch_channels is None:
+        return "", 404
+
+    channel = watch_channels.get(request.headers.get("X-Goog-Channel-ID", ""))
+    if channel is None:
+        # Channels of an earlier process are acknowledged and left to expire
+        return "", 204
+    if not watch_channels.verify(channel, request.headers.get("X-Goog-Channel-Token")):
+        return "", 403
+
+    tracer.count("calendar_notifications_total")
+    if request.headers.get("X-Goog-Resource-State") != "sync":
+        schedule_refresh(channel["owner"], channel["calendarId"])
+    return "", 204
+
+
+@app.route("/calendar/changes", methods=["GET"])
+def calendar_changes():
+    """
+    Stream changes of the user's calendars to the grid as server-sent events.
+
+    A "changed" event with the new store version is sent whenever a
+    notification changed one of the calendars.
+    """
+    if "credentials" not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    owner = get_session_id()
+    stream = change_feed.subscribe(owner)
+
+    def generate():
+        try:
+            yield "retry: 1000\n\n"
+            deadline = time.monotonic() + PUSH_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    message = stream.get(timeout=PUSH_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse("changed", message)
+        finally:
+            change_feed.unsubscribe(owner, stream)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.before_request
+def start_request_timer():
+    if tracer.enabled:
+        request.environ["timecraft.started"] = time.perf_counter()
+
+
+@app.after_request
+def add_server_timing(response):
+    """Report the spans of the request in the Server-Timing header."""
+    started = request.environ.get("timecraft.started")
+    if started is not None:
+        tracer.record(f"http.{request.endpoint}", time.perf_counter() - started)
+        response.headers["Server-Timing"] = server_timing(get_request_spans())
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    """Expose span percentiles, counters and cache statistics for Prometheus."""
+    gauges = {}
+    for name, cache in (
+        ("service_cache", service_cache),
+        ("event_store", event_stores),
+    ):
+        for key, value in cache.stats().items():
+            gauges[f"{name}_{key}"] = value
+    with prefetch_lock:
+        gauges["prefetch_hits"] = navigation_stats["hits"]
+        gauges["prefetch_misses"] = navigation_stats["misses"]
+    if llm_cache is not None:
+        for key, value in llm_cache.stats().items():
+            gauges[f"llm_cache_{key}"] = value
+    for name, scheduler in (
+        ("calendar", calendar_scheduler),
+        ("groq", groq_scheduler),
+    ):
+        for key, value in scheduler.stats().items():
+            gauges[f"{name}_scheduler_{key}"] = value
+    if watch_channels is not None:
+        gauges["watch_channels"] = len(watch_channels)
+    gauges["push_streams"] = len(change_feed)
+
+    return Response(
+        prometheus_text(tracer, "timecraft", gauges),
+        mimetype="text/plain; version=0.0.4",
     )
 
 
 @app.route("/logout")
 def logout():
+    cancel_prefetches(session.get("session_id"))
+    warm_contexts.pop(session.get("session_id"))
+    if watch_channels is not None:
+        stop_channels(session.get("session_id"))
+    conversations.reset(session.get("session_id"))
+    get_job_queue().cancel_owner(session.get("session_id"))
+    service_cache.pop(session.get("session_id"))
+    event_stores.pop(session.get("session_id"))
     session.clear()
     return redirect(url_for("index"))
 
 
-@app.route("/chat", methods=["POST"])
-def chat():
-    data = request.get_json()
-    message = data.get("message")
-    chat_log = data.get("chat_log", [])
+# System prompt of the first LLM call, the calendar context goes in between
+SYSTEM_PROMPT_HEADER = "You are TimeCraft, an AI assistant integrated with Google Calendar to help users manage their time effectively and achieve their goals through intelligent scheduling and time-blocking. You have access to the user's calendar events and can create, update, and manage events.\n\nCAPABILITIES:\n- View upcoming calendar events\n- Create new calendar events with specific times\n- Update existing calendar events\n- Delete calendar events when appropriate\n- Suggest time-blocking strategies based on user goals\n- Help users organize their schedule efficiently\n\nCURRENT CALENDAR CONTEXT:\n"
+SYSTEM_PROMPT_FOOTER = '\n\nRESPONSE FORMAT:\nAnalyze the user\'s request and respond in ONE of these two formats (ALWAYS in JSON format):\n\n1. If clarification is needed, or you need to converse with the user and not perform an action:\n{\n    "type": "inquiry",\n    "message": "Clear, specific question to get necessary information from user, or a response to the user if applicable"\n}\n\n2. If action can be taken:\n{\n    "type": "action",\n    "actions": [\n        {\n            "operation": "create_events|update_events|delete_events",\n            "events": [\n                {\n                    // Event details following the required format for each operation\n                }\n            ]\n        }\n    ],\n    "message": "Clear explanation of what actions were taken and why"\n}\n\nGUIDELINES:\n- Always check calendar context before suggesting times\n- Prefer specific times over vague scheduling\n- Consider time-blocking best practices\n- Do not suggest times which overlap with other events\n- If multiple events are related, or changing one event influences the other, batch them together\n- Be proactive in suggesting optimal scheduling approaches\n- When not fully certain about the dates and times, ask for clarification rather than making assumptions all the time\n- Before outputting actions, double check all the details first with an inquiry\n- Use clear, conversational language in responses\n- You do not need to just ask for clarification in inquiries. You can provide suggestions and clarify assumptions\n- Format all times in UTC (e.g., "2024-11-24T14:00:00Z")\n\nExample of good responses:\nUser: "I need to study for 3 hours tomorrow"\nResponse: {\n    "type": "inquiry",\n    "message": "I see you have some free time tomorrow. Would you prefer to study in the morning between 9 AM-12 PM, or in the afternoon between 2 PM-5 PM?"\n}\n\nUser: "Schedule a team meeting for next Tuesday at 2pm for 1 hour"\nResponse: {\n    "type": "action",\n    "actions": [{\n        "operation": "create_events",\n        "events": [{\n            "summary": "Team Meeting",\n            "start": "2024-11-26T14:00:00Z",\n            "end": "2024-11-26T15:00:00Z"\n        }]\n    }],\n    "message": "I\'ve scheduled the team meeting for next Tuesday at 2 PM for one hour. Would you like me to add any specific agenda items to the event description?"\n}\n\nNote: if there are multiple messages in the chat, your messages will not be in JSON format as it was formatted for the user. Always provide a JSON formatted response.'
+
+CHAT_MODEL = "llama-3.2-90b-vision-preview"
+
+
+# Token budget of the prompt of the first LLM call
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+
+# Share of the budget left after the fixed instructions that the calendar may use
+CALENDAR_BUDGET_SHARE = 0.6
+
+# Part of the history budget used to summarize messages that no longer fit
+HISTORY_SUMMARY_TOKENS = 300
+
+# Minutes the current time in the prompt is rounded down to
+PROMPT_TIME_RESOLUTION = 5
+
+
+def build_system_prompt(calendar_context: str, history_summary: str = "") -> str:
+    """
+    Build the TimeCraft system prompt.
+
+    Args:
+        calendar_context: Calendar section built by build_calendar_context
+        history_summary: Optional summary of older chat messages
+
+    Returns:
+        The system prompt
+    """
+    if history_summary:
+        calendar_context += (
+            "\nEARLIER CONVERSATION (older messages, summarized):\n"
+            + history_summary
+            + "\n"
+        )
+    return SYSTEM_PROMPT_HEADER + calendar_context + SYSTEM_PROMPT_FOOTER
+
+
+# Keys of busy time from BUSY_CALENDAR_IDS in the free/busy index
+BUSY_KEY_PREFIX = "busy:"
+
+
+def build_busy_index(
+    events: List[Dict], busy_blocks: List[tuple] = ()
+) -> FreeBusyIndex:
+    """
+    Build a free/busy index of formatted events, keyed by event ID.
+
+    Args:
+        events: List of formatted events
+        busy_blocks: Optional (start, end, calendar ID) busy time of calendars
+            without event details, keyed by BUSY_KEY_PREFIX and calendar ID
+
+    Returns:
+        The index
+    """
+    return FreeBusyIndex(
+        [
+            (
+                parse_event_time(event["start"]).timestamp(),
+                parse_event_time(event["end"]).timestamp(),
+                event["eventId"],
+            )
+            for event in events
+        ]
+        + [
+            (start, end, BUSY_KEY_PREFIX + calendar_id)
+            for start, end, calendar_id in busy_blocks
+        ]
+    )
+
+
+def list_busy(time_min: str, time_max: str) -> List[tuple]:
+    """
+    Get the busy time of BUSY_CALENDAR_IDS.
+
+    Args:
+        time_min: Start of the window
+        time_max: End of the window
+
+    Returns:
+        List of (start, end, calendar ID) tuples, empty if unavailable
+    """
+    service = get_calendar_service()
+    if not service or not BUSY_CALENDAR_IDS:
+        return []
+    try:
+        return query_busy(service, BUSY_CALENDAR_IDS, time_min, time_max)
+    except HttpError as e:
+        app.logger.warning("Free/busy query failed: %s", e)
+        return []
+
 
-    # Get calendar events for the next 7 days
+def get_prompt_time() -> datetime:
+    """
+    Return the current UTC time for the prompt.
+
+    It is rounded so the prompt, and with it the LLM response cache key, stays
+    the same for a while.
+    """
+    now = datetime.utcnow()
+    return now - timedelta(
+        minutes=now.minute % PROMPT_TIME_RESOLUTION,
+        seconds=now.second,
+        microseconds=now.microsecond,
+    )
+
+
+def fetch_calendar_context(now: datetime) -> tuple:
+    """
+    Start fetching the calendar of the 7 days after now.
+
+    Args:
+        now: Time from get_prompt_time
+
+    Returns:
+        Tuple of the futures of the events and of the busy time of
+        BUSY_CALENDAR_IDS, the latter None if there are none
+    """
     timeframe = {
-        "start": datetime.utcnow().isoformat() + "Z",
-        "end": (datetime.utcnow() + timedelta(days=7)).isoformat() + "Z",
+        "start": now.isoformat() + "Z",
+        "end": (now + timedelta(days=7)).isoformat() + "Z",
     }
+    events_future = calendar_pool.submit(
+        copy_current_request_context(list_events), timeframe
+    )
+    busy_future = (
+        calendar_pool.submit(
+            copy_current_request_context(list_busy),
+            timeframe["start"],
+            timeframe["end"],
+        )
+        if BUSY_CALENDAR_IDS
+        else None
+    )
+    return events_future, busy_future
 
-    events_result = list_events(timeframe)
 
+def encode_calendar_context(
+    events_future, busy_future, now: datetime, timezone: str
+) -> Optional[Dict]:
+    """
+    Encode a calendar fetched by fetch_calendar_context for the prompt.
+
+    Args:
+        events_future: Future of the list_events result
+        busy_future: Future of the list_busy result, or None
+        now: Time the calendar was fetched for
+        timezone: Time zone of the user, used to suggest free time
+
+    Returns:
+        Dictionary with the events, the busy_blocks of busy-only calendars,
+        the encoded calendar_context and the store version it matches, or
+        None if the calendar could not be accessed
+    """
+    events_result = events_future.result()
     if not events_result.get("success"):
-        return jsonify(
+        return None
+
+    events = events_result.get("events", [])
+    busy_blocks = busy_future.result() if busy_future else []
+    now = now.replace(tzinfo=dt_timezone.utc)
+    available = PROMPT_TOKEN_BUDGET - estimate_tokens(
+        SYSTEM_PROMPT_HEADER + SYSTEM_PROMPT_FOOTER
+    )
+    calendar_budget = int(available * CALENDAR_BUDGET_SHARE)
+    calendars = (
+        f"Calendars: {', '.join(CALENDAR_IDS)}. New events go to "
+        f"{DEFAULT_CALENDAR_ID} unless an event sets calendarId.\n"
+        if len(CALENDAR_IDS) > 1
+        else ""
+    )
+    calendar_context = calendars + build_calendar_context(
+        events,
+        now,
+        calendar_budget - estimate_tokens(calendars),
+        encode_free_slots(
+            build_busy_index(events, busy_blocks), now, get_zone(timezone)
+        ),
+    )
+    return {
+        "events": events,
+        "busy_blocks": busy_blocks,
+        "calendar_context": calendar_context,
+        "version": get_event_store().version,
+    }
+
+
+# Calendar contexts prepared by /chat/warmup while the user types, one slot
+# per user. They expire before the store would sync again, so they are never
+# staler than a fresh read.
+WARMUP_TTL = 30
+warm_contexts = TTLCache(max_size=256, ttl=WARMUP_TTL)
+
+# Seconds a chat turn waits for a warm-up still in progress
+WARMUP_WAIT = 10
+
+
+def take_warm_context(now: datetime, timezone: str) -> Optional[Dict]:
+    """
+    Get the calendar context prepared by /chat/warmup, if it still applies.
+
+    Args:
+        now: Time from get_prompt_time
+        timezone: Time zone of the user
+
+    Returns:
+        The result of encode_calendar_context, or None if there is no warm
+        context for this time, time zone and calendar version
+    """
+    slot = warm_contexts.get(get_session_id())
+    if slot is None or slot["now"] != now or slot["timezone"] != timezone:
+        return None
+    try:
+        # A warm-up still in progress is closer to done than a new fetch
+        calendar = slot["future"].result(timeout=WARMUP_WAIT)
+    except FutureTimeoutError:
+        return None
+    if calendar is None or calendar["version"] != get_event_store().version:
+        return None
+    return calendar
+
+
+def get_chat_context(
+    chat_log: List[Dict[str, str]], timezone: str = "UTC", summary: str = ""
+) -> Optional[tuple]:
+    """
+    Build the messages for the first LLM call of a chat turn.
+
+    The calendar context and chat history are fitted into PROMPT_TOKEN_BUDGET,
+    so the prompt stays the same size as calendars and conversations grow.
+    The calendar context prepared by /chat/warmup is used when it applies.
+
+    Args:
+        chat_log: List of previous messages with role and content
+        timezone: Time zone of the user, used to suggest free time
+        summary: Rolling summary of messages before chat_log
+
+    Returns:
+        Tuple of the messages and a free/busy index of the next 7 days, or
+        None if the calendar could not be accessed
+    """
+    now = get_prompt_time()
+    calendar = take_warm_context(now, timezone)
+    tracer.count("chat_warm_contexts_total" if calendar else "chat_cold_contexts_total")
+    # Otherwise fetch the calendar while the conversation is prepared
+    futures = None if calendar else fetch_calendar_context(now)
+
+    available = PROMPT_TOKEN_BUDGET - estimate_tokens(
+        SYSTEM_PROMPT_HEADER + SYSTEM_PROMPT_FOOTER
+    )
+    calendar_budget = int(available * CALENDAR_BUDGET_SHARE)
+    history, history_summary = fit_history(
+        [{"role": log["role"], "content": log["content"]} for log in chat_log],
+        available - calendar_budget - HISTORY_SUMMARY_TOKENS,
+        HISTORY_SUMMARY_TOKENS,
+        summary,
+    )
+
+    if futures is not None:
+        calendar = encode_calendar_context(*futures, now, timezone)
+    if calendar is None:
+        return None
+
+    messages = [
+        {
+            "role": "system",
+            "content": build_system_prompt(
+                calendar["calendar_context"], history_summary
+            ),
+        },
+        *history,
+    ]
+    # find_conflicts adds planned events to the index, so every turn gets its own
+    return messages, build_busy_index(calendar["events"], calendar["busy_blocks"])
+
+
+def find_conflicts(
+    actions: List[Dict], busy: FreeBusyIndex, timezone: str
+) -> Dict[tuple, List[str]]:
+    """
+    Find planned events which overlap other events, without any API calls.
+
+    Events created or moved earlier in the plan count as busy for later ones,
+    the time moved events leave is free, and events the plan deletes do not
+    count at all. New events are known by the ID create_events gives them, so
+    an event planned twice, or created by an earlier submission of the same
+    plan, does not overlap itself.
+
+    Args:
+        actions: Actions planned by the LLM
+        busy: Free/busy index of the calendar, updated with the planned events
+        timezone: Time zone of the user, used for new events
+
+    Returns:
+        Dictionary mapping (action index, event index) to the titles of the
+        overlapping events
+    """
+    store = get_event_store()
+    deleted = {
+        event.get("eventId")
+        for action in actions
+        if action.get("operation") == "delete_events"
+        for event in action.get("events", [])
+    }
+    planned_titles = {}
+    planned_creates = {}
+    conflicts = {}
+    for i, action in enumerate(actions):
+        operation = action.get("operation")
+        if operation not in ("create_events", "update_events"):
+            continue
+
+        for j, event in enumerate(action.get("events", [])):
+            try:
+                if operation == "create_events":
+                    # create_events books wall-clock times in the user's time zone
+                    zone = get_zone(timezone)
+                    start = datetime.fromisoformat(event["start"][:-1]).replace(
+                        tzinfo=zone
+                    )
+                    end = datetime.fromisoformat(event["end"][:-1]).replace(tzinfo=zone)
+                else:
+                    start = parse_event_time(event["start"])
+                    end = parse_event_time(event["end"])
+            except (KeyError, TypeError, ValueError):
+                # Partial updates keep their times, and bad times fail later
+                continue
+
+            if operation == "create_events":
+                try:
+                    key = event_id_for(create_key(event, timezone))
+                except KeyError:
+                    key = f"planned-{i}-{j}"
+                # Duplicates are created once, with the outcome of the first
+                if key in planned_creates:
+                    if planned_creates[key] in conflicts:
+                        conflicts[(i, j)] = conflicts[planned_creates[key]]
+                    continue
+                planned_creates[key] = (i, j)
+            else:
+                key = event.get("eventId") or f"planned-{i}-{j}"
+            overlapping = busy.conflicts(
+                start.timestamp(), end.timestamp(), ignore=deleted | {key}
+            )
+            if overlapping:
+                conflicts[(i, j)] = [
+                    planned_titles.get(other)
+                    or (store.get(other) or {}).get("summary")
+                    or (
+                        f"busy time on {other[len(BUSY_KEY_PREFIX):]}"
+                        if other.startswith(BUSY_KEY_PREFIX)
+                        else "another event"
+                    )
+                    for other in overlapping
+                ]
+                if CONFLICT_POLICY == "reject":
+                    continue
+
+            # A moved event no longer takes up its old time
+            busy.remove(key)
+            busy.add(start.timestamp(), end.timestamp(), key)
+            planned_titles[key] = (
+                event.get("summary")
+                or (store.get(key) or {}).get("summary")
+                or "another planned event"
+            )
+    return conflicts
+
+
+def run_action(action: Dict, timezone: str) -> Dict:
+    """
+    Execute one action planned by the LLM.
+
+    Args:
+        action: Dictionary containing operation and events
+        timezone: Time zone of the user, used for new events
+
+    Returns:
+        Dictionary containing the operation and its per-event results
+    """
+    operation = action["operation"]
+    events = action["events"]
+
+    with tracer.span(f"action.{operation}"):
+        if operation == "create_events":
+            result = create_events(events, timezone)
+        elif operation == "update_events":
+            result = update_events(events)
+        elif operation == "delete_events":
+            result = delete_events(events)
+        else:
+            result = [{"success": False, "error": f"Unknown operation: {operation}"}]
+
+    return {"operation": operation, "results": result}
+
+
+def plan_waves(actions: List[Dict]) -> List[List[int]]:
+    """
+    Group actions into waves which can each run concurrently.
+
+    An action touching an event changed by an earlier action goes in a later
+    wave than it, so changes to the same event keep their order. So does an
+    action creating an event an earlier action creates, which then finds it
+    created instead of racing it.
+
+    Args:
+        actions: Actions planned by the LLM
+
+    Returns:
+        List of waves, each a list of action indices
+    """
+    waves = []
+    action_waves = []
+    touched = []
+    for action in actions:
+        event_ids = set()
+        for event in action.get("events", []):
+            if not isinstance(event, dict):
+                continue
+            if "eventId" in event:
+                event_ids.add(event["eventId"])
+            elif action.get("operation") == "create_events":
+                event_ids.add(
+                    (event.get("summary"), event.get("start"), event.get("end"))
+                )
+        wave = 0
+        for earlier_wave, earlier_ids in zip(action_waves, touched):
+            if event_ids & earlier_ids:
+                wave = max(wave, earlier_wave + 1)
+
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(len(action_waves))
+        action_waves.append(wave)
+        touched.append(event_ids)
+    return waves
+
+
+def merge_conflicts(
+    index: int, action: Dict, result: Dict, conflicts: Dict[tuple, List[str]]
+) -> Dict:
+    """Add the conflicts found for an action to its results."""
+    if not any(key[0] == index for key in conflicts):
+        return result
+
+    if CONFLICT_POLICY == "reject":
+        ran = iter(result["results"])
+        outcomes = []
+        for j in range(len(action["events"])):
+            if (index, j) in conflicts:
+                titles = ", ".join(conflicts[(index, j)])
+                outcomes.append({"success": False, "error": f"Overlaps with {titles}"})
+            else:
+                outcomes.append(next(ran))
+    else:
+        outcomes = [dict(outcome) for outcome in result["results"]]
+        for j, outcome in enumerate(outcomes):
+            if (index, j) in conflicts:
+                outcome["conflicts"] = conflicts[(index, j)]
+
+    return {**result, "results": outcomes}
+
+
+def iter_action_results(
+    actions: List[Dict], timezone: str, conflicts: Dict[tuple, List[str]] = None
+):
+    """
+    Execute an action plan, running independent actions concurrently.
+
+    Args:
+        actions: Actions planned by the LLM
+        timezone: Time zone of the user, used for new events
+        conflicts: Optional conflicts found by find_conflicts. Depending on
+            CONFLICT_POLICY the events are skipped or flagged in the results.
+
+    Yields:
+        (index, result) tuples in the order the actions complete
+    """
+    conflicts = conflicts or {}
+    planned = actions
+    if CONFLICT_POLICY == "reject":
+        planned = [
             {
-                "bot_response": "Sorry, I couldn't access your calendar. Please make sure you're logged in."
+                **action,
+                "events": [
+                    event
+                    for j, event in enumerate(action["events"])
+                    if (i, j) not in conflicts
+                ],
             }
-        )
+            for i, action in enumerate(actions)
+        ]
+
+    for wave in plan_waves(planned):
+        futures = {}
+        for index in wave:
+            if not planned[index]["events"] and actions[index]["events"]:
+                # Every event of the action was rejected
+                result = {"operation": actions[index]["operation"], "results": []}
+                yield index, merge_conflicts(index, actions[index], result, conflicts)
+                continue
+            future = calendar_pool.submit(
+                copy_current_request_context(run_action), planned[index], timezone
+            )
+            futures[future] = index
 
-    # Format calendar events for the prompt
-    calendar_events = "Upcoming events for the next 7 days:\n"
-    for event in events_result.get("events", []):
-        start_time = datetime.fromisoformat(event["start"].replace("Z", "+00:00"))
-        end_time = datetime.fromisoformat(event["end"].replace("Z", "+00:00"))
-        calendar_events += f"- {event['summary']}: {start_time.strftime('%Y-%m-%d %H:%M')} to {end_time.strftime('%Y-%m-%d %H:%M')} UTC\n"
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures.pop(future)
+                result = future.result()
+                if len(result["results"]) == len(planned[index]["events"]):
+                    result = merge_conflicts(index, actions[index], result, conflicts)
+                yield index, result
 
-    if not events_result.get("events"):
-        calendar_events += "No events scheduled.\n"
 
-    # Get system prompt and format it with calendar events
-    system_prompt = (
-        "You are TimeCraft, an AI assistant integrated with Google Calendar to help users manage their time effectively and achieve their goals through intelligent scheduling and time-blocking. You have access to the user's calendar events and can create, update, and manage events.\n\nCAPABILITIES:\n- View upcoming calendar events\n- Create new calendar events with specific times\n- Update existing calendar events\n- Delete calendar events when appropriate\n- Suggest time-blocking strategies based on user goals\n- Help users organize their schedule efficiently\n\nCURRENT CALENDAR CONTEXT:\n"
-        + calendar_events
-        + '\n\nRESPONSE FORMAT:\nAnalyze the user\'s request and respond in ONE of these two formats (ALWAYS in JSON format):\n\n1. If clarification is needed, or you need to converse with the user and not perform an action:\n{\n    "type": "inquiry",\n    "message": "Clear, specific question to get necessary information from user, or a response to the user if applicable"\n}\n\n2. If action can be taken:\n{\n    "type": "action",\n    "actions": [\n        {\n            "operation": "create_events|update_events|delete_events",\n            "events": [\n                {\n                    // Event details following the required format for each operation\n                }\n            ]\n        }\n    ],\n    "message": "Clear explanation of what actions were taken and why"\n}\n\nGUIDELINES:\n- Always check calendar context before suggesting times\n- Prefer specific times over vague scheduling\n- Consider time-blocking best practices\n- Do not suggest times which overlap with other events\n- If multiple events are related, or changing one event influences the other, batch them together\n- Be proactive in suggesting optimal scheduling approaches\n- When not fully certain about the dates and times, ask for clarification rather than making assumptions all the time\n- Before outputting actions, double check all the details first with an inquiry\n- Use clear, conversational language in responses\n- You do not need to just ask for clarification in inquiries. You can provide suggestions and clarify assumptions\n- Format all times in UTC (e.g., "2024-11-24T14:00:00Z")\n\nExample of good responses:\nUser: "I need to study for 3 hours tomorrow"\nResponse: {\n    "type": "inquiry",\n    "message": "I see you have some free time tomorrow. Would you prefer to study in the morning between 9 AM-12 PM, or in the afternoon between 2 PM-5 PM?"\n}\n\nUser: "Schedule a team meeting for next Tuesday at 2pm for 1 hour"\nResponse: {\n    "type": "action",\n    "actions": [{\n        "operation": "create_events",\n        "events": [{\n            "summary": "Team Meeting",\n            "start": "2024-11-26T14:00:00Z",\n            "end": "2024-11-26T15:00:00Z"\n        }]\n    }],\n    "message": "I\'ve scheduled the team meeting for next Tuesday at 2 PM for one hour. Would you like me to add any specific agenda items to the event description?"\n}\n\nNote: if there are multiple messages in the chat, your messages will not be in JSON format as it was formatted for the user. Always provide a JSON formatted response.'
+def run_actions(
+    actions: List[Dict], timezone: str, conflicts: Dict[tuple, List[str]] = None
+) -> List[Dict]:
+    """
+    Execute an action plan.
+
+    Args:
+        actions: Actions planned by the LLM
+        timezone: Time zone of the user, used for new events
+        conflicts: Optional conflicts found by find_conflicts
+
+    Returns:
+        List of results in the same order as the actions
+    """
+    results = [None] * len(actions)
+    for index, result in iter_action_results(actions, timezone, conflicts):
+        results[index] = result
+    return results
+
+
+def get_summary_messages(
+    message: str, results: List[Dict], chat_log: List[Dict[str, str]]
+) -> List[Dict[str, str]]:
+    """Build the messages for the LLM call describing the actions taken."""
+    action_summary = json.dumps(results, indent=2)
+    return [
+        {
+            "role": "system",
+            "content": 'You are TimeCraft. Format the following action results into a friendly, clear message for the user. Focus on what was accomplished and any next steps or additional information the user might need. Do not provide the event ID. Start the message with "Done!"',
+        },
+        {
+            "role": "user",
+            "content": f"Original request: {message}\nAction results: {action_summary}\n Chat log: {chat_log}",
+        },
+    ]
+
+
+def get_event_names(actions: List[Dict]) -> Dict[str, str]:
+    """Look up the titles of the existing events an action plan refers to."""
+    store = get_event_store()
+    names = {}
+    for action in actions:
+        for event in action.get("events", []):
+            existing = store.get(event.get("eventId", ""))
+            if existing:
+                names[event["eventId"]] = existing.get("summary", "No Title")
+    return names
+
+
+def format_time_range(start: str, end: str, timezone: str) -> str:
+    """Format an event's start and end for the user, e.g. "Tue, Nov 26, 2:00 PM - 3:00 PM"."""
+    zone = get_zone(timezone)
+    start_dt = parse_event_time(start).astimezone(zone)
+    end_dt = parse_event_time(end).astimezone(zone)
+    text = start_dt.strftime("%a, %b %d, %I:%M %p").replace(" 0", " ")
+    if end_dt.date() == start_dt.date():
+        return text + end_dt.strftime(" - %I:%M %p").replace(" 0", " ")
+    return text + end_dt.strftime(" - %a, %b %d, %I:%M %p").replace(" 0", " ")
+
+
+def render_action_summary(
+    actions: List[Dict], results: List[Dict], timezone: str, names: Dict[str, str]
+) -> str:
+    """
+    Describe the outcome of an action plan without an LLM call.
+
+    Args:
+        actions: Actions planned by the LLM
+        results: Results returned by run_action for each action
+        timezone: Time zone of the user
+        names: Titles of existing events, keyed by event ID
+
+    Returns:
+        Message for the user starting with "Done!"
+    """
+    sentences = []
+    for action, result in zip(actions, results):
+        operation = result["operation"]
+        verb = {
+            "create_events": "Created",
+            "update_events": "Updated",
+            "delete_events": "Deleted",
+        }.get(operation)
+        if verb is None:
+            sentences.append(f"I skipped an unknown operation ({operation}).")
+            continue
+
+        for event, outcome in zip(action["events"], result["results"]):
+            title = event.get("summary") or names.get(event.get("eventId"), "the event")
+            if not outcome["success"]:
+                sentences.append(
+                    f'I couldn\'t {verb[:-1].lower()} "{title}": {outcome["error"]}.'
+                )
+            elif operation == "create_events":
+                # create_events books the times as wall-clock times in the
+                # user's time zone, so they are shown without conversion
+                when = format_time_range(event["start"][:-1], event["end"][:-1], "UTC")
+                sentences.append(f'{verb} "{title}" ({when}).')
+            elif operation == "update_events" and "start" in event and "end" in event:
+                when = format_time_range(event["start"], event["end"], timezone)
+                sentences.append(f'{verb} "{title}" ({when}).')
+            else:
+                sentences.append(f'{verb} "{title}".')
+
+            if outcome.get("conflicts"):
+                titles = '", "'.join(outcome["conflicts"])
+                sentences.append(f'Heads up: it overlaps with "{titles}".')
+
+    return " ".join(["Done!", *sentences])
+
+
+def use_llm_summary(results: List[Dict]) -> bool:
+    """Return whether the action results should be summarized by the LLM."""
+    if SUMMARY_MODE == "llm":
+        return True
+    if SUMMARY_MODE == "template":
+        return False
+    return any(
+        not outcome["success"] for result in results for outcome in result["results"]
     )
 
-    new_chat_log = []
-    for log in chat_log:
-        if log["role"] == "user":
-            new_chat_log.append(log)
-        else:
-            new_chat_log.append(
-                {
-                    "role": "assistant",
-                    "content": '{\n    "type": "inquiry",\n    "message": "'
-                    + log["content"]
-                    + '"\n}',
-                }
+
+# Groq calls failing with a rate limit, server or network error are retried
+GROQ_RETRIES = 2
+
+
+def create_completion(span: str, **params):
+    """
+    Call the Groq chat completions API, recording its latency and token usage.
+
+    Calls are admitted by groq_scheduler. Rate limited calls are retried once
+    the scheduler lets them through again, other failures after a backoff.
+
+    Args:
+        span: Name of the span, telling the calls of a chat turn apart
+        **params: Parameters of groq.chat.completions.create
+
+    Returns:
+        The completion, or the chunk iterator when streaming
+
+    Raises:
+        Throttled: If Groq kept rate limiting the call
+    """
+    client = get_groq()
+    # The groq package is imported by now
+    from groq import APIConnectionError, APIStatusError
+
+    owner = get_session_id()
+    for attempt in range(GROQ_RETRIES + 1):
+        groq_scheduler.acquire(owner)
+        throttled, retry_after = 0, None
+        try:
+            with tracer.span(span):
+                completion = client.chat.completions.create(**params)
+            break
+        except APIStatusError as e:
+            if e.status_code == 429:
+                throttled = 1
+                retry_after = parse_retry_after(e.response.headers.get("retry-after"))
+                if attempt == GROQ_RETRIES:
+                    raise Throttled(retry_after or OutboundScheduler.DEFAULT_PAUSE)
+            elif e.status_code < 500 or attempt == GROQ_RETRIES:
+                raise
+        except APIConnectionError:
+            if attempt == GROQ_RETRIES:
+                raise
+        finally:
+            groq_scheduler.release(owner, 1, throttled, retry_after)
+        tracer.count("groq_retries_total")
+        if not throttled:
+            time.sleep(RETRY_BACKOFF * 2**attempt)
+
+    usage = getattr(completion, "usage", None)
+    if usage:
+        tracer.count("groq_prompt_tokens_total", usage.prompt_tokens)
+        tracer.count("groq_completion_tokens_total", usage.completion_tokens)
+    return completion
+
+
+def log_prompt_tokens(estimated: int, completion=None) -> None:
+    """Log the size of a chat prompt, as estimated and as counted by Groq."""
+    tracer.count("prompt_tokens_estimated_total", estimated)
+    usage = getattr(completion, "usage", None)
+    app.logger.info(
+        "Chat prompt tokens: %d estimated, %s reported",
+        estimated,
+        usage.prompt_tokens if usage else "not",
+    )
+
+
+def cached_response(messages: List[Dict[str, str]], **params) -> tuple:
+    """
+    Look up the response of the first LLM call of a chat turn.
+
+    Args:
+        messages: Messages built by get_chat_context
+        **params: Parameters the call is made with besides temperature and
+            max_tokens, e.g. stream or response_format, as responses to
+            different ones are cached apart
+
+    Returns:
+        Tuple of the cache key and the cached response content, or None for
+        either when caching is off or the prompt was not seen before
+    """
+    cache = get_llm_cache()
+    if cache is None:
+        return None, None
+    key = prompt_key(CHAT_MODEL, messages, temperature=0, max_tokens=1024, **params)
+    response_content = cache.get(key)
+    app.logger.info(
+        "LLM response cache %s (%s)",
+        "miss" if response_content is None else "hit",
+        cache.stats(),
+    )
+    return key, response_content
+
+
+# Chat histories, so clients only send the new message of every turn
+conversations = ConversationStore(summary_tokens=HISTORY_SUMMARY_TOKENS)
+
+
+def read_message(data: Dict) -> Optional[str]:
+    """Get the user's message from a chat request, or None if it has none."""
+    message = data.get("message")
+    if not isinstance(message, str) or not message.strip():
+        return None
+    return message
+
+
+def start_turn(message: str) -> tuple:
+    """
+    Add the user's message to their conversation.
+
+    Args:
+        message: New message of the user
+
+    Returns:
+        Tuple of the conversation ID, the messages including the new one, and
+        the summary of older messages
+    """
+    conversation_id = get_session_id()
+    conversations.append(conversation_id, "user", message)
+    chat_log, summary = conversations.get(conversation_id)
+    return conversation_id, chat_log, summary
+
+
+@app.route("/chat/history", methods=["GET"])
+def chat_history():
+    """Return the messages of the current conversation, oldest first."""
+    messages, _ = conversations.get(get_session_id())
+    return jsonify({"messages": messages})
+
+
+@app.route("/chat/reset", methods=["POST"])
+def chat_reset():
+    """Start a new conversation."""
+    conversations.reset(get_session_id())
+    return jsonify({"success": True})
+
+
+@app.route("/chat/warmup", methods=["POST"])
+def chat_warmup():
+    """
+    Prepare the calendar context of the next chat turn while the user types.
+
+    The chat box calls this when it gets focus or the user starts typing. The
+    context goes into the user's slot in warm_contexts, where the next chat
+    turn picks it up instead of fetching the calendar itself.
+
+    Returns:
+        JSON with whether a context is ready
+    """
+    if "credentials" not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    timezone = (request.get_json(silent=True) or {}).get("timezone", "UTC")
+    now = get_prompt_time()
+    user_id = get_session_id()
+    slot = warm_contexts.get(user_id)
+    if (
+        slot is not None
+        and not slot["future"].done()
+        and slot["now"] == now
+        and slot["timezone"] == timezone
+    ):
+        return jsonify({"ready": False})
+    if take_warm_context(now, timezone) is not None:
+        return jsonify({"ready": True})
+
+    future = Future()
+    warm_contexts.set(user_id, {"now": now, "timezone": timezone, "future": future})
+    try:
+        with tracer.span("chat.warmup"):
+            # The first chat turn of the process would import the client
+            get_groq()
+            calendar = encode_calendar_context(
+                *fetch_calendar_context(now), now, timezone
             )
+    except Exception as e:
+        app.logger.warning("Chat warm-up failed: %s", e)
+        calendar = None
+    future.set_result(calendar)
+    return jsonify({"ready": calendar is not None})
+
+
+# Action plans touching more events than this run as background jobs
+JOB_THRESHOLD = int(os.getenv("JOB_THRESHOLD", "20"))
+
+# Most events per action of a job, progress is saved after every action
+JOB_CHUNK_SIZE = 10
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+
+# Job queue and workers of this process, started on first use by get_job_queue
+job_queue = None
+job_workers = None
+_jobs_lock = threading.Lock()
+_jobs_recovered = False
 
-    # Make initial LLM call
-    completion = groq.chat.completions.create(
-        model="llama-3.2-90b-vision-preview",
-        messages=[
+
+def count_events(actions: List[Dict]) -> int:
+    """Count the events an action plan touches."""
+    return sum(len(action.get("events", [])) for action in actions)
+
+
+def split_actions(
+    actions: List[Dict], conflicts: Dict[tuple, List[str]], size: int
+) -> tuple:
+    """
+    Split the actions of a plan into actions of at most size events.
+
+    Args:
+        actions: Actions planned by the LLM
+        conflicts: Conflicts found by find_conflicts
+        size: Most events per action
+
+    Returns:
+        Tuple of the split actions and their conflicts, keyed by
+        "action index:event index" strings so they can be stored as JSON
+    """
+    chunks = []
+    chunk_conflicts = {}
+    for i, action in enumerate(actions):
+        events = action.get("events", [])
+        for start in range(0, max(len(events), 1), size):
+            for j in range(start, min(start + size, len(events))):
+                if (i, j) in conflicts:
+                    chunk_conflicts[f"{len(chunks)}:{j - start}"] = conflicts[(i, j)]
+            chunks.append({**action, "events": events[start : start + size]})
+    return chunks, chunk_conflicts
+
+
+def enqueue_actions(
+    actions: List[Dict], timezone: str, conflicts: Dict[tuple, List[str]]
+) -> str:
+    """
+    Run an action plan as a background job.
+
+    Args:
+        actions: Actions planned by the LLM
+        timezone: Time zone of the user, used for new events
+        conflicts: Conflicts found by find_conflicts
+
+    Returns:
+        ID of the job
+    """
+    chunks, chunk_conflicts = split_actions(actions, conflicts, JOB_CHUNK_SIZE)
+    job_id = get_job_queue().enqueue(
+        get_session_id(),
+        {
+            "actions": chunks,
+            "timezone": timezone,
+            "conflicts": chunk_conflicts,
+            "names": get_event_names(actions),
+        },
+    )
+    job_workers.notify()
+    return job_id
+
+
+def run_job(job: Dict) -> None:
+    """
+    Execute the actions of a job which have no results yet.
+
+    Results are saved after every action, so a job interrupted by a restart
+    or failure continues with the actions it had not finished.
+
+    Args:
+        job: Job claimed from job_queue
+    """
+    cached = service_cache.get(job["owner"])
+    if cached is None:
+        # The credentials of the user are only known once they come back
+        raise JobDeferred("Waited too long for the user to sign in again")
+
+    payload = job["payload"]
+    progress = job["progress"]
+    results = progress.setdefault("results", {})
+    actions = payload["actions"]
+    remaining = [i for i in range(len(actions)) if str(i) not in results]
+    positions = {index: position for position, index in enumerate(remaining)}
+    conflicts = {}
+    for key, titles in payload["conflicts"].items():
+        i, j = map(int, key.split(":"))
+        if i in positions:
+            conflicts[(positions[i], j)] = titles
+
+    with user_context(job["owner"], cached["credentials"]):
+        for position, result in iter_action_results(
+            [actions[i] for i in remaining], payload["timezone"], conflicts
+        ):
+            results[str(remaining[position])] = result
+            job_queue.save_progress(job["id"], progress)
+            if job_queue.get(job["id"])["status"] == "cancelled":
+                return
+
+    progress["message"] = render_action_summary(
+        actions,
+        [results[str(i)] for i in range(len(actions))],
+        payload["timezone"],
+        payload["names"],
+    )
+    job_queue.save_progress(job["id"], progress)
+    conversations.append(job["owner"], "assistant", progress["message"])
+
+
+def get_job_queue() -> JobQueue:
+    """
+    Return the job queue of this process, starting its workers on first use.
+
+    A preloading parent process never calls this, so forked workers neither
+    share its SQLite connection nor miss its threads, which a fork does not
+    copy.
+    """
+    global job_queue, job_workers
+    with _jobs_lock:
+        if job_queue is None:
+            job_queue = JobQueue(JOB_DB_PATH, recover=not _jobs_recovered)
+            job_workers = JobWorkers(
+                job_queue,
+                run_job,
+                workers=int(os.getenv("JOB_WORKERS", "2")),
+                defer_timeout=float(os.getenv("JOB_DEFER_TIMEOUT", "3600")),
+            )
+            job_workers.start()
+        return job_queue
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """
+    Report the progress of a background job, event by event.
+
+    Returns:
+        JSON with the job status, event counts, the status of each event,
+        and the summary message once the job is done
+    """
+    job = get_job_queue().get(job_id)
+    if job is None or job["owner"] != session.get("session_id"):
+        return jsonify({"error": "Job not found"}), 404
+
+    results = job["progress"].get("results", {})
+    events = []
+    for i, action in enumerate(job["payload"]["actions"]):
+        result = results.get(str(i))
+        for j, event in enumerate(action.get("events", [])):
+            entry = {
+                "operation": action.get("operation"),
+                "summary": event.get("summary")
+                or job["payload"]["names"].get(event.get("eventId")),
+                "status": "pending",
+            }
+            if result is not None and j < len(result["results"]):
+                outcome = result["results"][j]
+                entry["status"] = "done" if outcome["success"] else "failed"
+                if not outcome["success"]:
+                    entry["error"] = outcome.get("error")
+            events.append(entry)
+
+    return jsonify(
+        {
+            "id": job["id"],
+            "status": job["status"],
+            "total_events": len(events),
+            "done_events": sum(event["status"] == "done" for event in events),
+            "failed_events": sum(event["status"] == "failed" for event in events),
+            "events": events,
+            "message": job["progress"].get("message"),
+            "error": job["error"],
+        }
+    )
+
+
+def job_started_message(actions: List[Dict]) -> str:
+    """Tell the user a plan is running in the background."""
+    return (
+        f"I'm making {count_events(actions)} changes to your calendar in the "
+        "background. I'll let you know when they're done."
+    )
+
+
+def busy_response(error: Throttled) -> Dict:
+    """Build the chat reply for a turn the rate limits held back too long."""
+    return {
+        "bot_response": "TimeCraft is handling a lot of requests right now. Please try again in a moment.",
+        "retry_after": math.ceil(error.retry_after),
+    }
+
+
+@app.errorhandler(Throttled)
+def handle_throttled(error: Throttled):
+    """Ask clients to come back once outbound calls are admitted again."""
+    response = jsonify({**busy_response(error), "error": str(error)})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(math.ceil(error.retry_after))
+    return response
+
+
+@app.route("/chat", methods=["POST"])
+def chat():
+    data = request.get_json(silent=True) or {}
+    message = read_message(data)
+    if message is None:
+        return jsonify({"error": "Message is required"}), 400
+    timezone = data.get("timezone", "UTC")
+    conversation_id, chat_log, summary = start_turn(message)
+
+    @after_this_request
+    def remember_reply(response):
+        reply = response.get_json(silent=True) or {}
+        if "bot_response" in reply:
+            conversations.append(conversation_id, "assistant", reply["bot_response"])
+        return response
+
+    chat_context = get_chat_context(chat_log, timezone, summary)
+    if chat_context is None:
+        return jsonify(
             {
-                "role": "system",
-                "content": system_prompt,
-            },
-            *chat_log,
-        ],
-        temperature=0,
-        max_tokens=1024,
-        top_p=1,
-        stream=False,
-        stop=None,
-        response_format={"type": "json_object"},
+                "bot_response": "Sorry, I couldn't access your calendar. Please make sure you're logged in."
+            }
+        )
+    messages, busy = chat_context
+
+    prompt_tokens = count_message_tokens(messages)
+
+    @after_this_request
+    def report_prompt_tokens(response):
+        response.headers["X-Prompt-Tokens"] = str(prompt_tokens)
+        return response
+
+    # Make initial LLM call, unless the same prompt was answered before
+    cache_key, response_content = cached_response(
+        messages, stream=False, response_format={"type": "json_object"}
     )
+    if response_content is None:
+        llm_started = time.perf_counter()
+        completion = create_completion(
+            "groq.plan",
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=0,
+            max_tokens=1024,
+            top_p=1,
+            stream=False,
+            stop=None,
+            response_format={"type": "json_object"},
+        )
+        llm_latency = time.perf_counter() - llm_started
+        log_prompt_tokens(prompt_tokens, completion)
+        response_content = completion.choices[0].message.content
+    else:
+        cache_key = None
 
     # Parse the LLM response
     try:
-        response_content = completion.choices[0].message.content
         response_data = json.loads(response_content)
+        if cache_key is not None:
+            get_llm_cache().set(cache_key, response_content, llm_latency)
 
         if response_data["type"] == "inquiry":
             # For inquiries, return directly to the user
@@ -512,47 +2841,44 @@ def chat():
 
         elif response_data["type"] == "action":
             # Execute the specified actions
-            results = []
-            for action in response_data["actions"]:
-                operation = action["operation"]
-                events = action["events"]
-
-                if operation == "create_events":
-                    timezone = data.get("timezone", "UTC")
-                    result = create_events(events, timezone)
-                elif operation == "update_events":
-                    result = update_events(events)
-                elif operation == "delete_events":
-                    result = delete_events(events)
-                else:
-                    result = [
-                        {"success": False, "error": f"Unknown operation: {operation}"}
-                    ]
-
-                results.append({"operation": operation, "results": result})
-
-            # Make second LLM call to generate response about the actions taken
-            action_summary = json.dumps(results, indent=2)
-            completion_2 = groq.chat.completions.create(
-                model="llama-3.2-90b-vision-preview",
-                messages=[
+            actions = response_data["actions"]
+            names = get_event_names(actions)
+            conflicts = find_conflicts(actions, busy, timezone)
+            if count_events(actions) > JOB_THRESHOLD:
+                # Large plans run in the background instead of holding the request
+                return jsonify(
                     {
-                        "role": "system",
-                        "content": 'You are TimeCraft. Format the following action results into a friendly, clear message for the user. Focus on what was accomplished and any next steps or additional information the user might need. Do not provide the event ID. Start the message with "Done!"',
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Original request: {message}\nAction results: {action_summary}\n Chat log: {chat_log}",
-                    },
-                ],
-                temperature=0.7,  # Slightly higher temperature for more natural response
-                max_tokens=1024,
-                top_p=1,
-                stream=False,
-                stop=None,
+                        "bot_response": job_started_message(actions),
+                        "job_id": enqueue_actions(actions, timezone, conflicts),
+                    }
+                )
+            results = run_actions(actions, timezone, conflicts)
+
+            summary_started = time.perf_counter()
+            if use_llm_summary(results):
+                # Make second LLM call to generate response about the actions taken
+                completion_2 = create_completion(
+                    "groq.summary",
+                    model=CHAT_MODEL,
+                    messages=get_summary_messages(message, results, chat_log),
+                    temperature=0.7,  # Slightly higher temperature for more natural response
+                    max_tokens=1024,
+                    top_p=1,
+                    stream=False,
+                    stop=None,
+                )
+                bot_response = completion_2.choices[0].message.content
+                summary_mode = "llm"
+            else:
+                bot_response = render_action_summary(actions, results, timezone, names)
+                summary_mode = "template"
+            app.logger.info(
+                "Action summary (%s) took %.1f ms",
+                summary_mode,
+                (time.perf_counter() - summary_started) * 1000,
             )
 
-            return jsonify({"bot_response": completion_2.choices[0].message.content})
+            return jsonify({"bot_response": bot_response})
 
         else:
             return jsonify(
@@ -562,14 +2888,16 @@ def chat():
             )
 
     except json.JSONDecodeError:
-        print(completion.choices[0].message.content)
+        app.logger.warning("Unparseable chat response: %s", response_content)
         return jsonify(
             {
                 "bot_response": "I apologize, but I couldn't process that request properly. Could you please rephrase it?"
             }
         )
-    except Exception as e:
-        print(f"Error processing request: {str(e)}")
+    except Throttled:
+        raise
+    except Exception:
+        app.logger.exception("Error processing chat request")
         return jsonify(
             {
                 "bot_response": "I encountered an error while processing your request. Please try again."
@@ -577,6 +2905,320 @@ def chat():
         )
 
 
+class JSONStringStreamer:
+    """
+    Incrementally decode one string field of a JSON object as it streams in.
+
+    Text is only produced once the object's "type" field has the expected
+    value, so action plans are not echoed to the user.
+    """
+
+    ESCAPES = {
+        '"': '"',
+        "\\": "\\",
+        "/": "/",
+        "b": "\b",
+        "f": "\f",
+        "n": "\n",
+        "r": "\r",
+        "t": "\t",
+    }
+
+    def __init__(self, field: str = "message", expected_type: str = "inquiry"):
+        self.buffer = ""
+        self.field_pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self.type_pattern = re.compile(r'"type"\s*:\s*"%s"' % re.escape(expected_type))
+        self.position = None
+        self.done = False
+
+    def feed(self, text: str) -> str:
+        """
+        Add streamed text.
+
+        Args:
+            text: Next piece of the JSON document
+
+        Returns:
+            Newly decoded characters of the field
+        """
+        self.buffer += text
+        if self.done:
+            return ""
+
+        if self.position is None:
+            if not self.type_pattern.search(self.buffer):
+                return ""
+            match = self.field_pattern.search(self.buffer)
+            if not match:
+                return ""
+            self.position = match.end()
+
+        decoded = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if char == '"':
+                self.done = True
+                break
+            if char != "\\":
+                decoded.append(char)
+                self.position += 1
+                continue
+
+            # Wait for the rest of the escape sequence
+            if self.position + 1 >= len(self.buffer):
+                break
+            escape = self.buffer[self.position + 1]
+            if escape == "u":
+                if self.position + 6 > len(self.buffer):
+                    break
+                length = 6
+                # A high surrogate is decoded together with the low one after it
+                if re.fullmatch(
+                    r"[dD][89abAB][0-9a-fA-F]{2}",
+                    self.buffer[self.position + 2 : self.position + 6],
+                ):
+                    if self.position + 12 > len(self.buffer):
+                        break
+                    if self.buffer[self.position + 6 : self.position + 8] == "\\u":
+                        length = 12
+                try:
+                    decoded.append(
+                        json.loads(
+                            '"%s"' % self.buffer[self.position : self.position + length]
+                        )
+                    )
+                except ValueError:
+                    # Not a valid escape, parsing the whole response reports it
+                    pass
+                self.position += length
+            else:
+                decoded.append(self.ESCAPES.get(escape, escape))
+                self.position += 2
+
+        return "".join(decoded)
+
+
+def sse(event: str, data: Dict) -> str:
+    """Format a server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def parse_streamed_json(content: str) -> Dict:
+    """Parse a JSON response generated without JSON mode."""
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        # The model sometimes wraps the object in text or a code block
+        start, end = content.find("{"), content.rfind("}")
+        if start == -1 or end < start:
+            raise
+        return json.loads(content[start : end + 1])
+
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Same as /chat, but sends the response as server-sent events."""
+    data = request.get_json(silent=True) or {}
+    message = read_message(data)
+    if message is None:
+        return jsonify({"error": "Message is required"}), 400
+    timezone = data.get("timezone", "UTC")
+    started = time.perf_counter()
+    conversation_id, chat_log, summary = start_turn(message)
+
+    def done(data: Dict) -> str:
+        # The final event carries the reply, which joins the conversation
+        conversations.append(conversation_id, "assistant", data["bot_response"])
+        return sse("done", data)
+
+    def generate():
+        chat_context = get_chat_context(chat_log, timezone, summary)
+        if chat_context is None:
+            yield done(
+                {
+                    "bot_response": "Sorry, I couldn't access your calendar. Please make sure you're logged in.",
+                    "refresh": False,
+                },
+            )
+            return
+        messages, busy = chat_context
+
+        log_prompt_tokens(count_message_tokens(messages))
+
+        # Decoding the tokens can fail like the rest of the turn, which then
+        # still ends with a done event
+        try:
+            streamer = JSONStringStreamer()
+            cache_key, response_content = cached_response(messages, stream=True)
+            if response_content is not None:
+                cache_key = None
+                text = streamer.feed(response_content)
+                if text:
+                    yield sse("token", {"text": text})
+            else:
+                llm_started = time.perf_counter()
+                # JSON mode cannot be combined with streaming, the system prompt
+                # already asks for JSON
+                try:
+                    stream = create_completion(
+                        "groq.plan",
+                        model=CHAT_MODEL,
+                        messages=messages,
+                        temperature=0,
+                        max_tokens=1024,
+                        top_p=1,
+                        stream=True,
+                        stop=None,
+                    )
+                except Throttled as e:
+                    yield done({**busy_response(e), "refresh": False})
+                    return
+
+                response_content = ""
+                first_token = True
+                for chunk in stream:
+                    content = chunk.choices[0].delta.content
+                    if not content:
+                        continue
+                    if first_token:
+                        first_token = False
+                        app.logger.info(
+                            "Chat time to first token: %.0f ms",
+                            (time.perf_counter() - started) * 1000,
+                        )
+                    response_content += content
+                    text = streamer.feed(content)
+                    if text:
+                        yield sse("token", {"text": text})
+                llm_latency = time.perf_counter() - llm_started
+
+            response_data = parse_streamed_json(response_content)
+            if cache_key is not None:
+                # Only the JSON the text held is kept, not text around it
+                get_llm_cache().set(cache_key, json.dumps(response_data), llm_latency)
+
+            if response_data["type"] == "inquiry":
+                yield done({"bot_response": response_data["message"], "refresh": False})
+
+            elif response_data["type"] == "action":
+                actions = response_data["actions"]
+                names = get_event_names(actions)
+                conflicts = find_conflicts(actions, busy, timezone)
+                if count_events(actions) > JOB_THRESHOLD:
+                    yield done(
+                        {
+                            "bot_response": job_started_message(actions),
+                            "job_id": enqueue_actions(actions, timezone, conflicts),
+                            "refresh": False,
+                        },
+                    )
+                    return
+                results = [None] * len(actions)
+                for index, result in iter_action_results(actions, timezone, conflicts):
+                    results[index] = result
+                    yield sse("progress", result)
+
+                summary_started = time.perf_counter()
+                if use_llm_summary(results):
+                    summary_stream = create_completion(
+                        "groq.summary",
+                        model=CHAT_MODEL,
+                        messages=get_summary_messages(message, results, chat_log),
+                        temperature=0.7,
+                        max_tokens=1024,
+                        top_p=1,
+                        stream=True,
+                        stop=None,
+                    )
+                    bot_response = ""
+                    for chunk in summary_stream:
+                        content = chunk.choices[0].delta.content
+                        if content:
+                            bot_response += content
+                            yield sse("token", {"text": content})
+                    summary_mode = "llm"
+                else:
+                    bot_response = render_action_summary(
+                        actions, results, timezone, names
+                    )
+                    yield sse("token", {"text": bot_response})
+                    summary_mode = "template"
+                app.logger.info(
+                    "Action summary (%s) took %.1f ms",
+                    summary_mode,
+                    (time.perf_counter() - summary_started) * 1000,
+                )
+
+                yield done({"bot_response": bot_response, "refresh": True})
+
+            else:
+                yield done(
+                    {
+                        "bot_response": "I'm sorry, I couldn't process that request properly. Please try again.",
+                        "refresh": False,
+                    },
+                )
+
+        except json.JSONDecodeError:
+            app.logger.warning("Unparseable chat response: %s", response_content)
+            yield done(
+                {
+                    "bot_response": "I apologize, but I couldn't process that request properly. Could you please rephrase it?",
+                    "refresh": False,
+                },
+            )
+        except Throttled as e:
+            # Actions may have run before the summary was throttled
+            yield done({**busy_response(e), "refresh": True})
+        except Exception:
+            app.logger.exception("Error processing streamed chat request")
+            yield done(
+                {
+                    "bot_response": "I encountered an error while processing your request. Please try again.",
+                    "refresh": False,
+                },
+            )
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def create_app(preload: bool = False) -> Flask:
+    """
+    Prepare the app for serving.
+
+    Loads the Calendar discovery document up front, so the first request does
+    not pay for it, and requeues jobs interrupted by the last shutdown. The
+    app logger logs at LOG_LEVEL, as the timings it reports are info records
+    Flask only shows in debug mode otherwise.
+
+    Args:
+        preload: Whether a parent process loads the app before forking
+            workers, like gunicorn with preload_app. It then also imports what
+            requests would load lazily, which the workers share after the
+            fork, and leaves the job queue to each worker.
+
+    Returns:
+        The Flask app
+    """
+    global _jobs_recovered
+    app.logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    get_discovery_document()
+    if preload:
+        import google.auth.transport.requests  # noqa: F401
+        import google_auth_oauthlib.flow  # noqa: F401
+        import groq  # noqa: F401
+
+        JobQueue(JOB_DB_PATH).close()
+        _jobs_recovered = True
+    else:
+        get_job_queue()
+    return app
+
+
 if __name__ == "__main__":
     os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
-    app.run("localhost", 5000, debug=True)
+    create_app().run("localhost", 5000, debug=True)
@@ -0,0 +1,345 @@
+import math
+import socket
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import httplib2
+from googleapiclient.http import DEFAULT_HTTP_TIMEOUT_SEC
+
+from cache import TTLCache
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header.
+
+    Args:
+        value: Header value, in seconds or as an HTTP date
+
+    Returns:
+        Seconds to wait, or None if the header is missing or malformed
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class Throttled(Exception):
+    """Raised when an outbound call would wait longer than allowed to be sent."""
+
+    def __init__(self, retry_after: float):
+        """
+        Args:
+            retry_after: Seconds after which the call is likely to get through
+        """
+        super().__init__(f"Rate limited, retry in {math.ceil(retry_after)} s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Tokens refilled at a steady rate, up to a burst. Not thread-safe."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """
+        Args:
+            rate: Tokens added per second, 0 for no limit
+            burst: Most tokens held, defaults to one second's worth
+        """
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def delay(self, cost: float, now: float) -> float:
+        """
+        Return how long until a call of the given cost can be taken.
+
+        A call costing more than the burst goes through once the bucket is
+        full, leaving it in debt.
+        """
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(cost, self.burst)
+        return max(needed - self.tokens, 0.0) / self.rate
+
+    def resize(self, rate: float) -> None:
+        """Change the rate, keeping a burst of one second's worth."""
+        self.rate = rate
+        self.burst = max(rate, 1.0)
+        self.tokens = min(self.tokens, self.burst)
+
+    def take(self, cost: float) -> None:
+        """Remove the tokens of a call, after delay returned 0."""
+        if self.rate:
+            self.tokens -= cost
+
+
+class OutboundScheduler:
+    """
+    Admits outbound calls to an API under per-user and per-project limits.
+
+    Calls wait in one queue per user and are admitted round-robin across
+    users, so a user with a large plan cannot starve the others. A rate limit
+    response pauses every call for its Retry-After and halves the project
+    rate, which then grows back as calls get through.
+    """
+
+    # Lowest share of the configured project rate backoff goes down to
+    MIN_RATE_SHARE = 0.05
+
+    # Share of the configured project rate regained per second of calls which
+    # get through
+    RECOVERY_SHARE = 0.1
+
+    # Seconds paused after a rate limit response without Retry-After
+    DEFAULT_PAUSE = 1.0
+
+    def __init__(
+        self,
+        project_rate: float,
+        user_rate: float = 0,
+        max_in_flight: Optional[int] = None,
+        max_wait: float = 30,
+    ):
+        """
+        Args:
+            project_rate: Calls per second of the whole process
+            user_rate: Calls per second of each user, 0 for no limit
+            max_in_flight: Most calls admitted and not yet released, None for
+                no limit
+            max_wait: Seconds a call waits to be admitted before Throttled is
+                raised
+        """
+        self.enabled = True
+        self.project_rate = project_rate
+        self.user_rate = user_rate
+        self.max_in_flight = max_in_flight
+        self.max_wait = max_wait
+        self._project = TokenBucket(project_rate)
+        self._users = TTLCache(max_size=4096, ttl=600)
+        self._queues = {}
+        self._turns = deque()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._decreased_until = 0.0
+        self._admitted = 0
+        self._throttled = 0
+        self._timeouts = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, owner: str, cost: float = 1) -> None:
+        """
+        Wait until a call may be sent.
+
+        Every call admitted has to be released again.
+
+        Args:
+            owner: Session identity of the user making the call
+            cost: Number of calls, e.g. the calls of a batch request
+
+        Raises:
+            Throttled: If the call was not admitted within max_wait seconds
+        """
+        if not self.enabled:
+            return
+        deadline = time.monotonic() + self.max_wait
+        waiter = {"cost": cost, "admitted": False}
+        with self._condition:
+            waiting = self._queues.setdefault(owner, deque())
+            waiting.append(waiter)
+            if len(waiting) == 1:
+                self._turns.append(owner)
+            while True:
+                delay = self._dispatch()
+                if waiter["admitted"]:
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._withdraw(owner, waiter)
+                    self._timeouts += 1
+                    raise Throttled(max(delay or 0.0, self.DEFAULT_PAUSE))
+                self._condition.wait(
+                    remaining if delay is None else min(delay, remaining)
+                )
+
+    def release(
+        self,
+        owner: str,
+        cost: float = 1,
+        throttled: int = 0,
+        retry_after: Optional[float] = None,
+    ) -> None:
+        """
+        Report that an admitted call finished.
+
+        Args:
+            owner: Session identity of the user who made the call
+            cost: Number of calls, as given to acquire
+            throttled: Number of calls the API rejected with a rate limit
+            retry_after: Seconds the API asked to wait, if it did
+        """
+        if not self.enabled:
+            return
+        with self._condition:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self._throttled += throttled
+                pause = self.DEFAULT_PAUSE if retry_after is None else retry_after
+                self._paused_until = max(self._paused_until, now + pause)
+                # Calls sent before the pause are rejected together, so they
+                # only lower the rate once
+                if now >= self._decreased_until:
+                    self._project.resize(
+                        max(
+                            self._project.rate / 2,
+                            self.project_rate * self.MIN_RATE_SHARE,
+                        )
+                    )
+                    # The API has no room left, so neither does the bucket
+                    self._project.tokens = min(self._project.tokens, 0.0)
+                    self._decreased_until = now + pause
+            elif self._project.rate < self.project_rate:
+                step = (
+                    cost * self.project_rate * self.RECOVERY_SHARE / self._project.rate
+                )
+                self._project.resize(min(self._project.rate + step, self.project_rate))
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get the scheduler counters.
+
+        Returns:
+            Dictionary containing the queue depth, calls in flight, current
+            project rate, and totals of admitted, throttled, and timed out calls
+        """
+        with self._condition:
+            return {
+                "queue_depth": sum(len(waiting) for waiting in self._queues.values()),
+                "in_flight": self._in_flight,
+                "rate": self._project.rate,
+                "admitted_total": self._admitted,
+                "throttled_total": self._throttled,
+                "timeouts_total": self._timeouts,
+            }
+
+    def _dispatch(self) -> Optional[float]:
+        """
+        Admit every waiting call which may go now, taking users in turn.
+
+        Returns:
+            Seconds until the next call may go, or None if waiting on a release
+        """
+        while self._turns:
+            if self.max_in_flight and self._in_flight >= self.max_in_flight:
+                return None
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+
+            # The first user in turn whose own limit allows their next call
+            soonest = None
+            for _ in range(len(self._turns)):
+                owner = self._turns[0]
+                waiter = self._queues[owner][0]
+                bucket = self._user_bucket(owner)
+                delay = bucket.delay(waiter["cost"], now)
+                if not delay:
+                    break
+                soonest = delay if soonest is None else min(soonest, delay)
+                self._turns.rotate(-1)
+            else:
+                return soonest
+
+            delay = self._project.delay(waiter["cost"], now)
+            if delay:
+                return delay
+
+            bucket.take(waiter["cost"])
+            self._project.take(waiter["cost"])
+            self._withdraw(owner, waiter)
+            waiter["admitted"] = True
+            self._in_flight += 1
+            self._admitted += 1
+            self._condition.notify_all()
+        return None
+
+    def _user_bucket(self, owner: str) -> TokenBucket:
+        bucket = self._users.get(owner)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate)
+            self._users.set(owner, bucket)
+        return bucket
+
+    def _withdraw(self, owner: str, waiter: Dict) -> None:
+        """Remove a call from its user's queue, moving the user to the back."""
+        waiting = self._queues[owner]
+        waiting.remove(waiter)
+        self._turns.remove(owner)
+        if waiting:
+            self._turns.append(owner)
+        else:
+            del self._queues[owner]
+
+
+class PooledHttp:
+    """
+    Stand-in for httplib2.Http which sends each request on a pooled connection.
+
+    httplib2.Http is not thread-safe, so a request borrows an idle Http for its
+    duration. Idle ones are shared by every user and thread, so requests reuse
+    open TLS connections to Google instead of each thread opening its own.
+    """
+
+    def __init__(self, max_idle: int = 16):
+        """
+        Args:
+            max_idle: Most idle Http objects kept open
+        """
+        self.max_idle = max_idle
+        # The settings of googleapiclient.http.build_http: a timeout, and 308
+        # left to resumable uploads rather than followed as a redirect
+        self.timeout = socket.getdefaulttimeout() or DEFAULT_HTTP_TIMEOUT_SEC
+        self.follow_redirects = True
+        self.redirect_codes = httplib2.REDIRECT_CODES - {308}
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def request(self, *args, **kwargs):
+        """Send a request, taking the same arguments as httplib2.Http.request."""
+        with self._lock:
+            http = self._idle.pop() if self._idle else None
+        if http is None:
+            http = httplib2.Http(timeout=self.timeout)
+        http.follow_redirects = self.follow_redirects
+        http.redirect_codes = self.redirect_codes
+        try:
+            return http.request(*args, **kwargs)
+        finally:
+            with self._lock:
+                # The most recently used connections are the warmest
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(http)
+                    http = None
+            if http is not None:
+                http.close()
+
+    def close(self) -> None:
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for http in idle:
+            http.close()
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import build_http
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_state_dir = tempfile.mkdtemp()
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("LLM_CACHE_BACKEND", "off")
+os.environ.setdefault("JOB_DB_PATH", os.path.join(_state_dir, "jobs.sqlite3"))
+os.environ.setdefault(
+    "ACTION_JOURNAL_PATH", os.path.join(_state_dir, "actions.sqlite3")
+)
+
+
+@pytest.fixture
+def timecraft():
+    """The app module."""
+    import main
+
+    return main
+
+
+@pytest.fixture
+def user_session(timecraft):
+    """Request context with a session of its own, yielding the session identity."""
+    from flask import session
+
+    user_id = uuid.uuid4().hex
+    with timecraft.app.test_request_context():
+        session["session_id"] = user_id
+        yield user_id
+    timecraft.event_stores.pop(user_id)
+
+
+@pytest.fixture
+def fake_calendar():
+    """A local fake Calendar server, and a Calendar service talking to it."""
+    from benchmark import FakeCalendar
+
+    calendar = FakeCalendar()
+    document = get_static_doc("calendar", "v3").replace(
+        '"rootUrl": "https://www.googleapis.com/"',
+        f'"rootUrl": "{calendar.serve()}"',
+    )
+    return calendar, build_from_document(document, http=build_http())
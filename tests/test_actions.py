@@ -0,0 +1,52 @@
+import pytest
+
+
+@pytest.fixture
+def calendar(timecraft, user_session, fake_calendar, monkeypatch):
+    """Fake Calendar server the action functions of the session write to."""
+    calendar, service = fake_calendar
+    monkeypatch.setattr(timecraft, "get_calendar_service", lambda: service)
+    return calendar
+
+
+def standup() -> dict:
+    return {
+        "summary": "Standup",
+        "start": "2030-01-01T10:00:00Z",
+        "end": "2030-01-01T11:00:00Z",
+    }
+
+
+def move(timecraft, calendar, event_id: str, forget: bool = False) -> None:
+    """Move an event by an hour, as if the user did in another client."""
+    event = calendar.calendars["primary"][event_id]
+    event["start"] = {"dateTime": "2030-01-01T12:00:00Z"}
+    event["end"] = {"dateTime": "2030-01-01T13:00:00Z"}
+    store = timecraft.get_event_store()
+    if forget:
+        store.remove(event_id)
+    else:
+        store.apply({**event, "calendarId": "primary"})
+
+
+def test_resubmitted_create_is_a_no_op(timecraft, calendar):
+    first = timecraft.create_events([standup()], "UTC")
+    second = timecraft.create_events([standup()], "UTC")
+
+    assert first == second
+    assert len(calendar.calendars["primary"]) == 1
+
+
+@pytest.mark.parametrize("forget", [False, True], ids=["stored", "unknown"])
+def test_create_after_the_event_moved_makes_a_new_event(timecraft, calendar, forget):
+    [first] = timecraft.create_events([standup()], "UTC")
+    move(timecraft, calendar, first["eventId"], forget)
+
+    [second] = timecraft.create_events([standup()], "UTC")
+    [third] = timecraft.create_events([standup()], "UTC")
+
+    assert second["success"]
+    assert second["eventId"] != first["eventId"]
+    # The new event is found again like the first one was
+    assert third == second
+    assert len(calendar.calendars["primary"]) == 2
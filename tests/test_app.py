@@ -0,0 +1,49 @@
+import logging
+
+import pytest
+
+
+def test_create_app_logs_info_records(timecraft, monkeypatch):
+    monkeypatch.delenv("LOG_LEVEL", raising=False)
+    timecraft.app.logger.setLevel(logging.NOTSET)
+
+    app = timecraft.create_app()
+
+    assert app.logger.getEffectiveLevel() == logging.INFO
+
+
+@pytest.mark.parametrize("start", ["", "tomorrow", "2030-13-01", "2030-01-01T25:00"])
+def test_invalid_window_start_is_a_bad_request(timecraft, start):
+    client = timecraft.app.test_client()
+    with client.session_transaction() as session:
+        session["credentials"] = {}
+
+    response = client.get("/calendar-events", query_string={"start": start})
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid start date"}
+
+
+def test_invalid_current_date_is_a_bad_request(timecraft):
+    client = timecraft.app.test_client()
+    with client.session_transaction() as session:
+        session["credentials"] = {}
+        session["current_date"] = "someday"
+
+    response = client.get("/list-calendar-events?direction=next")
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("route", ["/chat", "/chat/stream"])
+@pytest.mark.parametrize("body", [{}, {"message": ""}, {"message": "  "}, None])
+def test_chat_without_a_message_is_a_bad_request(timecraft, route, body):
+    client = timecraft.app.test_client()
+    with client.session_transaction() as session:
+        session["session_id"] = "no-message"
+
+    response = client.post(route, json=body)
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Message is required"}
+    assert timecraft.conversations.get("no-message")[0] == []
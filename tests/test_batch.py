@@ -0,0 +1,100 @@
+import math
+
+import pytest
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import build_http
+
+from benchmark import FakeCalendar
+
+
+class FlakyCalendar(FakeCalendar):
+    """Fails the first insert of the given events with 503."""
+
+    def __init__(self, failing):
+        super().__init__()
+        self.failing = set(failing)
+
+    def handle(self, method, path, query, body):
+        if method == "POST" and body.get("summary") in self.failing:
+            self.failing.remove(body["summary"])
+            return 503, {"error": {"code": 503, "message": "Backend Error"}}
+        return super().handle(method, path, query, body)
+
+
+@pytest.fixture
+def no_waiting(timecraft, monkeypatch):
+    monkeypatch.setattr(timecraft, "RETRY_BACKOFF", 0)
+    monkeypatch.setattr(timecraft.calendar_scheduler, "enabled", False)
+
+
+def calendar_service(calendar: FakeCalendar):
+    document = get_static_doc("calendar", "v3").replace(
+        '"rootUrl": "https://www.googleapis.com/"',
+        f'"rootUrl": "{calendar.serve()}"',
+    )
+    return build_from_document(document, http=build_http())
+
+
+def inserts(service, count: int) -> list:
+    return [
+        service.events().insert(
+            calendarId="primary",
+            body={
+                "summary": f"Event {number}",
+                "start": {"dateTime": "2030-01-01T10:00:00Z"},
+                "end": {"dateTime": "2030-01-01T11:00:00Z"},
+            },
+        )
+        for number in range(count)
+    ]
+
+
+@pytest.mark.parametrize("count", [1, 50, 51, 120])
+def test_calls_go_in_batches_of_fifty(timecraft, no_waiting, count):
+    calendar = FakeCalendar()
+    service = calendar_service(calendar)
+
+    outcomes = timecraft.execute_batch(service, inserts(service, count))
+
+    assert calendar.round_trips == math.ceil(count / timecraft.BATCH_SIZE)
+    assert all(error is None for _, error in outcomes)
+    assert [event["summary"] for event, _ in outcomes] == [
+        f"Event {number}" for number in range(count)
+    ]
+
+
+def test_failed_calls_are_retried_in_a_new_batch(timecraft, no_waiting):
+    calendar = FlakyCalendar(failing={"Event 3", "Event 57"})
+    service = calendar_service(calendar)
+
+    outcomes = timecraft.execute_batch(service, inserts(service, 60))
+
+    # Two batches, then one with the two failed calls
+    assert calendar.round_trips == 3
+    assert all(error is None for _, error in outcomes)
+    assert len(calendar.calendars["primary"]) == 60
+
+
+def test_updates_take_two_round_trips_per_fifty_events(
+    timecraft, user_session, fake_calendar, no_waiting, monkeypatch
+):
+    calendar, service = fake_calendar
+    monkeypatch.setattr(timecraft, "get_calendar_service", lambda: service)
+    event_ids = [
+        calendar.add_event(
+            "primary", f"Event {number}", "2030-01-01T10:00:00", "2030-01-01T11:00"
+        )["id"]
+        for number in range(60)
+    ]
+
+    results = timecraft.update_events(
+        [{"eventId": event_id, "summary": "Renamed"} for event_id in event_ids]
+    )
+
+    # One batch of reads and one of writes per 50 events
+    assert calendar.round_trips == 4
+    assert all(result["success"] for result in results)
+    assert {event["summary"] for event in calendar.calendars["primary"].values()} == {
+        "Renamed"
+    }
@@ -0,0 +1,103 @@
+import pytest
+
+
+@pytest.fixture
+def standup(timecraft, user_session):
+    """A stored event from 10 to 11, and the free/busy index of the calendar."""
+    timecraft.get_event_store().apply(
+        {
+            "id": "standup",
+            "summary": "Standup",
+            "start": {"dateTime": "2030-01-01T10:00:00Z"},
+            "end": {"dateTime": "2030-01-01T11:00:00Z"},
+            "calendarId": "primary",
+        }
+    )
+    return timecraft.build_busy_index(
+        [
+            {
+                "eventId": "standup",
+                "summary": "Standup",
+                "start": "2030-01-01T10:00:00Z",
+                "end": "2030-01-01T11:00:00Z",
+            }
+        ]
+    )
+
+
+def move_standup_and_book(start: str, end: str) -> list:
+    return [
+        {
+            "operation": "update_events",
+            "events": [
+                {
+                    "eventId": "standup",
+                    "start": "2030-01-01T14:00:00Z",
+                    "end": "2030-01-01T15:00:00Z",
+                }
+            ],
+        },
+        {
+            "operation": "create_events",
+            "events": [{"summary": "Focus", "start": start, "end": end}],
+        },
+    ]
+
+
+def test_time_left_by_a_moved_event_is_free(timecraft, standup):
+    actions = move_standup_and_book("2030-01-01T10:00:00Z", "2030-01-01T11:00:00Z")
+
+    assert timecraft.find_conflicts(actions, standup, "UTC") == {}
+
+
+def test_moved_event_conflicts_at_its_new_time_with_its_title(timecraft, standup):
+    actions = move_standup_and_book("2030-01-01T14:30:00Z", "2030-01-01T15:30:00Z")
+
+    assert timecraft.find_conflicts(actions, standup, "UTC") == {(1, 0): ["Standup"]}
+
+
+def test_rejected_move_keeps_the_old_time_busy(timecraft, standup, monkeypatch):
+    monkeypatch.setattr(timecraft, "CONFLICT_POLICY", "reject")
+    standup.add(
+        timecraft.parse_event_time("2030-01-01T14:00:00Z").timestamp(),
+        timecraft.parse_event_time("2030-01-01T15:00:00Z").timestamp(),
+        "lunch",
+    )
+    actions = move_standup_and_book("2030-01-01T10:00:00Z", "2030-01-01T11:00:00Z")
+
+    conflicts = timecraft.find_conflicts(actions, standup, "UTC")
+
+    assert conflicts[(0, 0)] == ["another event"]
+    assert conflicts[(1, 0)] == ["Standup"]
+
+
+def focus(start: str = "2030-01-01T12:00:00Z", end: str = "2030-01-01T13:00:00Z"):
+    return {"summary": "Focus", "start": start, "end": end}
+
+
+def test_duplicated_event_does_not_overlap_itself(timecraft, standup):
+    actions = [{"operation": "create_events", "events": [focus(), focus()]}]
+
+    assert timecraft.find_conflicts(actions, standup, "UTC") == {}
+
+
+def test_duplicates_share_the_conflicts_of_the_first(timecraft, standup):
+    booked = focus("2030-01-01T10:30:00Z", "2030-01-01T11:30:00Z")
+    actions = [{"operation": "create_events", "events": [booked, dict(booked)]}]
+
+    assert timecraft.find_conflicts(actions, standup, "UTC") == {
+        (0, 0): ["Standup"],
+        (0, 1): ["Standup"],
+    }
+
+
+def test_resubmitted_event_does_not_overlap_itself(timecraft, standup):
+    event_id = timecraft.event_id_for(timecraft.create_key(focus(), "UTC"))
+    standup.add(
+        timecraft.parse_event_time("2030-01-01T12:00:00Z").timestamp(),
+        timecraft.parse_event_time("2030-01-01T13:00:00Z").timestamp(),
+        event_id,
+    )
+    actions = [{"operation": "create_events", "events": [focus()]}]
+
+    assert timecraft.find_conflicts(actions, standup, "UTC") == {}
@@ -0,0 +1,71 @@
+import random
+
+from intervals import FreeBusyIndex, IntervalIndex, merge_intervals
+
+
+def test_overlapping_finds_long_intervals_starting_before_the_range():
+    index = IntervalIndex.from_intervals([(0, 100, "long"), (10, 20, "short")])
+    index.add(50, 60, "added")
+
+    assert [key for _, _, key in index.overlapping(55, 70)] == ["long", "added"]
+    assert index.overlapping(100, 110) == []
+
+
+def test_removing_the_longest_interval_shortens_the_lookback():
+    index = IntervalIndex.from_intervals([(0, 100, "long"), (10, 20, "short")])
+
+    index.remove(0, 100, "long")
+    assert index._max_length == 10
+    assert [key for _, _, key in index.overlapping(15, 16)] == ["short"]
+
+    index.remove(10, 20, "short")
+    assert index._max_length == 0
+
+
+def test_merge_intervals_joins_touching_intervals():
+    assert merge_intervals([(5, 6), (0, 2), (2, 3)]) == [(0, 3), (5, 6)]
+
+
+def test_free_slots_skip_busy_time():
+    busy = FreeBusyIndex([(10, 20, "a"), (15, 30, "b"), (40, 45, "c")])
+
+    assert busy.free_slots(0, 50) == [(0, 10), (30, 40), (45, 50)]
+    assert busy.free_slots(0, 50, min_length=6) == [(0, 10), (30, 40)]
+
+
+def test_remove_frees_the_time_of_a_moved_event():
+    busy = FreeBusyIndex([(10, 11, "a"), (12, 13, "b")])
+
+    busy.remove("a")
+    busy.add(14, 15, "a")
+
+    assert busy.conflicts(10, 11) == []
+    assert busy.conflicts(14, 15) == ["a"]
+    assert busy.free_slots(9, 16) == [(9, 12), (13, 14), (15, 16)]
+
+
+def test_remove_unknown_key_is_a_no_op():
+    busy = FreeBusyIndex([(10, 11, "a")])
+
+    busy.remove("missing")
+
+    assert busy.conflicts(10, 11) == ["a"]
+
+
+def test_busy_time_matches_a_full_merge_after_adds_and_removes():
+    rng = random.Random(7)
+    intervals = []
+    for key in range(200):
+        start = rng.randrange(0, 1000)
+        intervals.append((start, start + rng.randrange(1, 30), key))
+    busy = FreeBusyIndex(intervals[:100])
+    for interval in intervals[100:]:
+        busy.add(*interval)
+    for key in rng.sample(range(200), 80):
+        busy.remove(key)
+
+    left = [(start, end) for start, end, key in intervals if key in busy._by_key]
+    assert busy.busy == merge_intervals(left)
+    assert busy.free_slots(0, 1100) == FreeBusyIndex(
+        [(start, end, None) for start, end in left]
+    ).free_slots(0, 1100)
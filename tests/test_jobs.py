@@ -0,0 +1,51 @@
+import time
+
+from jobs import JobDeferred, JobQueue, JobWorkers
+
+
+def wait_for_status(queue: JobQueue, job_id: str, status: str) -> dict:
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job is {job['status']}, not {status}")
+
+
+def test_deferred_job_fails_after_the_timeout(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    runs = []
+
+    def handler(job):
+        runs.append(time.monotonic())
+        raise JobDeferred("Waiting for credentials")
+
+    workers = JobWorkers(
+        queue, handler, workers=1, poll_interval=0.01, defer_timeout=0.3
+    )
+    job_id = queue.enqueue("user", {})
+    workers.start()
+
+    job = wait_for_status(queue, job_id, "failed")
+
+    assert job["error"] == "Waiting for credentials"
+    assert len(runs) > 1
+    assert runs[-1] - runs[0] < 0.5
+
+
+def test_deferred_job_runs_once_it_can(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    runs = []
+
+    def handler(job):
+        runs.append(job["id"])
+        if len(runs) < 3:
+            raise JobDeferred("Waiting for credentials")
+
+    workers = JobWorkers(queue, handler, workers=1, poll_interval=0.01)
+    job_id = queue.enqueue("user", {})
+    workers.start()
+
+    assert wait_for_status(queue, job_id, "done")["attempts"] == 0
+    assert len(runs) == 3
@@ -0,0 +1,41 @@
+import time
+
+from google.oauth2.credentials import Credentials
+
+from journal import ActionJournal
+
+
+def test_abandon_leaves_operations_recorded_again(tmp_path):
+    journal = ActionJournal(str(tmp_path / "actions.sqlite3"))
+    journal.begin("user", [("old", "delete_events", {}), ("new", "delete_events", {})])
+    before = time.time()
+    journal.begin("user", [("new", "delete_events", {})])
+
+    assert journal.abandon("user", ["old", "new"], before=before) == 1
+    assert [entry["key"] for entry in journal.pending("user")] == ["new"]
+
+
+def test_failed_resume_is_not_retried(timecraft, tmp_path, monkeypatch):
+    journal = ActionJournal(str(tmp_path / "actions.sqlite3"))
+    monkeypatch.setattr(timecraft, "action_journal", journal)
+    journal.begin(
+        "user",
+        [("key", "delete_events", {"event": {"eventId": "gone"}, "timezone": "UTC"})],
+    )
+    monkeypatch.setattr(timecraft, "PROCESS_STARTED", time.time() + 1)
+    monkeypatch.setattr(
+        timecraft, "service_cache", {"user": {"credentials": Credentials("token")}}
+    )
+    runs = []
+
+    def run_action(action, timezone):
+        runs.append(action)
+        raise RuntimeError("Calendar is down")
+
+    monkeypatch.setattr(timecraft, "run_action", run_action)
+
+    timecraft.resume_actions("user")
+    timecraft.resume_actions("user")
+
+    assert len(runs) == 1
+    assert journal.pending("user", before=time.time() + 1) == []
@@ -0,0 +1,79 @@
+from layout import DAY_MINUTES, layout_events, pack_columns, split_days
+
+
+def timed(event_id: str, start: str, end: str) -> dict:
+    return {
+        "id": event_id,
+        "summary": event_id,
+        "start": {"dateTime": f"2030-01-01T{start}:00"},
+        "end": {"dateTime": f"2030-01-01T{end}:00"},
+    }
+
+
+def all_day(event_id: str, start: str, end: str) -> dict:
+    return {
+        "id": event_id,
+        "summary": event_id,
+        "start": {"date": start},
+        "end": {"date": end},
+    }
+
+
+def test_separate_groups_get_their_own_column_counts():
+    # 0-60 overlaps 30-90, which overlaps 60-120; 200-260 stands alone
+    order, column, columns = pack_columns([0, 30, 60, 200], [60, 90, 120, 260])
+
+    assert order == [0, 1, 2, 3]
+    assert column == [0, 1, 0, 0]
+    assert columns == [2, 2, 2, 1]
+
+
+def test_columns_are_reused_once_free():
+    # Longer segments go first, so the one ending at 30 frees the last column
+    _, column, columns = pack_columns([0, 0, 0, 30], [30, 60, 60, 90])
+
+    assert column == [2, 0, 1, 2]
+    assert columns == [3, 3, 3, 3]
+
+
+def test_touching_segments_do_not_overlap():
+    _, column, columns = pack_columns([0, 60], [60, 120])
+
+    assert column == [0, 0]
+    assert columns == [1, 1]
+
+
+def test_events_are_split_at_midnight():
+    from datetime import datetime
+
+    days, starts, ends, owners = split_days(
+        [datetime(2030, 1, 1, 22), datetime(2030, 1, 2, 23)],
+        [datetime(2030, 1, 2, 1), datetime(2030, 1, 3)],
+    )
+
+    assert days == ["2030-01-01", "2030-01-02", "2030-01-02"]
+    assert starts == [22 * 60, 0, 23 * 60]
+    assert ends == [DAY_MINUTES, 60, DAY_MINUTES]
+    assert owners == [0, 0, 1]
+
+
+def test_all_day_events_do_not_take_columns():
+    days_events = layout_events(
+        [
+            all_day("holiday", "2030-01-01", "2030-01-02"),
+            timed("standup", "10:00", "11:00"),
+            timed("review", "10:30", "11:30"),
+        ]
+    )
+
+    boxes = {box.eventId: box for box in days_events["2030-01-01"]}
+    assert boxes["holiday"].all_day
+    assert (boxes["standup"].column, boxes["standup"].columns) == (0, 2)
+    assert (boxes["review"].column, boxes["review"].columns) == (1, 2)
+
+
+def test_all_day_events_cover_every_day_up_to_their_end():
+    days_events = layout_events([all_day("trip", "2030-01-01", "2030-01-03")])
+
+    assert sorted(days_events) == ["2030-01-01", "2030-01-02"]
+    assert all(box.all_day for boxes in days_events.values() for box in boxes)
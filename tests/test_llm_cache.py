@@ -0,0 +1,141 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from intervals import FreeBusyIndex
+from llm_cache import MemoryBackend, ResponseCache, prompt_key
+
+INQUIRY = json.dumps({"type": "inquiry", "message": "You are free all day."})
+
+
+class FakeGroq:
+    """Answers every completion with INQUIRY, counting the calls by kind."""
+
+    def __init__(self, content: str = INQUIRY):
+        self.content = content
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **params):
+        self.calls.append("stream" if params.get("stream") else "json")
+        if params.get("stream"):
+            # Without JSON mode the model may wrap the object in prose
+            text = f"Sure! {self.content} Anything else?"
+            return [
+                SimpleNamespace(
+                    choices=[SimpleNamespace(delta=SimpleNamespace(content=part))]
+                )
+                for part in (text[:10], text[10:])
+            ]
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=self.content))],
+            usage=None,
+        )
+
+
+@pytest.fixture
+def calendar(timecraft, monkeypatch):
+    """A calendar context the tests can change, served to the chat routes."""
+    context = {"text": "Events: standup at 10"}
+
+    def get_chat_context(chat_log, timezone="UTC", summary=""):
+        # The prompt ends with the new message only, as in a fresh conversation
+        return [
+            {"role": "system", "content": context["text"]},
+            chat_log[-1],
+        ], FreeBusyIndex([])
+
+    monkeypatch.setattr(timecraft, "get_chat_context", get_chat_context)
+    return context
+
+
+@pytest.fixture
+def groq(timecraft, monkeypatch):
+    fake = FakeGroq()
+    monkeypatch.setattr(timecraft, "groq", fake)
+    monkeypatch.setattr(timecraft, "llm_cache", ResponseCache(MemoryBackend()))
+    return fake
+
+
+def ask(client, message: str, route: str = "/chat") -> str:
+    response = client.post(route, json={"message": message})
+    if route == "/chat":
+        return response.get_json()["bot_response"]
+    events = [
+        json.loads(line[len("data: ") :])
+        for line in response.get_data(as_text=True).splitlines()
+        if line.startswith("data: ")
+    ]
+    return events[-1]["bot_response"]
+
+
+def test_same_prompt_is_answered_from_the_cache(timecraft, calendar, groq):
+    client = timecraft.app.test_client()
+
+    assert ask(client, "Am I free?") == "You are free all day."
+    assert ask(client, "Am  I free? ") == "You are free all day."
+
+    assert groq.calls == ["json"]
+    assert timecraft.llm_cache.stats()["hits"] == 1
+
+
+def test_different_wording_is_a_miss(timecraft, calendar, groq):
+    client = timecraft.app.test_client()
+
+    ask(client, "Am I free?")
+    ask(client, "Am I free tomorrow?")
+    ask(client, "am i free?")
+
+    assert groq.calls == ["json", "json", "json"]
+
+
+def test_calendar_change_invalidates_the_cached_response(timecraft, calendar, groq):
+    client = timecraft.app.test_client()
+
+    ask(client, "Am I free?")
+    calendar["text"] = "Events: standup at 10, lunch at 12"
+    ask(client, "Am I free?")
+
+    assert groq.calls == ["json", "json"]
+
+
+def test_streamed_response_does_not_answer_json_mode(timecraft, calendar, groq):
+    client = timecraft.app.test_client()
+
+    assert ask(client, "Am I free?", "/chat/stream") == "You are free all day."
+    assert ask(client, "Am I free?", "/chat") == "You are free all day."
+    assert ask(client, "Am I free?", "/chat/stream") == "You are free all day."
+
+    assert groq.calls == ["stream", "json"]
+
+
+def test_prompt_key_depends_on_call_parameters():
+    messages = [{"role": "user", "content": "Am I free?"}]
+
+    assert prompt_key("model", messages, stream=True) != prompt_key(
+        "model", messages, stream=False
+    )
+
+
+def stream_events(client, message: str) -> list:
+    response = client.post("/chat/stream", json={"message": message})
+    lines = response.get_data(as_text=True).splitlines()
+    return [
+        (event[len("event: ") :], json.loads(data[len("data: ") :]))
+        for event, data in zip(lines, lines[1:])
+        if event.startswith("event: ")
+    ]
+
+
+def test_escaped_non_ascii_message_streams_on_miss_and_hit(timecraft, calendar, groq):
+    groq.content = json.dumps({"type": "inquiry", "message": "한 🙂"})
+    client = timecraft.app.test_client()
+
+    for _ in range(2):
+        events = stream_events(client, "Say hi in Korean")
+
+        tokens = "".join(data["text"] for event, data in events if event == "token")
+        assert tokens == "한 🙂"
+        assert events[-1] == ("done", {"bot_response": "한 🙂", "refresh": False})
+    assert groq.calls == ["stream"]
@@ -0,0 +1,33 @@
+import time
+
+import httplib2
+
+from outbound import OutboundScheduler, PooledHttp
+
+
+def test_pooled_connections_keep_the_api_client_defaults(monkeypatch):
+    used = []
+    monkeypatch.setattr(
+        httplib2.Http, "request", lambda http, *args, **kwargs: used.append(http)
+    )
+    pool = PooledHttp()
+
+    pool.request("https://www.googleapis.com/calendar/v3/users/me/calendarList")
+    pool.request("https://www.googleapis.com/calendar/v3/users/me/calendarList")
+
+    assert used[0] is used[1]
+    assert used[0].timeout == 60
+    assert 308 not in used[0].redirect_codes
+    assert used[0].redirect_codes == httplib2.REDIRECT_CODES - {308}
+
+
+def test_project_rate_of_zero_admits_every_call_at_once():
+    scheduler = OutboundScheduler(project_rate=0)
+
+    started = time.monotonic()
+    for _ in range(100):
+        scheduler.acquire("user")
+        scheduler.release("user")
+
+    assert time.monotonic() - started < 1
+    assert scheduler.stats()["admitted_total"] == 100
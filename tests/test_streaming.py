@@ -0,0 +1,25 @@
+import json
+
+import pytest
+
+from main import JSONStringStreamer
+
+
+def stream(document: str, piece: int) -> str:
+    streamer = JSONStringStreamer()
+    return "".join(
+        streamer.feed(document[start : start + piece])
+        for start in range(0, len(document), piece)
+    )
+
+
+@pytest.mark.parametrize("piece", [1, 3, 7, 1000])
+@pytest.mark.parametrize("message", ["한국어", 'café "quoted"\n', "🙂 ok", "퀀"])
+def test_streamed_message_matches_the_parsed_one(message, piece):
+    document = json.dumps({"type": "inquiry", "message": message, "x": 1})
+
+    assert stream(document, piece) == message
+
+
+def test_invalid_escape_is_skipped():
+    assert stream('{"type": "inquiry", "message": "a\\uZZZZb"}', 4) == "ab"
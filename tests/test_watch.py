@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+class Stop(Exception):
+    pass
+
+
+class FakeChannels:
+    """Two expiring channels, the first of which cannot be renewed."""
+
+    def __init__(self):
+        self.channels = [
+            {"id": "broken", "owner": "user", "calendarId": "primary"},
+            {"id": "fine", "owner": "user", "calendarId": "work"},
+        ]
+        self.renewed = []
+        self.forgotten = []
+
+    def expiring(self, margin):
+        return list(self.channels)
+
+    def renew(self, service, channel):
+        if channel["id"] == "broken":
+            raise ConnectionResetError("connection reset")
+        self.renewed.append(channel["id"])
+
+    def forget(self, channel):
+        self.forgotten.append(channel["id"])
+
+
+def test_renewal_continues_past_an_unexpected_error(timecraft, monkeypatch):
+    channels = FakeChannels()
+    sleeps = []
+
+    def sleep(seconds):
+        # Run one round of renewals, then end the loop
+        if sleeps:
+            raise Stop()
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(timecraft, "watch_channels", channels)
+    monkeypatch.setattr(timecraft.time, "sleep", sleep)
+    monkeypatch.setattr(timecraft, "service_cache", {"user": {"service": None}})
+    monkeypatch.setattr(timecraft, "event_stores", {"user": SimpleNamespace(stores={})})
+
+    with pytest.raises(Stop):
+        timecraft.renew_channels()
+
+    assert channels.forgotten == ["broken"]
+    assert channels.renewed == ["fine"]
@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, List, Optional
+
+
+class Span:
+    """Times one operation and reports it to the tracer when it ends."""
+
+    __slots__ = ("tracer", "name", "started")
+
+    def __init__(self, tracer, name: str):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class NullSpan:
+    """Stands in for Span when tracing is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    """
+    Records timed spans and counters, per request and aggregated.
+
+    Aggregates keep the most recent SAMPLE_SIZE durations of every span name
+    for percentiles, plus running counts and sums.
+    """
+
+    SAMPLE_SIZE = 1024
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, enabled: bool = True, current_spans: Optional[Callable] = None):
+        """
+        Args:
+            enabled: Whether spans are recorded at all
+            current_spans: Function returning the span list of the current
+                request, or None outside of a request
+        """
+        self.enabled = enabled
+        self.current_spans = current_spans
+        self._samples = defaultdict(lambda: deque(maxlen=self.SAMPLE_SIZE))
+        self._counts = defaultdict(int)
+        self._sums = defaultdict(float)
+        self._counters = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def span(self, name: str):
+        """
+        Time a block of code.
+
+        Args:
+            name: Name of the operation, e.g. "calendar.events.list"
+
+        Returns:
+            Context manager timing the block
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        Record a finished span.
+
+        Args:
+            name: Name of the operation
+            seconds: Duration of the operation
+        """
+        with self._lock:
+            self._samples[name].append(seconds)
+            self._counts[name] += 1
+            self._sums[name] += seconds
+
+        spans = self.current_spans() if self.current_spans else None
+        if spans is not None:
+            spans.append((name, seconds))
+
+    def count(self, name: str, value: float = 1) -> None:
+        """
+        Add to a counter.
+
+        Args:
+            name: Name of the counter
+            value: Amount to add
+        """
+        if self.enabled:
+            with self._lock:
+                self._counters[name] += value
+
+    def percentiles(self) -> Dict[str, Dict]:
+        """
+        Get the aggregated span durations.
+
+        Returns:
+            Dictionary mapping span names to their count, sum, and a dictionary
+            of quantiles over the recent samples
+        """
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            counts = dict(self._counts)
+            sums = dict(self._sums)
+
+        return {
+            name: {
+                "count": counts[name],
+                "sum": sums[name],
+                "quantiles": {
+                    quantile: values[min(int(quantile * len(values)), len(values) - 1)]
+                    for quantile in self.QUANTILES
+                },
+            }
+            for name, values in samples.items()
+        }
+
+    def counters(self) -> Dict[str, float]:
+        """Get the current value of every counter."""
+        with self._lock:
+            return dict(self._counters)
+
+
+def server_timing(spans: List[tuple]) -> str:
+    """
+    Format the spans of a request as a Server-Timing header value.
+
+    Args:
+        spans: List of (name, seconds) tuples
+
+    Returns:
+        Header value with one metric per span name, repeated spans summed
+    """
+    totals = {}
+    calls = defaultdict(int)
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+        calls[name] += 1
+
+    metrics = []
+    for name, seconds in totals.items():
+        metric = f"{name};dur={seconds * 1000:.1f}"
+        if calls[name] > 1:
+            metric += f';desc="{calls[name]} calls"'
+        metrics.append(metric)
+    return ", ".join(metrics)
+
+
+def prometheus_text(
+    tracer: Tracer, prefix: str, gauges: Dict[str, float] = None
+) -> str:
+    """
+    Render the tracer's aggregates in the Prometheus text exposition format.
+
+    Args:
+        tracer: Tracer to export
+        prefix: Prefix of every metric name
+        gauges: Additional values, e.g. cache counters, keyed by metric name
+
+    Returns:
+        Exposition text
+    """
+    lines = [
+        f"# HELP {prefix}_span_seconds Duration of traced operations.",
+        f"# TYPE {prefix}_span_seconds summary",
+    ]
+    for name, aggregate in sorted(tracer.percentiles().items()):
+        label = f'span="{name}"'
+        for quantile, seconds in aggregate["quantiles"].items():
+            lines.append(
+                f'{prefix}_span_seconds{{{label},quantile="{quantile}"}} {seconds:.6f}'
+            )
+        lines.append(f"{prefix}_span_seconds_sum{{{label}}} {aggregate['sum']:.6f}")
+        lines.append(f"{prefix}_span_seconds_count{{{label}}} {aggregate['count']}")
+
+    for name, value in sorted(tracer.counters().items()):
+        lines.append(f"# TYPE {prefix}_{name} counter")
+        lines.append(f"{prefix}_{name} {value:g}")
+
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value:g}")
+    return "\n".join(lines) + "\n"
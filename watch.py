@@ -0,0 +1,254 @@
+import hmac
+import queue
+import secrets
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+
+class WatchChannels:
+    """
+    Calendar push notification channels, opened with events().watch.
+
+    Every channel carries a random token which Google sends back with each
+    notification, so forged notifications can be rejected. Channels expire
+    after their TTL and have to be renewed by opening a new one.
+    """
+
+    # Seconds before opening a channel is tried again after it failed, e.g.
+    # for calendars which do not support push notifications
+    RETRY_AFTER = 3600
+
+    def __init__(self, address: str, ttl: int = 6 * 3600):
+        """
+        Args:
+            address: HTTPS URL Google posts notifications to
+            ttl: Seconds a channel lives before it has to be renewed
+        """
+        self.address = address
+        self.ttl = ttl
+        self._channels = {}
+        self._pending = set()
+        self._failed = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, owner: str, calendar_id: str) -> bool:
+        """
+        Claim the right to open a channel for a calendar of a user.
+
+        Args:
+            owner: Session identity of the user
+            calendar_id: ID of the calendar
+
+        Returns:
+            Whether the caller should open the channel, False if one is open,
+            being opened, or failed recently
+        """
+        key = (owner, calendar_id)
+        with self._lock:
+            if key in self._pending or any(
+                (channel["owner"], channel["calendarId"]) == key
+                for channel in self._channels.values()
+            ):
+                return False
+            if time.time() - self._failed.get(key, 0) < self.RETRY_AFTER:
+                return False
+            self._pending.add(key)
+            return True
+
+    def open(self, service, owner: str, calendar_id: str) -> Dict:
+        """
+        Open a channel for a calendar of a user.
+
+        Args:
+            service: Google Calendar service of the user
+            owner: Session identity of the user
+            calendar_id: ID of the calendar
+
+        Returns:
+            The channel
+        """
+        key = (owner, calendar_id)
+        channel_id = uuid.uuid4().hex
+        token = secrets.token_urlsafe(24)
+        try:
+            response = (
+                service.events()
+                .watch(
+                    calendarId=calendar_id,
+                    body={
+                        "id": channel_id,
+                        "type": "web_hook",
+                        "address": self.address,
+                        "token": token,
+                        "params": {"ttl": str(self.ttl)},
+                    },
+                )
+                .execute()
+            )
+        except Exception:
+            with self._lock:
+                self._pending.discard(key)
+                self._failed[key] = time.time()
+            raise
+
+        expiration = response.get("expiration")
+        channel = {
+            "id": channel_id,
+            "token": token,
+            "owner": owner,
+            "calendarId": calendar_id,
+            "resourceId": response["resourceId"],
+            # Google reports the expiration in milliseconds
+            "expiration": (
+                int(expiration) / 1000 if expiration else time.time() + self.ttl
+            ),
+        }
+        with self._lock:
+            self._pending.discard(key)
+            self._failed.pop(key, None)
+            self._channels[channel_id] = channel
+        return channel
+
+    def renew(self, service, channel: Dict) -> Dict:
+        """
+        Replace a channel which is about to expire.
+
+        The new channel is opened before the old one is stopped, so no change
+        goes unnoticed in between.
+
+        Args:
+            service: Google Calendar service of the channel's user
+            channel: Channel to replace
+
+        Returns:
+            The new channel
+        """
+        renewed = self.open(service, channel["owner"], channel["calendarId"])
+        self.stop(service, channel)
+        return renewed
+
+    def stop(self, service, channel: Dict) -> None:
+        """
+        Stop a channel, so Google sends no more notifications for it.
+
+        Args:
+            service: Google Calendar service of the channel's user
+            channel: Channel to stop
+        """
+        self.forget(channel)
+        service.channels().stop(
+            body={"id": channel["id"], "resourceId": channel["resourceId"]}
+        ).execute()
+
+    def forget(self, channel: Dict) -> None:
+        """Drop a channel without stopping it, it lapses when it expires."""
+        with self._lock:
+            self._channels.pop(channel["id"], None)
+
+    def get(self, channel_id: str) -> Optional[Dict]:
+        """Get an open channel by its ID."""
+        with self._lock:
+            return self._channels.get(channel_id)
+
+    def verify(self, channel: Dict, token: Optional[str]) -> bool:
+        """Return whether a notification's token matches its channel."""
+        return hmac.compare_digest(channel["token"], token or "")
+
+    def watching(self, owner: str, calendar_id: str) -> bool:
+        """Return whether a calendar of a user has an open channel."""
+        with self._lock:
+            return any(
+                channel["owner"] == owner and channel["calendarId"] == calendar_id
+                for channel in self._channels.values()
+            )
+
+    def owned_by(self, owner: str) -> List[Dict]:
+        """Get the open channels of a user."""
+        with self._lock:
+            return [
+                channel
+                for channel in self._channels.values()
+                if channel["owner"] == owner
+            ]
+
+    def expiring(self, margin: float) -> List[Dict]:
+        """Get the channels expiring within margin seconds."""
+        deadline = time.time() + margin
+        with self._lock:
+            return [
+                channel
+                for channel in self._channels.values()
+                if channel["expiration"] < deadline
+            ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._channels)
+
+
+class ChangeFeed:
+    """
+    Messages to the open push streams of each user.
+
+    Every stream has a small queue. A stream which falls behind misses
+    messages, which is fine as each one carries the complete current state.
+    """
+
+    QUEUE_SIZE = 16
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, owner: str) -> queue.Queue:
+        """
+        Open a stream for a user.
+
+        Args:
+            owner: Session identity of the user
+
+        Returns:
+            Queue receiving the messages published to the user
+        """
+        stream = queue.Queue(maxsize=self.QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[owner].add(stream)
+        return stream
+
+    def unsubscribe(self, owner: str, stream: queue.Queue) -> None:
+        """Close a stream opened by subscribe."""
+        with self._lock:
+            streams = self._subscribers.get(owner)
+            if streams is not None:
+                streams.discard(stream)
+                if not streams:
+                    del self._subscribers[owner]
+
+    def publish(self, owner: str, message: Dict) -> int:
+        """
+        Send a message to every open stream of a user.
+
+        Args:
+            owner: Session identity of the user
+            message: JSON-serializable message
+
+        Returns:
+            Number of streams the message was queued on
+        """
+        with self._lock:
+            streams = list(self._subscribers.get(owner, ()))
+        delivered = 0
+        for stream in streams:
+            try:
+                stream.put_nowait(message)
+                delivered += 1
+            except queue.Full:
+                pass
+        return delivered
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(streams) for streams in self._subscribers.values())